@@ -1,32 +1,111 @@
 """Перезапуск функций в случае исключения."""
 
+import random
+import threading
 import time
+from collections import deque
 from functools import wraps
-from typing import Any, Callable, TypeVar, Union
+from typing import Any, Callable, Optional, TypeVar, Union
+
+import metrics
 
 F = TypeVar('F', bound=Callable[..., Any])
 
 
+class RetryBudget:
+    """Ограничение числа повторов за скользящее окно времени.
+
+    Один бюджет можно разделить между несколькими функциями: если
+    за period секунд повторов было больше retries, следующие ошибки
+    не повторяются, а пробрасываются дальше.  Так долгий сбой не
+    превращается в бесконечный поток повторов.  Безопасен для
+    использования из нескольких потоков.
+    """
+
+    def __init__(self, retries: int, period: float):
+        """Проинициализировать бюджет.
+
+        Args:
+            retries: Сколько повторов разрешено за окно.
+            period: Длина окна в секундах.
+        """
+        self.retries = retries
+        self.period = period
+        self._spent: deque[float] = deque()
+        self._lock = threading.Lock()
+
+    def spend(self) -> bool:
+        """Потратить один повтор из бюджета.
+
+        Returns:
+            Истина, если повтор разрешен.
+        """
+        now = time.monotonic()
+        with self._lock:
+            while self._spent and self._spent[0] <= now - self.period:
+                self._spent.popleft()
+            if len(self._spent) >= self.retries:
+                return False
+            self._spent.append(now)
+            return True
+
+
+def backoff_delay(
+        attempt: int,
+        start_sleep_time: Union[int, float] = 0.1,
+        factor: Union[int, float] = 2,
+        border_sleep_time: Union[int, float] = 10,
+        jitter: bool = True,
+        ) -> float:
+    """Посчитать паузу перед повтором.
+
+    Формула:
+        t = start_sleep_time * factor^(attempt - 1) if t < border_sleep_time
+        t = border_sleep_time if t >= border_sleep_time
+
+    С jitter пауза выбирается случайно между t / 2 и t, чтобы
+    несколько реплик ETL после общего сбоя не повторяли запросы
+    одновременно.
+
+    Args:
+        attempt: Номер повтора, начиная с 1.
+        start_sleep_time: Начальное время повтора.
+        factor: Во сколько раз нужно увеличить время ожидания.
+        border_sleep_time: Граничное время ожидания.
+        jitter: Добавить случайный разброс.
+
+    Returns:
+        Пауза в секундах.
+    """
+    sleep_time = min(
+        start_sleep_time * factor ** (attempt - 1), border_sleep_time,
+    )
+    if jitter:
+        sleep_time = sleep_time / 2 + random.uniform(0, sleep_time / 2)
+    return sleep_time
+
+
 def backoff(
         exceptions: tuple,
         start_sleep_time: Union[int, float] = 0.1,
         factor: Union[int, float] = 2,
         border_sleep_time: Union[int, float] = 10,
+        jitter: bool = True,
+        budget: Optional[RetryBudget] = None,
         ) -> Callable[[F], F]:
     """Перезапускает функцию в ответ на исключения от нее.
 
-    Использует наивный экспоненциальный рост времени
-    повтора (factor) до граничного времени ожидания (border_sleep_time).
-
-    Формула:
-        t = start_sleep_time * 2^(n) if t < border_sleep_time
-        t = border_sleep_time if t >= border_sleep_time
+    Использует экспоненциальный рост времени повтора (factor) до
+    граничного времени ожидания (border_sleep_time), см. backoff_delay.
 
     Args:
         exceptions: В ответ на какие исключения перезапускать функцию.
         start_sleep_time: Начальное время повтора.
         factor: Во сколько раз нужно увеличить время ожидания.
         border_sleep_time: Граничное время ожидания.
+        jitter: Добавлять к паузе случайный разброс.
+        budget: Общий бюджет повторов.  Когда он исчерпан,
+            исключение пробрасывается дальше.
 
     Returns:
         Результат выполнения функции.
@@ -34,14 +113,21 @@ def backoff(
     def func_wrapper(func: Callable[[F], F]) -> Callable[[F], F]:
         @wraps(func)
         def inner(*args, **kwargs):
-            sleep_time = start_sleep_time
+            attempt = 0
             while True:
                 try:
                     return func(*args, **kwargs)
-                except exceptions:
-                    sleep_time = sleep_time * factor
-                    if sleep_time > border_sleep_time:
-                        sleep_time = border_sleep_time
-                    time.sleep(sleep_time)
+                except exceptions as error:
+                    if budget and not budget.spend():
+                        raise
+                    metrics.BACKOFF_RETRIES.inc(
+                        function=func.__qualname__,
+                        exception=type(error).__name__,
+                    )
+                    attempt += 1
+                    time.sleep(backoff_delay(
+                        attempt, start_sleep_time, factor, border_sleep_time,
+                        jitter,
+                    ))
         return inner
     return func_wrapper
@@ -0,0 +1,61 @@
+from unittest import TestCase, main
+
+from availability.backoff import RetryBudget, backoff, backoff_delay
+
+
+class TestBackoffDelay(TestCase):
+
+    def test_grows_up_to_border(self):
+        delays = [
+            backoff_delay(attempt, 1, 2, 5, jitter=False)
+            for attempt in range(1, 6)
+        ]
+        self.assertEqual([1, 2, 4, 5, 5], delays)
+
+    def test_jitter_keeps_half_of_delay(self):
+        for _ in range(100):
+            delay = backoff_delay(3, 1, 2, 10)
+            self.assertGreaterEqual(delay, 2)
+            self.assertLessEqual(delay, 4)
+
+
+class TestRetryBudget(TestCase):
+
+    def test_limits_retries_in_period(self):
+        budget = RetryBudget(2, 60)
+        spent = [budget.spend() for _ in range(3)]
+        self.assertEqual([True, True, False], spent)
+
+    def test_frees_retries_after_period(self):
+        budget = RetryBudget(1, 0)
+        self.assertTrue(budget.spend())
+        self.assertTrue(budget.spend())
+
+
+class TestBackoff(TestCase):
+
+    def failing(self, failures, **kwargs):
+        calls = []
+
+        @backoff((ValueError,), start_sleep_time=0, **kwargs)
+        def func():
+            calls.append(1)
+            if len(calls) <= failures:
+                raise ValueError
+            return len(calls)
+
+        return func, calls
+
+    def test_retries_until_success(self):
+        func, _ = self.failing(3)
+        self.assertEqual(4, func())
+
+    def test_raises_when_budget_is_spent(self):
+        func, calls = self.failing(5, budget=RetryBudget(2, 60))
+        with self.assertRaises(ValueError):
+            func()
+        self.assertEqual(3, len(calls))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,11 +1,13 @@
 """Сбор информации о жанрах из базы данных Postgresql."""
 
-from typing import Generator
+from typing import Generator, Union
+
 from psycopg2.extras import RealDictRow
 
+from storage import Checkpoint
 from transform.db_objects import Genre
 
-from .postgres_loader import EPOCH, PostgresLoader
+from .postgres_loader import INFINITY, START, Keyset, PostgresLoader
 
 
 class StateKeys:
@@ -13,77 +15,103 @@ class StateKeys:
 
     FILM_WORK = 'genre_film_work_since'
     GENRE = 'genre_genre_since'
+    CHANGE_LOG = 'genre_change_log_since'
 
 
 class PostgresGenreLoader(PostgresLoader):
     """Класс, загружающий жанры из PostgreSQL."""
 
     es_index = 'genres'
+    table = 'genre'
+    source_tables = ('genre', 'film_work', 'genre_film_work')
     validator = Genre
-
-    def load_all(self) -> Generator[RealDictRow, None, None]:
+    change_log_key = StateKeys.CHANGE_LOG
+    watermark_keys = (StateKeys.FILM_WORK, StateKeys.GENRE)
+    film_link = ('genre_film_work', 'genre_id')
+    # Тот же документ, что собирает Genre.as_document.
+    document_sql = """
+        json_build_object(
+            'id', objects.id,
+            'name', objects.name,
+            'description', objects.description,
+            'film_ids', objects.film_ids
+        )
+    """
+
+    def load_all(self) -> Generator[Union[RealDictRow, Checkpoint], None, None]:
         """Получить все обновленные и новые жанры.
 
         Yields:
             Строка базы данных с информацией о жанре.
+            Отметка состояния после каждой связки объектов.
         """
         # При добавлении/удалении жанра у фильма в базе, меняется
         # film_work.modified.  И в ответ на добавление/удаление жанра
         # у фильма, нужно обновить список фильмов у жарнра в индексе
         # genre.
-        film_work_since = self.state.get_state(StateKeys.FILM_WORK) or EPOCH
-        for ids, film_work_since in self.ids_for_film_work_since(film_work_since):
-            yield from self.get_genres(ids)
-            self.state.set_state(StateKeys.FILM_WORK, film_work_since)
+        # Правки, сделанные после начала цикла, достанутся следующему
+        # циклу.  Поэтому объект, уже загруженный в этом цикле, можно
+        # пропускать в остальных потоках изменений.
+        until = self._now()
+        seen = set()
+        film_work_since = self._keyset(self.state.get_state(StateKeys.FILM_WORK))
+        for ids, film_work_since in self.ids_for_film_work_since(film_work_since, until):
+            if ids := self._unseen(ids, seen):
+                yield from self.get_genres(ids)
+            yield Checkpoint(StateKeys.FILM_WORK, film_work_since)
+
+        genre_since = self._keyset(self.state.get_state(StateKeys.GENRE))
+        for ids, genre_since in self.ids_for_genre_since(genre_since, until):
+            if ids := self._unseen(ids, seen):
+                yield from self.get_genres(ids)
+            yield Checkpoint(StateKeys.GENRE, genre_since)
+
+    def ids_for_genre_since(
+            self, since: Keyset = START, until: str = INFINITY,
+            ) -> Generator[tuple[tuple[str], Keyset], None, None]:
+        """Получить ID жанров, отредактированных после курсора since.
+
+        Args:
+            since: Курсор (modified, id) последней обработанной строки.
+            until: Не учитывать правки, сделанные начиная с until.
 
-        genre_since = self.state.get_state(StateKeys.GENRE) or EPOCH
-        for ids, genre_since in self.ids_for_genre_since(genre_since):
-            yield from self.get_genres(ids)
-            self.state.set_state(StateKeys.GENRE, genre_since)
+        Yields:
+            Список ID жанров и курсор последней из них.
+        """
+        yield from self._changed_since('genre', since, until)
 
-    def ids_for_genre_since(self, since: str = EPOCH) -> Generator[tuple[tuple[str], str], None, None]:
-        """Получить ID жанров, отредактированных с указанного момента.
+    def ids_for_film_work_since(
+            self, since: Keyset = START, until: str = INFINITY,
+            ) -> Generator[tuple[tuple[str], Keyset], None, None]:
+        """Получить ID жанров, у которых изменились фильмы.
 
         Args:
-            since: Получить жанры, измененные после since.
+            since: Курсор последней обработанной строки film_work.
+            until: Не учитывать правки, сделанные начиная с until.
 
         Yields:
-            Список ID жанров и самое раннее время правки этих жанров.
+            Список ID жанров и курсор строки film_work, до которой
+            изменения уже обработаны.
         """
         sql = """
-            SELECT
-                genre.id,
-                genre.modified
-            FROM genre
-            WHERE genre.modified >= %s
-            ORDER BY genre.modified, genre.id;
+            SELECT DISTINCT gfw.genre_id AS id
+            FROM genre_film_work gfw
+            WHERE gfw.film_work_id IN %s
+            ORDER BY id;
         """
-        values = (since,)
-        bunches = self._bunchify(self._execute_sql(sql, values))
-        yield from self._split_bunch(bunches)
+        changes = self._changed_since('film_work', since, until)
+        yield from self._with_related(changes, since, sql)
 
-    def ids_for_film_work_since(self, since: str = EPOCH) -> Generator[tuple[tuple[str], str], None, None]:
-        """Получить ID жанров у изменённых фильмов.
+    def get_objects(self, ids: tuple[str]) -> Generator[RealDictRow, None, None]:
+        """Получить жанров с указанными ID.
 
         Args:
-            since: Получить жанры по фильмам, изменённым после since.
+            ids: Список ID жанров.
 
         Yields:
-            Список ID жанров и самое раннее время правки фильма этих жанров.
-        """
-        sql = """
-            SELECT
-                gfw.genre_id,
-                min(fw.modified) min_modified
-            FROM film_work fw
-            INNER JOIN genre_film_work gfw ON fw.id = gfw.film_work_id
-            WHERE fw.modified >= %s
-            GROUP BY gfw.genre_id
-            ORDER BY min_modified, gfw.genre_id;
+            Информация о жанре в виде строки БД.
         """
-        values = (since,)
-        bunches = self._bunchify(self._execute_sql(sql, values))
-        yield from self._split_bunch(bunches)
+        yield from self.get_genres(ids)
 
     def get_genres(self, ids: tuple[str]) -> Generator[RealDictRow, None, None]:
         """Получить жанры с указанными ID.
@@ -100,15 +128,68 @@ class PostgresGenreLoader(PostgresLoader):
                 genre.name,
                 genre.description,
                 COALESCE(
-                    JSON_AGG(DISTINCT gfw.film_work_id),
-                    '{}'
+                    JSON_AGG(DISTINCT gfw.film_work_id)
+                        FILTER (WHERE gfw.film_work_id IS NOT NULL),
+                    '[]'
                 ) as film_ids
             FROM genre
             LEFT JOIN genre_film_work gfw ON gfw.genre_id = genre.id
             WHERE genre.id IN %s
             GROUP BY genre.id
-            ORDER BY genre.modified;
+            ORDER BY genre.modified, genre.id;
         """
         values = (tuple(ids),)
-        rows = self._execute_sql(sql, values)
+        rows = self._execute_objects_sql(sql, values)
         yield from rows
+
+    def get_film_ids_deltas(
+            self, ids: list[str], film_ids: list[str],
+            ) -> Generator[RealDictRow, None, None]:
+        """Получить жанры с изменениями их списков фильмов.
+
+        Args:
+            ids: ID жанров.
+            film_ids: ID фильмов, связь с которыми у жанра с тем же
+                номером в ids могла появиться или пропасть.
+
+        Yields:
+            Информация о жанре в виде строки БД, где film_ids - фильмы,
+            связанные с жанром, removed - фильмы, с которыми жанр
+            больше не связан, а all_film_ids - все фильмы жанра.
+        """
+        sql = """
+            WITH pairs AS (
+                SELECT
+                    p.genre_id,
+                    p.film_work_id,
+                    EXISTS (
+                        SELECT 1
+                        FROM genre_film_work gfw
+                        WHERE gfw.genre_id = p.genre_id
+                            AND gfw.film_work_id = p.film_work_id
+                    ) AS linked
+                FROM unnest(%s::uuid[], %s::uuid[]) AS p(genre_id, film_work_id)
+            )
+            SELECT
+                genre.id,
+                genre.name,
+                genre.description,
+                COALESCE(
+                    JSON_AGG(pairs.film_work_id) FILTER (WHERE pairs.linked),
+                    '[]'
+                ) as film_ids,
+                COALESCE(
+                    JSON_AGG(pairs.film_work_id) FILTER (WHERE NOT pairs.linked),
+                    '[]'
+                ) as removed,
+                (
+                    SELECT COALESCE(JSON_AGG(DISTINCT gfw.film_work_id), '[]')
+                    FROM genre_film_work gfw
+                    WHERE gfw.genre_id = genre.id
+                ) as all_film_ids
+            FROM pairs
+            JOIN genre ON genre.id = pairs.genre_id
+            GROUP BY genre.id
+            ORDER BY genre.id;
+        """
+        yield from self._execute_sql(sql, (ids, film_ids))
@@ -0,0 +1,78 @@
+"""Ожидание уведомлений PostgreSQL об изменении данных."""
+
+import logging
+import select
+import time
+
+from psycopg2 import sql
+from psycopg2.extensions import connection as pg_connection
+
+
+class PostgresListener:
+    """Подписчик на канал LISTEN/NOTIFY PostgreSQL.
+
+    Триггеры из postgres/etl_notify.sql шлют в канал имя таблицы,
+    в которой изменились данные.  Подписчик ждет уведомлений и
+    возвращает множество измененных таблиц.
+    """
+
+    def __init__(
+            self,
+            connection: pg_connection,
+            channel: str,
+            debounce: float = 0.5,
+            ):
+        """Проинициализировать подписчика.
+
+        Args:
+            connection: Отдельное подключение к PostgreSQL в autocommit.
+            channel: Имя канала уведомлений.
+            debounce: Сколько секунд после первого уведомления собирать
+                остальные, чтобы пачка правок вызвала одну загрузку.
+        """
+        self.connection = connection
+        self.channel = channel
+        self.debounce = debounce
+
+    def listen(self) -> None:
+        """Подписаться на канал уведомлений."""
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                sql.SQL('LISTEN {};').format(sql.Identifier(self.channel)),
+            )
+        logging.info(f'Listening to {self.channel} notifications.')
+
+    def wait(self, timeout: float) -> set[str]:
+        """Дождаться уведомлений об изменениях.
+
+        Args:
+            timeout: Сколько секунд ждать первого уведомления.
+
+        Returns:
+            Имена измененных таблиц или пустое множество, если
+            за timeout уведомлений не было.
+        """
+        tables = self._poll(timeout)
+        if not tables:
+            return tables
+        deadline = time.monotonic() + self.debounce
+        while (left := deadline - time.monotonic()) > 0:
+            tables |= self._poll(left)
+        return tables
+
+    def _poll(self, timeout: float) -> set[str]:
+        """Забрать уведомления, пришедшие за timeout секунд.
+
+        Args:
+            timeout: Сколько секунд ждать уведомлений.
+
+        Returns:
+            Имена таблиц из полученных уведомлений.
+        """
+        if not self.connection.notifies:
+            readable, _, _ = select.select([self.connection], [], [], timeout)
+            if readable:
+                self.connection.poll()
+        tables = {notify.payload for notify in self.connection.notifies}
+        self.connection.notifies.clear()
+        return tables
@@ -1,16 +1,39 @@
 """Подключение и чтение из PostgreSQL."""
 
+import itertools
 import logging
+import time
 from collections.abc import Iterable
 from contextlib import contextmanager
-from typing import Generator
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Generator, Optional, Union
 
 import psycopg2
 from psycopg2.extensions import connection as pg_connection
 from psycopg2.extras import RealDictCursor, RealDictRow
-from storage import State
+from psycopg2.pool import ThreadedConnectionPool
+
+import metrics
+import profiling
+from availability.backoff import backoff_delay
+from storage import Checkpoint, State
 
 EPOCH = '1970-01-01'
+INFINITY = 'infinity'
+NIL_ID = '00000000-0000-0000-0000-000000000000'
+# Курсор (modified, id), с которого начинается загрузка с нуля.
+START = (EPOCH, NIL_ID)
+
+Keyset = tuple[str, str]
+
+# Курсор (txid, seq) начала журнала изменений content.etl_change_log.
+CHANGE_LOG_START = (0, 0)
+# Сколько записей журнала изменений обрабатывать за раз.
+CHANGE_LOG_BUNCH_SIZE = 1000
+
+# Счетчик для уникальных имен серверных курсоров в рамках процесса.
+_cursor_ids = itertools.count()
 
 
 def create_connection(dsl: dict) -> pg_connection:
@@ -43,46 +66,645 @@ def postgres_connection(dsl: dict) -> Generator[pg_connection, None, None]:
     connection.close()
 
 
+def purge_change_log(
+        connection: pg_connection, up_to: tuple[int, int], batch_size: int = 10000,
+        ) -> int:
+    """Удалить прочитанные записи журнала изменений.
+
+    Удаляет порциями, чтобы не держать долгих блокировок.
+
+    Args:
+        connection: Подключение к PostgreSQL.
+        up_to: Курсор (txid, seq) последней записи, прочитанной всеми
+            индексами.
+        batch_size: Сколько записей удалять за один запрос.
+
+    Returns:
+        Число удаленных записей.
+    """
+    sql = """
+        DELETE FROM content.etl_change_log
+        WHERE seq IN (
+            SELECT seq
+            FROM content.etl_change_log
+            WHERE (txid, seq) <= (%s, %s)
+            ORDER BY txid, seq
+            LIMIT %s
+        );
+    """
+    deleted = 0
+    with connection.cursor() as cursor:
+        while True:
+            cursor.execute(sql, (*up_to, batch_size))
+            deleted += cursor.rowcount
+            if cursor.rowcount < batch_size:
+                return deleted
+
+
+@dataclass(frozen=True)
+class Deleted:
+    """Отметка в потоке строк: объекта с таким ID больше нет в PostgreSQL."""
+
+    id: str
+
+
+@dataclass(frozen=True)
+class FilmIdsDelta:
+    """Отметка в потоке строк: у объекта изменился список фильмов.
+
+    Вместо полного документа в ElasticSearch отправляется частичное
+    обновление: фильмы из row['film_ids'] добавляются в документ,
+    фильмы из removed удаляются из него, остальные поля row
+    перезаписываются.  Если документа в индексе нет, он создается
+    с полным списком фильмов film_ids.
+    """
+
+    row: RealDictRow
+    removed: tuple[str, ...]
+    film_ids: tuple[str, ...]
+
+
+@contextmanager
+def postgres_pool(
+        dsl: dict, size: int,
+        ) -> Generator[ThreadedConnectionPool, None, None]:
+    """Создает пул подключений к PostgreSQL, который закроет на выходе.
+
+    Args:
+        dsl: Настройки подключения к базе данных.
+        size: Наибольшее число подключений в пуле.
+
+    Yields:
+        Пул подключений к PostgreSQL.
+    """
+    pool = ThreadedConnectionPool(1, size, **dsl, cursor_factory=RealDictCursor)
+    logging.info('Connected to postgresql with a pool of %s.', size)
+    yield pool
+    pool.closeall()
+
+
+@contextmanager
+def pooled_connection(
+        pool: ThreadedConnectionPool,
+        ) -> Generator[pg_connection, None, None]:
+    """Взять подключение из пула и вернуть его обратно на выходе.
+
+    Args:
+        pool: Пул подключений к PostgreSQL.
+
+    Yields:
+        Подключение к PostgreSQL.
+    """
+    connection = pool.getconn()
+    try:
+        connection.set_session(autocommit=True)
+        yield connection
+    finally:
+        # Сломанное подключение не возвращать в оборот.
+        pool.putconn(connection, close=bool(connection.closed))
+
+
 class PostgresLoader:
     """Класс, загружающий объекты из PostgreSQL."""
 
-    def __init__(self, connection: pg_connection, state: State):
+    # Индекс ElasticSearch, в который идут документы загрузчика.
+    es_index: Optional[str] = None
+    # Таблица, каждая строка которой - документ индекса.
+    table: Optional[str] = None
+    # Таблицы, изменения в которых затрагивают документы индекса.
+    source_tables: tuple[str, ...] = ()
+    # Ключ состояния с курсором журнала изменений.
+    change_log_key: Optional[str] = None
+    # Ключи состояния с курсорами (modified, id) сканирования таблиц.
+    watermark_keys: tuple[str, ...] = ()
+    # Таблица связей с фильмами и ее колонка с ID объекта индекса,
+    # если у документов индекса есть film_ids.
+    film_link: Optional[tuple[str, str]] = None
+    # Выражение SQL, которое собирает документ индекса из колонок
+    # строки objects, выбранной get_objects.
+    document_sql: Optional[str] = None
+
+    def __init__(
+            self, connection: pg_connection, state: State,
+            itersize: int = 1000,
+            film_ids_deltas: bool = False,
+            pass_through: bool = False,
+            validate_every: int = 1,
+            bunch_size: int = 100,
+            dsl: Optional[dict] = None,
+            reconnect_attempts: int = 3,
+            ):
         """Проинициализировать соединение и состояние.
 
         Args:
             connection: Подключение к PostgreSQL.
             state: Хранилище, для сохранения состояния импорта объектов.
+            itersize: Сколько строк забирать с сервера за одно обращение.
+            film_ids_deltas: Обновлять film_ids по изменениям связей
+                из журнала, а не собирать документ заново.
+            pass_through: Собирать документы в PostgreSQL: вместо
+                строк объектов выдавать строки с id и готовым JSON
+                документа в колонке document.
+            validate_every: Проверять валидатором каждую validate_every
+                строку, а остальные строки, которые приходят из нашего
+                же SQL, считать корректными.  0 - не проверять совсем.
+            bunch_size: Сколько ID объектов выбирать одним запросом.
+                Можно менять на ходу, чтобы извлечение подстраивалось
+                под размер bulk-запросов в ElasticSearch.
+            dsl: Настройки подключения к базе данных.  С ними при
+                обрыве подключения загрузчик переподключается сам и
+                продолжает прерванный запрос.
+            reconnect_attempts: Сколько раз подряд переподключаться.
         """
         self.connection = connection
         self.state = state
+        self.itersize = itersize
+        self.film_ids_deltas = film_ids_deltas and self.film_link is not None
+        self.pass_through = pass_through and self.document_sql is not None
+        self.validate_every = validate_every
+        self.bunch_size = bunch_size
+        self.dsl = dsl
+        self.reconnect_attempts = reconnect_attempts
+        self._rows_count = 0
+        # Подключение, созданное самим загрузчиком при переподключении.
+        self._own_connection = None
+
+    def load_all(self) -> Generator[Union[RealDictRow, Checkpoint], None, None]:
+        """Получить объекты индекса, измененные с прошлой загрузки.
+
+        Yields:
+            Информация об объекте в виде строки БД или отметка о
+            сохраненном состоянии загрузки.
+        """
+        raise NotImplementedError
+
+    def to_document(self, row: RealDictRow) -> dict:
+        """Преобразовать строку БД в документ ElasticSearch.
+
+        Строки, которые не попали в выборку для проверки, собираются
+        через construct без проверки и приведения типов.  Документ от
+        этого не меняется: значения, которые валидатор привел бы к
+        UUID, сериализуются в те же строки.
+
+        Args:
+            row: Строка БД с информацией об объекте.
+
+        Returns:
+            Документ ElasticSearch в виде dict.
+
+        Raises:
+            ValidationError: Если проверенная строка некорректна.
+        """
+        validate = (
+            self.validate_every
+            and self._rows_count % self.validate_every == 0
+        )
+        self._rows_count += 1
+        if validate:
+            with profiling.span('transform.validate'):
+                obj = self.validator(**row)
+        else:
+            with profiling.span('transform.construct'):
+                obj = self.validator.construct(**row)
+        with profiling.span('transform.as_document'):
+            return obj.as_document()
+
+    def build_document(self, row: RealDictRow) -> dict:
+        """Собрать документ и учесть время сборки в метриках.
+
+        Args:
+            row: Строка БД с информацией об объекте.
+
+        Returns:
+            Документ ElasticSearch в виде dict.
+        """
+        started = time.perf_counter()
+        document = self.to_document(row)
+        metrics.TRANSFORM_SECONDS.observe(
+            time.perf_counter() - started, index=self.es_index,
+        )
+        metrics.TRANSFORMED_DOCUMENTS.inc(index=self.es_index)
+        return document
+
+    def get_objects(self, ids: tuple[str]) -> Generator[RealDictRow, None, None]:
+        """Получить объекты индекса с указанными ID.
+
+        Args:
+            ids: Список ID объектов.
+
+        Yields:
+            Информация об объекте в виде строки БД.
+        """
+        raise NotImplementedError
+
+    def ids_for_changes(self, entries: list[RealDictRow]) -> list[str]:
+        """Получить ID объектов индекса, затронутых записями журнала.
+
+        По умолчанию документ затрагивают только правки самой строки
+        table и ее связей с фильмами из film_link.
+
+        Args:
+            entries: Записи журнала изменений по порядку.
+
+        Returns:
+            ID объектов без повторов в порядке записей журнала.
+        """
+        tables = {self.table}
+        if self.film_link:
+            tables.add(self.film_link[0])
+        column = f'{self.table}_id'
+        ids = (
+            entry[column] for entry in entries
+            if entry['table_name'] in tables
+        )
+        return list(dict.fromkeys(ids))
+
+    def get_film_ids_deltas(
+            self, ids: list[str], film_ids: list[str],
+            ) -> Generator[RealDictRow, None, None]:
+        """Получить объекты индекса с изменениями их списков фильмов.
+
+        Нужен загрузчикам, у которых задан film_link.
+
+        Args:
+            ids: ID объектов индекса.
+            film_ids: ID фильмов, связь с которыми у объекта с тем же
+                номером в ids могла появиться или пропасть.
+
+        Yields:
+            Информация об объекте в виде строки БД, где film_ids -
+            фильмы, связанные с объектом, removed - фильмы, с которыми
+            объект больше не связан, а all_film_ids - все фильмы
+            объекта.
+        """
+        raise NotImplementedError
+
+    def load_changes(
+            self,
+            ) -> Generator[Union[RealDictRow, Deleted, Checkpoint], None, None]:
+        """Получить объекты, затронутые записями журнала изменений.
+
+        В отличие от load_all, не сканирует таблицы по времени правки,
+        а читает журнал content.etl_change_log, который ведут триггеры
+        из postgres/etl_change_log.sql.  Поэтому работа пропорциональна
+        числу изменений и видны удаления: для ID из журнала, которых
+        больше нет в базе, выдается отметка Deleted.
+
+        Yields:
+            Строка базы данных с информацией об объекте.
+            Отметка об удалении объекта.
+            Отметка об изменении списка фильмов, если film_ids_deltas.
+            Отметка состояния после каждой связки записей журнала.
+        """
+        sql = """
+            SELECT
+                seq,
+                txid,
+                table_name,
+                op,
+                film_work_id,
+                genre_id,
+                person_id
+            FROM content.etl_change_log
+            WHERE (txid, seq) > (%s, %s)
+                AND txid < txid_snapshot_xmin(txid_current_snapshot())
+            ORDER BY txid, seq;
+        """
+        since = self.state.get_state(self.change_log_key) or CHANGE_LOG_START
+        entries = self._execute_sql(sql, tuple(since))
+        for bunch in self._bunchify(entries, CHANGE_LOG_BUNCH_SIZE):
+            objects, links = bunch, []
+            if self.film_ids_deltas:
+                link_table = self.film_link[0]
+                objects = [
+                    entry for entry in bunch
+                    if entry['table_name'] != link_table
+                ]
+                links = [
+                    entry for entry in bunch
+                    if entry['table_name'] == link_table
+                ]
+            rebuilt = self.ids_for_changes(objects)
+            for ids in self._bunchify(rebuilt):
+                yield from self._get_or_delete(tuple(ids))
+            if links:
+                yield from self._film_ids_deltas(links, set(rebuilt))
+            last = bunch[-1]
+            yield Checkpoint(self.change_log_key, (last['txid'], last['seq']))
+
+    def load_ids(
+            self, ids: Iterable[str],
+            ) -> Generator[Union[RealDictRow, Deleted], None, None]:
+        """Получить объекты с указанными ID, в том числе удаленные.
+
+        Args:
+            ids: ID объектов.
+
+        Yields:
+            Строка базы данных или отметка об удалении объекта.
+        """
+        for bunch in self._bunchify(ids):
+            yield from self._get_or_delete(tuple(bunch))
+
+    def range_checksums(
+            self, low: str, high: Optional[str], length: int,
+            ) -> dict[str, tuple[int, int]]:
+        """Посчитать число и контрольную сумму ID объектов по поддиапазонам.
+
+        Диапазон ID делится на поддиапазоны по первым length
+        шестнадцатеричным цифрам ID.  Контрольная сумма - сумма
+        последних 6 цифр ID как чисел, ее же считает reconcile.py
+        на стороне ElasticSearch.
+
+        Args:
+            low: Наименьший ID диапазона.
+            high: ID, с которого начинается следующий диапазон, или
+                None для диапазона до конца.
+            length: Сколько первых цифр ID задают поддиапазон.
 
-    def load_all(self) -> Generator[RealDictRow, None, None]:
-        pass
+        Returns:
+            Число ID и их контрольная сумма по первым цифрам ID.
+        """
+        sql = f"""
+            SELECT
+                substr(replace(id::text, '-', ''), 1, %s) AS prefix,
+                count(*) AS count,
+                sum(('x' || right(id::text, 6))::bit(24)::bigint) AS checksum
+            FROM {self.table}
+            WHERE {self._id_range_sql(high)}
+            GROUP BY 1
+            ORDER BY 1;
+        """
+        values = (length, low, high) if high else (length, low)
+        return {
+            row['prefix']: (row['count'], int(row['checksum']))
+            for row in self._execute_sql(sql, values)
+        }
+
+    def range_ids(self, low: str, high: Optional[str]) -> list[str]:
+        """Получить ID объектов из диапазона.
+
+        Args:
+            low: Наименьший ID диапазона.
+            high: ID, с которого начинается следующий диапазон, или
+                None для диапазона до конца.
+
+        Returns:
+            ID объектов по возрастанию.
+        """
+        sql = f"""
+            SELECT id::text AS id
+            FROM {self.table}
+            WHERE {self._id_range_sql(high)}
+            ORDER BY id;
+        """
+        values = (low, high) if high else (low,)
+        return [row['id'] for row in self._execute_sql(sql, values)]
+
+    def _id_range_sql(self, high: Optional[str]) -> str:
+        """Собрать условие на ID из диапазона.
+
+        Args:
+            high: Верхняя граница диапазона или None, если ее нет.
+
+        Returns:
+            Условие SQL с местами для границ диапазона.
+        """
+        if high is None:
+            return 'id >= %s'
+        return 'id >= %s AND id < %s'
+
+    def _get_or_delete(
+            self, ids: tuple[str],
+            ) -> Generator[Union[RealDictRow, Deleted], None, None]:
+        """Получить объекты, а для отсутствующих в базе выдать Deleted.
+
+        Args:
+            ids: Список ID объектов.
+
+        Yields:
+            Строка базы данных или отметка об удалении объекта.
+        """
+        found = set()
+        for row in self.get_objects(ids):
+            found.add(row['id'])
+            yield row
+        for id in ids:
+            if id not in found:
+                yield Deleted(id)
+
+    def _film_ids_deltas(
+            self, links: list[RealDictRow], skip_ids: set[str],
+            ) -> Generator[FilmIdsDelta, None, None]:
+        """Получить изменения списков фильмов по записям журнала о связях.
+
+        Что добавить и что удалить, решает текущее состояние связей в
+        базе, а не операции журнала.  Поэтому повторное применение
+        тех же записей ничего не портит.
+
+        Args:
+            links: Записи журнала по таблице связей с фильмами.
+            skip_ids: ID объектов, документы которых уже собраны заново.
+
+        Yields:
+            Отметка об изменении списка фильмов объекта.
+        """
+        column = self.film_link[1]
+        pairs = dict.fromkeys(
+            (entry[column], entry['film_work_id']) for entry in links
+            if entry[column] not in skip_ids
+        )
+        for bunch in self._bunchify(pairs):
+            ids, film_ids = zip(*bunch)
+            for row in self.get_film_ids_deltas(list(ids), list(film_ids)):
+                removed = tuple(row.pop('removed'))
+                film_ids = tuple(row.pop('all_film_ids'))
+                yield FilmIdsDelta(row, removed, film_ids)
+
+    def _related_by_source(
+            self, sql: str, ids: Iterable[str],
+            ) -> dict[str, list[str]]:
+        """Сгруппировать ID связанных объектов по ID исходных строк.
+
+        Args:
+            sql: SQL-выражение, выбирающее пары source_id, id по
+                кортежу ID исходных строк.
+            ids: ID исходных строк.
+
+        Returns:
+            Списки ID связанных объектов по ID исходной строки.
+        """
+        related = {}
+        ids = tuple(set(ids))
+        if not ids:
+            return related
+        for row in self._execute_sql(sql, (ids,)):
+            related.setdefault(row['source_id'], []).append(row['id'])
+        return related
+
+    def _execute_objects_sql(
+            self, sql: str, values: Any,
+            ) -> Generator[RealDictRow, None, None]:
+        """Выполнить SQL-выражение, выбирающее объекты индекса.
+
+        В режиме pass_through выражение оборачивается так, чтобы
+        PostgreSQL сразу отдал документ в виде текста JSON, который
+        можно без разбора отправить в ElasticSearch.  Порядок строк
+        подзапроса внешний SELECT не сохраняет, поэтому обернутое
+        выражение упорядочено по id: иначе после переподключения
+        _execute_sql пропустил бы не те строки.
+
+        Args:
+            sql: SQL-выражение, выбирающее объекты индекса.
+            values: Значения для подстановки в SQL-выражение.
+
+        Yields:
+            Строка с объектом или строка с id и документом.
+        """
+        if self.pass_through:
+            sql = f"""
+                SELECT objects.id, ({self.document_sql})::text AS document
+                FROM ({sql.strip().rstrip(';')}) AS objects
+                ORDER BY objects.id;
+            """
+        yield from metrics.timed(
+            self._execute_sql(sql, values),
+            metrics.QUERY_SECONDS,
+            index=self.es_index,
+        )
 
     def _execute_sql(
-            self, sql: str, values: tuple, fetch_size: int = 1,
+            self, sql: str, values: tuple,
             ) -> Generator[RealDictRow, None, None]:
-        """Запустить SQL.
+        """Запустить SQL и читать результат потоком.
+
+        Результат остается на стороне PostgreSQL в именованном
+        (серверном) курсоре и забирается порциями по self.itersize
+        строк, поэтому память процесса не зависит от размера выборки.
+        Подключение работает в autocommit, а в этом режиме psycopg2
+        разрешает только курсоры WITH HOLD.
+
+        При обрыве подключения загрузчик с настройками dsl
+        переподключается, заново выполняет SQL и пропускает уже
+        выданные строки.  Поэтому каждый запрос через _execute_sql
+        должен быть однозначно упорядочен: тогда результат
+        продолжается с той же строки.
+
+        Вложенные запросы работают через то же подключение.  Если
+        вложенный запрос уже переподключился, курсор внешнего запроса
+        остался на старом подключении: внешний запрос тоже
+        продолжается, но уже через новое подключение.
 
         Args:
             sql: SQL-выражение.
             values: Значения для вставки в SQL-выражение.
-            fetch_size: По сколько объектов выбирать из SQL-запроса за раз.
 
         Yields:
             Строка результата SQL.
+
+        Raises:
+            OperationalError: Если подключение не восстановилось за
+                reconnect_attempts попыток или ошибка не в подключении.
         """
-        with self.connection.cursor() as cursor:
-            cursor.execute(sql, values)
-            while rows := cursor.fetchmany(fetch_size):
+        yielded = 0
+        for attempt in itertools.count(1):
+            try:
+                if self.dsl and self.connection.closed:
+                    self._reconnect()
+                connection = self.connection
+                rows = profiling.traced(
+                    self._stream_sql(sql, values, yielded),
+                    'extract.execute_sql',
+                )
                 for row in rows:
                     yield row
+                    yielded += 1
+                return
+            except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                lost = (
+                    connection.closed or connection is not self.connection
+                )
+                if (
+                    not self.dsl
+                    or not lost
+                    or attempt > self.reconnect_attempts
+                ):
+                    raise
+                logging.warning(
+                    'Lost postgresql connection, reconnecting '
+                    f'(attempt {attempt}).',
+                )
+                time.sleep(backoff_delay(attempt))
+
+    def _stream_sql(
+            self, sql: str, values: tuple, skip: int = 0,
+            ) -> Generator[RealDictRow, None, None]:
+        """Выполнить SQL в серверном курсоре и читать результат потоком.
+
+        Args:
+            sql: SQL-выражение.
+            values: Значения для вставки в SQL-выражение.
+            skip: Сколько первых строк результата пропустить.
+
+        Yields:
+            Строка результата SQL.
+        """
+        name = f'etl_cursor_{next(_cursor_ids)}'
+        with self.connection.cursor(name, withhold=True) as cursor:
+            cursor.itersize = self.itersize
+            cursor.execute(sql, values)
+            yield from itertools.islice(cursor, skip, None)
+
+    def _reconnect(self) -> None:
+        """Заменить оборванное подключение новым."""
+        self.close()
+        self.connection = create_connection(self.dsl)
+        self._own_connection = self.connection
+
+    def close(self) -> None:
+        """Закрыть подключение, созданное при переподключении.
+
+        Исходное подключение закрывает тот, кто его передал.
+        """
+        if self._own_connection and not self._own_connection.closed:
+            self._own_connection.close()
+        self._own_connection = None
+
+    def _now(self) -> datetime:
+        """Получить текущее время по часам PostgreSQL.
+
+        Returns:
+            Время начала запроса в базе.
+        """
+        rows = self._execute_sql('SELECT now() AS now;', ())
+        return next(rows)['now']
 
     def _bunchify(
-            self, rows: Iterable[RealDictRow], bunch_size: int = 100,
+            self,
+            rows: Iterable[RealDictRow],
+            bunch_size: Optional[int] = None,
             ) -> Generator[list[RealDictRow], None, None]:
         """Связать строки списка в подсписки указанного размера.
 
+        Args:
+            rows: Итератор из строк.
+            bunch_size: Размер возвращаемого списка, по умолчанию
+                текущий self.bunch_size.
+
+        Yields:
+            Подсписок строк.
+        """
+        yield from profiling.traced(
+            self._bunches(rows, bunch_size), 'extract.bunchify',
+        )
+
+    def _bunches(
+            self,
+            rows: Iterable[RealDictRow],
+            bunch_size: Optional[int] = None,
+            ) -> Generator[list[RealDictRow], None, None]:
+        """Связать строки в подсписки, см. _bunchify.
+
         Args:
             rows: Итератор из строк.
             bunch_size: Размер возвращаемого списка.
@@ -93,25 +715,111 @@ class PostgresLoader:
         bunch = []
         for row in rows:
             bunch.append(row)
-            if len(bunch) >= bunch_size:
+            if len(bunch) >= (bunch_size or self.bunch_size):
                 yield bunch
                 bunch = []
         if bunch:
             yield bunch
 
-    def _split_bunch(
+    def _unseen(self, ids: tuple[str], seen: set[str]) -> tuple[str]:
+        """Отбросить ID, которые уже загружены в этом цикле.
+
+        Один и тот же объект может попасть в несколько потоков
+        изменений, например, когда у фильма за период изменились и
+        жанр, и состав персон, и сам фильм.  Чтобы не извлекать и не
+        индексировать его несколько раз, загрузчик накапливает за цикл
+        множество уже загруженных ID.
+
+        Args:
+            ids: Список ID из очередного потока изменений.
+            seen: ID, уже загруженные в этом цикле.  Пополняется.
+
+        Returns:
+            ID, которые в этом цикле еще не загружались.
+        """
+        new_ids = tuple(id for id in ids if id not in seen)
+        seen.update(new_ids)
+        return new_ids
+
+    def _keyset(self, value: Any) -> Keyset:
+        """Привести значение из состояния к курсору (modified, id).
+
+        Args:
+            value: Значение ключа состояния.  Пустое значение означает
+                загрузку с самого начала, а строка - время правки в
+                старом формате состояния.
+
+        Returns:
+            Курсор для постраничного чтения изменений.
+        """
+        if not value:
+            return START
+        if isinstance(value, str):
+            return (value, NIL_ID)
+        return tuple(value)
+
+    def _changed_since(
+            self, table: str, since: Keyset, until: str = INFINITY,
+            ) -> Generator[tuple[tuple[str], Keyset], None, None]:
+        """Получить ID строк таблицы, измененных после курсора since.
+
+        Строки читаются в порядке (modified, id) строго после курсора,
+        поэтому каждая правка обрабатывается ровно один раз, даже если
+        у тысячи строк одинаковое время правки.  Для чтения диапазоном
+        по индексу у таблицы должен быть индекс по (modified, id), его
+        создает postgres/etl_indexes.sql.
+
+        Args:
+            table: Таблица с колонками id и modified.
+            since: Курсор (modified, id) последней обработанной строки.
+            until: Не учитывать правки, сделанные начиная с until.
+
+        Yields:
+            Список ID строк и курсор последней из них.
+        """
+        sql = f"""
+            SELECT
+                {table}.id,
+                {table}.modified
+            FROM {table}
+            WHERE ({table}.modified, {table}.id) > (%s, %s)
+                AND {table}.modified < %s
+            ORDER BY {table}.modified, {table}.id;
+        """
+        values = (*since, until)
+        for bunch in self._bunchify(self._execute_sql(sql, values)):
+            metrics.ROWS_SCANNED.inc(
+                len(bunch), index=self.es_index, table=table,
+            )
+            ids = tuple(row['id'] for row in bunch)
+            last = bunch[-1]
+            yield ids, (last['modified'], last['id'])
+
+    def _with_related(
             self,
-            bunches: Generator[list[RealDictRow], None, None]
-            ) -> Generator[tuple[tuple[str], str], None, None]:
-        """Выделить ID и дату модификации из связок строк БД.
+            changes: Iterable[tuple[tuple[str], Keyset]],
+            since: Keyset,
+            sql: str,
+            ) -> Generator[tuple[tuple[str], Keyset], None, None]:
+        """Перейти от измененных строк к связанным с ними объектам.
+
+        Одна связка измененных строк может дать много связанных
+        объектов, например, жанр Drama - тысячи фильмов.  Они выдаются
+        связками, и курсор сдвигается только после последней из них.
 
         Args:
-            bunches: Iterable связки строк БД.
+            changes: Связки ID измененных строк с их курсорами.
+            since: Курсор, с которого начато чтение изменений.
+            sql: SQL-выражение, выбирающее id связанных объектов
+                по кортежу ID измененных строк.
 
         Yields:
-            Список ID и минимальная дата модификации для них.
+            Список ID связанных объектов и курсор, до которого
+            изменения уже обработаны.
         """
-        for bunch in bunches:
-            ids, modified_dates = zip(*(row.values() for row in bunch))
-            since = modified_dates[0]
-            yield ids, since
+        for ids, changed_since in changes:
+            rows = self._execute_sql(sql, (ids,))
+            for bunch in self._bunchify(rows):
+                yield tuple(row['id'] for row in bunch), since
+            since = changed_since
+            yield (), since
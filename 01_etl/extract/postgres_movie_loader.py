@@ -1,11 +1,14 @@
 """Сбор информации о фильмах из базы данных Postgresql."""
 
-from typing import Generator
+from typing import Generator, Union
+
 from psycopg2.extras import RealDictRow
 
-from transform.db_objects import FilmWork
+import profiling
+from storage import Checkpoint
+from transform.db_objects import FilmWork, film_work_document
 
-from .postgres_loader import EPOCH, PostgresLoader
+from .postgres_loader import INFINITY, START, Keyset, PostgresLoader
 
 
 class StateKeys:
@@ -14,101 +17,232 @@ class StateKeys:
     FILM_WORK = 'movie_film_work_since'
     PERSON = 'movie_person_work_since'
     GENRE = 'movie_genre_since'
+    CHANGE_LOG = 'movie_change_log_since'
 
 
 class PostgresMovieLoader(PostgresLoader):
     """Класс, загружающий фильмы из PostgreSQL."""
 
     es_index = 'movies'
+    table = 'film_work'
+    source_tables = (
+        'film_work', 'genre', 'person', 'genre_film_work', 'person_film_work',
+    )
     validator = FilmWork
+    change_log_key = StateKeys.CHANGE_LOG
+    watermark_keys = (StateKeys.GENRE, StateKeys.PERSON, StateKeys.FILM_WORK)
+    # Тот же документ, что собирает film_work_document.
+    document_sql = """
+        json_build_object(
+            'id', objects.id,
+            'imdb_rating', objects.rating,
+            'genre', objects.genre,
+            'genres', objects.genres,
+            'title', objects.title,
+            'description', objects.description,
+            'director', (
+                SELECT COALESCE(json_agg(p.person->'name' ORDER BY p.n), '[]')
+                FROM json_array_elements(objects.persons)
+                    WITH ORDINALITY AS p(person, n)
+                WHERE p.person->>'role' = 'director'
+            ),
+            'actors_names', (
+                SELECT COALESCE(json_agg(p.person->'name' ORDER BY p.n), '[]')
+                FROM json_array_elements(objects.persons)
+                    WITH ORDINALITY AS p(person, n)
+                WHERE p.person->>'role' = 'actor'
+            ),
+            'writers_names', (
+                SELECT COALESCE(json_agg(p.person->'name' ORDER BY p.n), '[]')
+                FROM json_array_elements(objects.persons)
+                    WITH ORDINALITY AS p(person, n)
+                WHERE p.person->>'role' = 'writer'
+            ),
+            'actors', (
+                SELECT COALESCE(
+                    json_agg(
+                        json_build_object(
+                            'id', p.person->'id',
+                            'name', p.person->'name'
+                        )
+                        ORDER BY p.n
+                    ),
+                    '[]'
+                )
+                FROM json_array_elements(objects.persons)
+                    WITH ORDINALITY AS p(person, n)
+                WHERE p.person->>'role' = 'actor'
+            ),
+            'writers', (
+                SELECT COALESCE(
+                    json_agg(
+                        json_build_object(
+                            'id', p.person->'id',
+                            'name', p.person->'name'
+                        )
+                        ORDER BY p.n
+                    ),
+                    '[]'
+                )
+                FROM json_array_elements(objects.persons)
+                    WITH ORDINALITY AS p(person, n)
+                WHERE p.person->>'role' = 'writer'
+            )
+        )
+    """
 
-    def load_all(self) -> Generator[RealDictRow, None, None]:
+    def load_all(self) -> Generator[Union[RealDictRow, Checkpoint], None, None]:
         """Получить все обновленные и новые фильмы.
 
         Yields:
             Строка базы данных с полной информацией о фильме.
+            Отметка состояния после каждой связки объектов.
         """
-        genre_since = self.state.get_state(StateKeys.GENRE) or EPOCH
-        for ids, genre_since in self.ids_for_genre_since(genre_since):
-            yield from self.get_film_works(ids)
-            self.state.set_state(StateKeys.GENRE, genre_since)
+        # Правки, сделанные после начала цикла, достанутся следующему
+        # циклу.  Поэтому объект, уже загруженный в этом цикле, можно
+        # пропускать в остальных потоках изменений.
+        until = self._now()
+        seen = set()
+        genre_since = self._keyset(self.state.get_state(StateKeys.GENRE))
+        for ids, genre_since in self.ids_for_genre_since(genre_since, until):
+            if ids := self._unseen(ids, seen):
+                yield from self.get_film_works(ids)
+            yield Checkpoint(StateKeys.GENRE, genre_since)
 
-        person_since = self.state.get_state(StateKeys.PERSON) or EPOCH
-        for ids, person_since in self.ids_for_person_since(person_since):
-            yield from self.get_film_works(ids)
-            self.state.set_state(StateKeys.PERSON, person_since)
+        person_since = self._keyset(self.state.get_state(StateKeys.PERSON))
+        for ids, person_since in self.ids_for_person_since(person_since, until):
+            if ids := self._unseen(ids, seen):
+                yield from self.get_film_works(ids)
+            yield Checkpoint(StateKeys.PERSON, person_since)
 
-        film_work_since = self.state.get_state(StateKeys.FILM_WORK) or EPOCH
-        for ids, film_work_since in self.ids_for_film_work_since(film_work_since):
-            yield from self.get_film_works(ids)
-            self.state.set_state(StateKeys.FILM_WORK, film_work_since)
+        film_work_since = self._keyset(self.state.get_state(StateKeys.FILM_WORK))
+        for ids, film_work_since in self.ids_for_film_work_since(film_work_since, until):
+            if ids := self._unseen(ids, seen):
+                yield from self.get_film_works(ids)
+            yield Checkpoint(StateKeys.FILM_WORK, film_work_since)
 
-    def ids_for_film_work_since(self, since: str = EPOCH) -> Generator[tuple[tuple[str], str], None, None]:
-        """Получить ID фильмов, отредактированных с указанного момента.
+    def ids_for_film_work_since(
+            self, since: Keyset = START, until: str = INFINITY,
+            ) -> Generator[tuple[tuple[str], Keyset], None, None]:
+        """Получить ID фильмов, отредактированных после курсора since.
 
         Args:
-            since: Получить фильмы, измененные после since.
+            since: Курсор (modified, id) последней обработанной строки.
+            until: Не учитывать правки, сделанные начиная с until.
 
         Yields:
-            Список ID фильмов и самое раннее время правки этих фильмов.
-        """
-        sql = """
-            SELECT
-                fw.id,
-                fw.modified
-            FROM film_work fw
-            WHERE fw.modified >= %s
-            ORDER BY fw.modified, fw.id;
+            Список ID фильмов и курсор последней из них.
         """
-        values = (since,)
-        bunches = self._bunchify(self._execute_sql(sql, values))
-        yield from self._split_bunch(bunches)
+        yield from self._changed_since('film_work', since, until)
 
-    def ids_for_genre_since(self, since: str = EPOCH) -> Generator[tuple[tuple[str], str], None, None]:
+    def ids_for_genre_since(
+            self, since: Keyset = START, until: str = INFINITY,
+            ) -> Generator[tuple[tuple[str], Keyset], None, None]:
         """Получить ID фильмов, у которых изменился жанр.
 
         Args:
-            since: Получить фильмы, жанры которых изменены после since.
+            since: Курсор последней обработанной строки genre.
+            until: Не учитывать правки, сделанные начиная с until.
 
         Yields:
-            Список ID фильмов и самое раннее время правки жанра этих фильмов.
+            Список ID фильмов и курсор строки genre, до которой
+            изменения уже обработаны.
         """
         sql = """
-            SELECT
-                gfw.film_work_id,
-                min(g.modified) min_modified
-            FROM genre g
-            INNER JOIN genre_film_work gfw ON g.id = gfw.genre_id
-            WHERE g.modified >= %s
-            GROUP BY gfw.film_work_id
-            ORDER BY min_modified, gfw.film_work_id;
+            SELECT DISTINCT gfw.film_work_id AS id
+            FROM genre_film_work gfw
+            WHERE gfw.genre_id IN %s
+            ORDER BY id;
         """
-        values = (since,)
-        bunches = self._bunchify(self._execute_sql(sql, values))
-        yield from self._split_bunch(bunches)
+        changes = self._changed_since('genre', since, until)
+        yield from self._with_related(changes, since, sql)
 
-    def ids_for_person_since(self, since: str = EPOCH) -> Generator[tuple[tuple[str], str], None, None]:
+    def ids_for_person_since(
+            self, since: Keyset = START, until: str = INFINITY,
+            ) -> Generator[tuple[tuple[str], Keyset], None, None]:
         """Получить ID фильмов, у которых изменились персоны.
 
         Args:
-            since: Получить фильмы, персоны которых изменены после since.
+            since: Курсор последней обработанной строки person.
+            until: Не учитывать правки, сделанные начиная с until.
 
         Yields:
-            Список ID фильмов и самое раннее время правки персон этих фильмов.
+            Список ID фильмов и курсор строки person, до которой
+            изменения уже обработаны.
         """
         sql = """
-            SELECT
-                pfw.film_work_id,
-                min(p.modified) min_modified
-            FROM person p
-            INNER JOIN person_film_work pfw ON p.id = pfw.person_id
-            WHERE p.modified >= %s
-            GROUP BY pfw.film_work_id
-            ORDER BY min_modified, pfw.film_work_id;
+            SELECT DISTINCT pfw.film_work_id AS id
+            FROM person_film_work pfw
+            WHERE pfw.person_id IN %s
+            ORDER BY id;
         """
-        values = (since,)
-        bunches = self._bunchify(self._execute_sql(sql, values))
-        yield from self._split_bunch(bunches)
+        changes = self._changed_since('person', since, until)
+        yield from self._with_related(changes, since, sql)
+
+    def to_document(self, row: RealDictRow) -> dict:
+        """Собрать документ фильма без промежуточного объекта FilmWork.
+
+        Args:
+            row: Строка БД с информацией о фильме.
+
+        Returns:
+            Документ ElasticSearch в виде dict.
+        """
+        with profiling.span('transform.as_document'):
+            return film_work_document(row)
+
+    def ids_for_changes(self, entries: list[RealDictRow]) -> list[str]:
+        """Получить ID фильмов, затронутых записями журнала изменений.
+
+        Правка фильма или его связи с жанром или персоной затрагивает
+        сам фильм, а правка жанра или персоны - все их фильмы.
+
+        Args:
+            entries: Записи журнала изменений по порядку.
+
+        Returns:
+            ID фильмов без повторов в порядке записей журнала.
+        """
+        films_by_genre = self._related_by_source(
+            """
+                SELECT gfw.genre_id AS source_id, gfw.film_work_id AS id
+                FROM genre_film_work gfw
+                WHERE gfw.genre_id IN %s
+                ORDER BY gfw.genre_id, gfw.film_work_id;
+            """,
+            (e['genre_id'] for e in entries if e['table_name'] == 'genre'),
+        )
+        films_by_person = self._related_by_source(
+            """
+                SELECT pfw.person_id AS source_id, pfw.film_work_id AS id
+                FROM person_film_work pfw
+                WHERE pfw.person_id IN %s
+                ORDER BY pfw.person_id, pfw.film_work_id;
+            """,
+            (e['person_id'] for e in entries if e['table_name'] == 'person'),
+        )
+        ids = {}
+        for entry in entries:
+            if entry['film_work_id']:
+                ids[entry['film_work_id']] = None
+            elif entry['table_name'] == 'genre':
+                films = films_by_genre.get(entry['genre_id'], ())
+                ids.update(dict.fromkeys(films))
+            elif entry['table_name'] == 'person':
+                films = films_by_person.get(entry['person_id'], ())
+                ids.update(dict.fromkeys(films))
+        return list(ids)
+
+    def get_objects(self, ids: tuple[str]) -> Generator[RealDictRow, None, None]:
+        """Получить фильмы с указанными ID.
+
+        Args:
+            ids: Список ID фильмов.
+
+        Yields:
+            Полная информация о фильме в виде строки БД.
+        """
+        yield from self.get_film_works(ids)
 
     def get_film_works(self, ids: tuple[str]) -> Generator[RealDictRow, None, None]:
         """Получить фильмы с указанными ID.
@@ -155,8 +289,8 @@ class PostgresMovieLoader(PostgresLoader):
             LEFT JOIN content.genre g ON g.id = gfw.genre_id
             WHERE fw.id IN %s
             GROUP BY fw.id
-            ORDER BY fw.modified;
+            ORDER BY fw.modified, fw.id;
         """
         values = (tuple(ids),)
-        rows = self._execute_sql(sql, values)
+        rows = self._execute_objects_sql(sql, values)
         yield from rows
@@ -1,11 +1,13 @@
 """Сбор информации о персонах из базы данных Postgresql."""
 
-from typing import Generator
+from typing import Generator, Union
+
 from psycopg2.extras import RealDictRow
 
+from storage import Checkpoint
 from transform.db_objects import Person
 
-from .postgres_loader import EPOCH, PostgresLoader
+from .postgres_loader import INFINITY, START, Keyset, PostgresLoader
 
 
 class StateKeys:
@@ -13,77 +15,103 @@ class StateKeys:
 
     FILM_WORK = 'person_film_work_since'
     PERSON = 'person_person_since'
+    CHANGE_LOG = 'person_change_log_since'
 
 
 class PostgresPersonLoader(PostgresLoader):
     """Класс, загружающий персон из PostgreSQL."""
 
     es_index = 'persons'
+    table = 'person'
+    source_tables = ('person', 'film_work', 'person_film_work')
     validator = Person
-
-    def load_all(self) -> Generator[RealDictRow, None, None]:
+    change_log_key = StateKeys.CHANGE_LOG
+    watermark_keys = (StateKeys.FILM_WORK, StateKeys.PERSON)
+    film_link = ('person_film_work', 'person_id')
+    # Тот же документ, что собирает Person.as_document.
+    document_sql = """
+        json_build_object(
+            'id', objects.id,
+            'name', objects.full_name,
+            'role', objects.role,
+            'film_ids', objects.film_ids
+        )
+    """
+
+    def load_all(self) -> Generator[Union[RealDictRow, Checkpoint], None, None]:
         """Получить все обновленные и новые персоны.
 
         Yields:
             Строка базы данных с информацией о персоне.
+            Отметка состояния после каждой связки объектов.
         """
         # Ожидается, что при добавлении/удалении персоны у фильма в базе, 
         # меняется film_work.modified.  И в ответ на добавление/удаление
         # персоны у фильма, нужно обновить список фильмов у этой персоны
         # в индексе.
-        film_work_since = self.state.get_state(StateKeys.FILM_WORK) or EPOCH
-        for ids, film_work_since in self.ids_for_film_work_since(film_work_since):
-            yield from self.get_persons(ids)
-            self.state.set_state(StateKeys.FILM_WORK, film_work_since)
+        # Правки, сделанные после начала цикла, достанутся следующему
+        # циклу.  Поэтому объект, уже загруженный в этом цикле, можно
+        # пропускать в остальных потоках изменений.
+        until = self._now()
+        seen = set()
+        film_work_since = self._keyset(self.state.get_state(StateKeys.FILM_WORK))
+        for ids, film_work_since in self.ids_for_film_work_since(film_work_since, until):
+            if ids := self._unseen(ids, seen):
+                yield from self.get_persons(ids)
+            yield Checkpoint(StateKeys.FILM_WORK, film_work_since)
+
+        person_since = self._keyset(self.state.get_state(StateKeys.PERSON))
+        for ids, person_since in self.ids_for_person_since(person_since, until):
+            if ids := self._unseen(ids, seen):
+                yield from self.get_persons(ids)
+            yield Checkpoint(StateKeys.PERSON, person_since)
+
+    def ids_for_person_since(
+            self, since: Keyset = START, until: str = INFINITY,
+            ) -> Generator[tuple[tuple[str], Keyset], None, None]:
+        """Получить ID персон, отредактированных после курсора since.
 
-        person_since = self.state.get_state(StateKeys.PERSON) or EPOCH
-        for ids, person_since in self.ids_for_person_since(person_since):
-            yield from self.get_persons(ids)
-            self.state.set_state(StateKeys.PERSON, person_since)
+        Args:
+            since: Курсор (modified, id) последней обработанной строки.
+            until: Не учитывать правки, сделанные начиная с until.
 
-    def ids_for_person_since(self, since: str = EPOCH) -> Generator[tuple[tuple[str], str], None, None]:
-        """Получить ID персон, отредактированных с указанного момента.
+        Yields:
+            Список ID персон и курсор последней из них.
+        """
+        yield from self._changed_since('person', since, until)
+
+    def ids_for_film_work_since(
+            self, since: Keyset = START, until: str = INFINITY,
+            ) -> Generator[tuple[tuple[str], Keyset], None, None]:
+        """Получить ID персон, у которых изменились фильмы.
 
         Args:
-            since: Получить персоны, измененные после since.
+            since: Курсор последней обработанной строки film_work.
+            until: Не учитывать правки, сделанные начиная с until.
 
         Yields:
-            Список ID персон и самое раннее время правки этих персон.
+            Список ID персон и курсор строки film_work, до которой
+            изменения уже обработаны.
         """
         sql = """
-            SELECT
-                person.id,
-                person.modified
-            FROM person
-            WHERE person.modified >= %s
-            ORDER BY person.modified, person.id;
+            SELECT DISTINCT pfw.person_id AS id
+            FROM person_film_work pfw
+            WHERE pfw.film_work_id IN %s
+            ORDER BY id;
         """
-        values = (since,)
-        bunches = self._bunchify(self._execute_sql(sql, values))
-        yield from self._split_bunch(bunches)
+        changes = self._changed_since('film_work', since, until)
+        yield from self._with_related(changes, since, sql)
 
-    def ids_for_film_work_since(self, since: str = EPOCH) -> Generator[tuple[tuple[str], str], None, None]:
-        """Получить ID персон у изменённых фильмов.
+    def get_objects(self, ids: tuple[str]) -> Generator[RealDictRow, None, None]:
+        """Получить персон с указанными ID.
 
         Args:
-            since: Получить персон по фильмам, изменённым после since.
+            ids: Список ID персон.
 
         Yields:
-            Список ID персон и самое раннее время правки фильма этих персон.
-        """
-        sql = """
-            SELECT
-                pfw.person_id,
-                min(fw.modified) min_modified
-            FROM film_work fw
-            INNER JOIN person_film_work pfw ON fw.id = pfw.film_work_id
-            WHERE fw.modified >= %s
-            GROUP BY pfw.person_id
-            ORDER BY min_modified, pfw.person_id;
+            Информация о персоне в виде строки БД.
         """
-        values = (since,)
-        bunches = self._bunchify(self._execute_sql(sql, values))
-        yield from self._split_bunch(bunches)
+        yield from self.get_persons(ids)
 
     def get_persons(self, ids: tuple[str]) -> Generator[RealDictRow, None, None]:
         """Получить персон с указанными ID.
@@ -99,19 +127,81 @@ class PostgresPersonLoader(PostgresLoader):
                 person.id,
                 person.full_name,
                 COALESCE(
-                    JSON_AGG(DISTINCT pfw.role),
-                    '{}'
+                    JSON_AGG(DISTINCT pfw.role)
+                        FILTER (WHERE pfw.role IS NOT NULL),
+                    '[]'
                 ) as role,
                 COALESCE(
-                    JSON_AGG(DISTINCT pfw.film_work_id),
-                    '{}'
+                    JSON_AGG(DISTINCT pfw.film_work_id)
+                        FILTER (WHERE pfw.film_work_id IS NOT NULL),
+                    '[]'
                 ) as film_ids
             FROM person
             LEFT JOIN person_film_work pfw ON pfw.person_id = person.id
             WHERE person.id IN %s
             GROUP BY person.id
-            ORDER BY person.modified;
+            ORDER BY person.modified, person.id;
         """
         values = (tuple(ids),)
-        rows = self._execute_sql(sql, values)
+        rows = self._execute_objects_sql(sql, values)
         yield from rows
+
+    def get_film_ids_deltas(
+            self, ids: list[str], film_ids: list[str],
+            ) -> Generator[RealDictRow, None, None]:
+        """Получить персон с изменениями их списков фильмов.
+
+        Персона может участвовать в фильме в нескольких ролях, поэтому
+        фильм удаляется из списка, только если не осталось ни одной
+        связи с ним.  Список ролей собирается заново.
+
+        Args:
+            ids: ID персон.
+            film_ids: ID фильмов, связь с которыми у персоны с тем же
+                номером в ids могла появиться или пропасть.
+
+        Yields:
+            Информация о персоне в виде строки БД, где film_ids - фильмы,
+            связанные с персоной, removed - фильмы, с которыми персона
+            больше не связана, а all_film_ids - все фильмы персоны.
+        """
+        sql = """
+            WITH pairs AS (
+                SELECT
+                    p.person_id,
+                    p.film_work_id,
+                    EXISTS (
+                        SELECT 1
+                        FROM person_film_work pfw
+                        WHERE pfw.person_id = p.person_id
+                            AND pfw.film_work_id = p.film_work_id
+                    ) AS linked
+                FROM unnest(%s::uuid[], %s::uuid[]) AS p(person_id, film_work_id)
+            )
+            SELECT
+                person.id,
+                person.full_name,
+                (
+                    SELECT COALESCE(JSON_AGG(DISTINCT pfw.role), '[]')
+                    FROM person_film_work pfw
+                    WHERE pfw.person_id = person.id
+                ) as role,
+                COALESCE(
+                    JSON_AGG(pairs.film_work_id) FILTER (WHERE pairs.linked),
+                    '[]'
+                ) as film_ids,
+                COALESCE(
+                    JSON_AGG(pairs.film_work_id) FILTER (WHERE NOT pairs.linked),
+                    '[]'
+                ) as removed,
+                (
+                    SELECT COALESCE(JSON_AGG(DISTINCT pfw.film_work_id), '[]')
+                    FROM person_film_work pfw
+                    WHERE pfw.person_id = person.id
+                ) as all_film_ids
+            FROM pairs
+            JOIN person ON person.id = pairs.person_id
+            GROUP BY person.id
+            ORDER BY person.id;
+        """
+        yield from self._execute_sql(sql, (ids, film_ids))
@@ -0,0 +1,72 @@
+import json
+from unittest import TestCase, main, skipUnless
+
+import settings
+from extract.postgres_genre_loader import PostgresGenreLoader
+from extract.postgres_loader import PostgresLoader, postgres_connection
+from extract.postgres_movie_loader import PostgresMovieLoader
+from extract.postgres_person_loader import PostgresPersonLoader
+from extract.unit_tests.postgres_loader_tests import FakeConnection
+from serializers import StdlibSerializer
+
+
+class DocumentLoader(PostgresLoader):
+    document_sql = "json_build_object('id', objects.id)"
+
+
+class TestExecuteObjectsSql(TestCase):
+
+    def test_keeps_sql_without_pass_through(self):
+        connection = FakeConnection([])
+        loader = DocumentLoader(connection, None)
+        list(loader._execute_objects_sql('SELECT id FROM genre;', ()))
+        self.assertEqual('SELECT id FROM genre;', connection.cursors[0].sql)
+
+    def test_wraps_sql_in_document(self):
+        connection = FakeConnection([])
+        loader = DocumentLoader(connection, None, pass_through=True)
+        list(loader._execute_objects_sql('SELECT id FROM genre;', ()))
+        sql = connection.cursors[0].sql
+        self.assertIn("(json_build_object('id', objects.id))::text", sql)
+        self.assertIn('FROM (SELECT id FROM genre) AS objects', sql)
+
+    def test_ignores_pass_through_without_document_sql(self):
+        loader = PostgresLoader(None, None, pass_through=True)
+        self.assertFalse(loader.pass_through)
+
+
+@skipUnless(settings.POSTGRES_TEST_DB['dbname'], 'no test PostgreSQL')
+class TestPassThroughDocuments(TestCase):
+    """Документы из PostgreSQL совпадают с документами из Python."""
+
+    tables = {
+        PostgresMovieLoader: 'content.film_work',
+        PostgresGenreLoader: 'content.genre',
+        PostgresPersonLoader: 'content.person',
+    }
+
+    def test_same_documents(self):
+        serializer = StdlibSerializer()
+        with postgres_connection(settings.POSTGRES_TEST_DB) as connection:
+            for index_loader, table in self.tables.items():
+                with self.subTest(index=index_loader.es_index):
+                    with connection.cursor() as cursor:
+                        cursor.execute(f'SELECT id FROM {table} LIMIT 200;')
+                        ids = tuple(row['id'] for row in cursor)
+                    loader = index_loader(connection, None)
+                    expected = {
+                        str(row['id']): json.loads(
+                            serializer.dumps(loader.to_document(row)),
+                        )
+                        for row in loader.get_objects(ids)
+                    }
+                    loader = index_loader(connection, None, pass_through=True)
+                    documents = {
+                        str(row['id']): json.loads(row['document'])
+                        for row in loader.get_objects(ids)
+                    }
+                    self.assertEqual(expected, documents)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+import os
+from collections import namedtuple
+from unittest import TestCase, main
+
+from extract.postgres_listener import PostgresListener
+
+Notify = namedtuple('Notify', 'channel payload')
+
+
+class FakeConnection:
+
+    def __init__(self):
+        self.notifies = []
+        self.read_fd, self.write_fd = os.pipe()
+
+    def fileno(self):
+        return self.read_fd
+
+    def poll(self):
+        pass
+
+    def close(self):
+        os.close(self.read_fd)
+        os.close(self.write_fd)
+
+
+class TestPostgresListener(TestCase):
+
+    def setUp(self):
+        self.connection = FakeConnection()
+        self.listener = PostgresListener(
+            self.connection, 'etl_changes', debounce=0.01,
+        )
+
+    def tearDown(self):
+        self.connection.close()
+
+    def test_returns_changed_tables(self):
+        self.connection.notifies.extend([
+            Notify('etl_changes', 'genre'),
+            Notify('etl_changes', 'film_work'),
+            Notify('etl_changes', 'genre'),
+        ])
+        self.assertEqual({'genre', 'film_work'}, self.listener.wait(0))
+        self.assertEqual([], self.connection.notifies)
+
+    def test_returns_nothing_on_timeout(self):
+        self.assertEqual(set(), self.listener.wait(0))
+
+
+if __name__ == '__main__':
+    main()
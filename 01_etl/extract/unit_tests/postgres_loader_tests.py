@@ -0,0 +1,448 @@
+from decimal import Decimal
+from unittest import TestCase, main
+
+from psycopg2 import OperationalError
+from pydantic import ValidationError
+
+from extract.postgres_genre_loader import PostgresGenreLoader
+from extract.postgres_loader import (NIL_ID, START, Deleted, FilmIdsDelta,
+                                     PostgresLoader)
+from serializers import StdlibSerializer
+from storage import Checkpoint
+from transform.db_objects import Genre
+
+
+class FakeCursor:
+
+    def __init__(self, name, withhold, rows):
+        self.name = name
+        self.withhold = withhold
+        self.itersize = None
+        self.rows = rows
+        self.closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.closed = True
+
+    def execute(self, sql, values):
+        self.sql = sql
+        self.values = values
+
+    def __iter__(self):
+        return iter(self.rows)
+
+
+class FakeConnection:
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.cursors = []
+
+    def cursor(self, name=None, withhold=False):
+        cursor = FakeCursor(name, withhold, self.rows)
+        self.cursors.append(cursor)
+        return cursor
+
+
+class TestExecuteSql(TestCase):
+
+    def setUp(self):
+        self.rows = [{'id': 1}, {'id': 2}, {'id': 3}]
+        self.connection = FakeConnection(self.rows)
+        self.loader = PostgresLoader(self.connection, None, itersize=2)
+
+    def test_yields_all_rows(self):
+        rows = list(self.loader._execute_sql('SELECT 1', ()))
+        self.assertEqual(self.rows, rows)
+
+    def test_uses_server_side_cursor(self):
+        list(self.loader._execute_sql('SELECT 1', ()))
+        cursor = self.connection.cursors[0]
+        self.assertIsNotNone(cursor.name)
+        self.assertTrue(cursor.withhold)
+        self.assertEqual(2, cursor.itersize)
+        self.assertTrue(cursor.closed)
+
+    def test_cursor_names_are_unique(self):
+        list(self.loader._execute_sql('SELECT 1', ()))
+        list(self.loader._execute_sql('SELECT 1', ()))
+        first, second = self.connection.cursors
+        self.assertNotEqual(first.name, second.name)
+
+
+class BrokenCursor(FakeCursor):
+
+    def __init__(self, name, withhold, rows, connection, fail_after):
+        super().__init__(name, withhold, rows)
+        self.connection = connection
+        self.fail_after = fail_after
+
+    def __iter__(self):
+        for n, row in enumerate(self.rows):
+            if n == self.fail_after:
+                self.connection.closed = 2
+                raise OperationalError('server closed the connection')
+            yield row
+
+
+class BrokenConnection(FakeConnection):
+
+    def __init__(self, rows, fail_after):
+        super().__init__(rows)
+        self.fail_after = fail_after
+        self.closed = 0
+
+    def cursor(self, name=None, withhold=False):
+        cursor = BrokenCursor(
+            name, withhold, self.rows, self, self.fail_after,
+        )
+        self.cursors.append(cursor)
+        return cursor
+
+
+class ReconnectingLoader(PostgresLoader):
+
+    def __init__(self, connections, **kwargs):
+        super().__init__(
+            connections.pop(0), None, dsl={'dbname': 'movies'}, **kwargs,
+        )
+        self.connections = connections
+
+    def _reconnect(self):
+        self.connection = self.connections.pop(0)
+
+
+class ErrorRows:
+
+    def __iter__(self):
+        raise OperationalError('canceling statement due to timeout')
+
+
+class TestReconnect(TestCase):
+
+    def setUp(self):
+        self.rows = [{'id': 1}, {'id': 2}, {'id': 3}]
+
+    def test_resumes_query_after_reconnect(self):
+        loader = ReconnectingLoader([
+            BrokenConnection(self.rows, fail_after=2),
+            BrokenConnection(self.rows, fail_after=None),
+        ])
+        rows = list(loader._execute_sql('SELECT 1', ()))
+        self.assertEqual(self.rows, rows)
+        self.assertFalse(loader.connections)
+
+    def test_resumes_outer_query_after_inner_reconnect(self):
+        loader = ReconnectingLoader([
+            BrokenConnection(self.rows, fail_after=1),
+            BrokenConnection(self.rows, fail_after=None),
+        ])
+        outer = loader._execute_sql('SELECT 1', ())
+        rows = [next(outer)]
+        self.assertEqual(self.rows, list(loader._execute_sql('SELECT 2', ())))
+        rows += list(outer)
+        self.assertEqual(self.rows, rows)
+
+    def test_gives_up_after_attempts(self):
+        loader = ReconnectingLoader(
+            [BrokenConnection(self.rows, fail_after=0) for _ in range(3)],
+            reconnect_attempts=2,
+        )
+        with self.assertRaises(OperationalError):
+            list(loader._execute_sql('SELECT 1', ()))
+
+    def test_reraises_errors_of_live_connection(self):
+        connection = BrokenConnection(self.rows, fail_after=1)
+        connection.cursor = lambda *args, **kwargs: FakeCursor(
+            None, True, ErrorRows(),
+        )
+        loader = ReconnectingLoader([connection, connection])
+        with self.assertRaises(OperationalError):
+            list(loader._execute_sql('SELECT 1', ()))
+        self.assertEqual([connection], loader.connections)
+
+
+class TestBunchify(TestCase):
+
+    def setUp(self):
+        self.loader = PostgresLoader(None, None)
+
+    def test_splits_rows(self):
+        bunches = list(self.loader._bunchify(range(5), bunch_size=2))
+        self.assertEqual([[0, 1], [2, 3], [4]], bunches)
+
+    def test_follows_bunch_size_changes(self):
+        self.loader.bunch_size = 2
+        bunches = self.loader._bunchify(range(7))
+        self.assertEqual([0, 1], next(bunches))
+        self.loader.bunch_size = 4
+        self.assertEqual([[2, 3, 4, 5], [6]], list(bunches))
+
+
+class FakeSqlLoader(PostgresLoader):
+    """Загрузчик, который отвечает на SQL заранее заданными строками."""
+
+    def __init__(self, results):
+        super().__init__(None, None)
+        self.results = results
+        self.queries = []
+        self.statements = []
+
+    def _execute_sql(self, sql, values):
+        self.queries.append(values)
+        self.statements.append(sql)
+        yield from self.results.pop(0)
+
+
+class TestKeyset(TestCase):
+
+    def setUp(self):
+        self.loader = PostgresLoader(None, None)
+
+    def test_starts_from_scratch(self):
+        self.assertEqual(START, self.loader._keyset(None))
+
+    def test_reads_legacy_timestamp(self):
+        self.assertEqual(
+            ('2022-01-01', NIL_ID), self.loader._keyset('2022-01-01'),
+        )
+
+    def test_reads_stored_keyset(self):
+        self.assertEqual(
+            ('2022-01-01', 'a'), self.loader._keyset(['2022-01-01', 'a']),
+        )
+
+
+class TestChangedSince(TestCase):
+
+    def test_yields_cursor_of_last_row(self):
+        rows = [{'id': str(i), 'modified': f't{i}'} for i in range(150)]
+        loader = FakeSqlLoader([rows])
+        changes = list(loader._changed_since('genre', START))
+        self.assertEqual(('t99', '99'), changes[0][1])
+        self.assertEqual(('t149', '149'), changes[1][1])
+        self.assertEqual(50, len(changes[1][0]))
+
+    def test_seeks_after_cursor(self):
+        loader = FakeSqlLoader([[]])
+        list(loader._changed_since('genre', ('t1', 'a'), 'now'))
+        self.assertEqual([('t1', 'a', 'now')], loader.queries)
+
+
+class TestRanges(TestCase):
+
+    def test_reads_checksums_by_prefix(self):
+        loader = FakeSqlLoader([[
+            {'prefix': 'a', 'count': 2, 'checksum': Decimal(30)},
+        ]])
+        self.assertEqual(
+            {'a': (2, 30)}, loader.range_checksums('a0', 'b0', 1),
+        )
+        self.assertEqual([(1, 'a0', 'b0')], loader.queries)
+        self.assertIn('ORDER BY 1', loader.statements[0])
+
+    def test_last_range_has_no_upper_bound(self):
+        loader = FakeSqlLoader([[{'id': 'f1'}]])
+        self.assertEqual(['f1'], loader.range_ids('f0', None))
+        self.assertEqual([('f0',)], loader.queries)
+
+    def test_load_ids_marks_deleted(self):
+        loader = FakeSqlLoader([])
+        loader.get_objects = lambda ids: iter([{'id': '2'}])
+        self.assertEqual(
+            [{'id': '2'}, Deleted('1')], list(loader.load_ids(['1', '2'])),
+        )
+
+
+class TestDefaults(TestCase):
+
+    def test_ids_for_changes_of_table_and_film_links(self):
+        loader = PostgresGenreLoader(None, None)
+        entries = [
+            {'table_name': 'genre', 'genre_id': 'g2'},
+            {'table_name': 'film_work', 'genre_id': None},
+            {'table_name': 'genre_film_work', 'genre_id': 'g1'},
+            {'table_name': 'genre', 'genre_id': 'g2'},
+        ]
+        self.assertEqual(['g2', 'g1'], loader.ids_for_changes(entries))
+
+    def test_index_queries_are_left_to_loaders(self):
+        loader = PostgresLoader(None, None)
+        with self.assertRaises(NotImplementedError):
+            next(loader.load_all())
+        with self.assertRaises(NotImplementedError):
+            next(loader.get_objects(('1',)))
+        with self.assertRaises(NotImplementedError):
+            next(loader.get_film_ids_deltas(['1'], ['2']))
+
+
+class TestPassThroughOrder(TestCase):
+
+    def test_orders_wrapped_objects(self):
+        loader = FakeSqlLoader([[]])
+        loader.pass_through = True
+        loader.document_sql = "json_build_object('id', objects.id)"
+        sql = 'SELECT id FROM genre ORDER BY modified, id;'
+        list(loader._execute_objects_sql(sql, ()))
+        self.assertTrue(
+            loader.statements[0].strip().endswith('ORDER BY objects.id;'),
+        )
+
+
+class TestWithRelated(TestCase):
+
+    def test_moves_cursor_after_all_related(self):
+        related = [{'id': str(i)} for i in range(150)]
+        loader = FakeSqlLoader([related])
+        changes = [(('g1',), ('t1', 'g1'))]
+        result = list(loader._with_related(changes, START, 'SQL'))
+        self.assertEqual(
+            [START, START, ('t1', 'g1')],
+            [since for _, since in result],
+        )
+        self.assertEqual(150, sum(len(ids) for ids, _ in result))
+
+
+class FakeState:
+
+    def __init__(self, state=None):
+        self.state = state or {}
+
+    def get_state(self, key):
+        return self.state.get(key)
+
+
+class FakeChangeLogLoader(PostgresLoader):
+    """Загрузчик, который читает заранее заданный журнал изменений."""
+
+    change_log_key = 'change_log'
+
+    def __init__(self, entries, existing):
+        super().__init__(None, FakeState())
+        self.entries = entries
+        self.existing = existing
+
+    def _execute_sql(self, sql, values):
+        yield from self.entries
+
+    def ids_for_changes(self, entries):
+        return list(dict.fromkeys(entry['genre_id'] for entry in entries))
+
+    def get_objects(self, ids):
+        for id in ids:
+            if id in self.existing:
+                yield {'id': id}
+
+
+class TestLoadChanges(TestCase):
+
+    def setUp(self):
+        entries = [
+            {'txid': 10, 'seq': 1, 'genre_id': 'a'},
+            {'txid': 10, 'seq': 2, 'genre_id': 'b'},
+            {'txid': 11, 'seq': 3, 'genre_id': 'a'},
+        ]
+        self.loader = FakeChangeLogLoader(entries, existing={'a'})
+
+    def test_yields_rows_deletions_and_checkpoint(self):
+        expected = [
+            {'id': 'a'},
+            Deleted('b'),
+            Checkpoint('change_log', (11, 3)),
+        ]
+        self.assertEqual(expected, list(self.loader.load_changes()))
+
+
+class FakeFilmIdsLoader(FakeChangeLogLoader):
+    """Загрузчик жанров, у которого заданы текущие связи с фильмами."""
+
+    film_link = ('genre_film_work', 'genre_id')
+
+    def __init__(self, entries, existing, links):
+        super().__init__(entries, existing)
+        self.film_ids_deltas = True
+        self.links = links
+        self.delta_requests = []
+
+    def get_film_ids_deltas(self, ids, film_ids):
+        self.delta_requests.append((ids, film_ids))
+        rows = {}
+        for id, film_id in zip(ids, film_ids):
+            row = rows.setdefault(id, {
+                'id': id, 'film_ids': [], 'removed': [],
+                'all_film_ids': sorted(f for i, f in self.links if i == id),
+            })
+            linked = (id, film_id) in self.links
+            row['film_ids' if linked else 'removed'].append(film_id)
+        yield from rows.values()
+
+
+class TestFilmIdsDeltas(TestCase):
+
+    def test_link_changes_become_deltas(self):
+        entries = [
+            {'txid': 10, 'seq': 1, 'table_name': 'genre_film_work',
+             'genre_id': 'a', 'film_work_id': 'f1'},
+            {'txid': 10, 'seq': 2, 'table_name': 'genre_film_work',
+             'genre_id': 'a', 'film_work_id': 'f2'},
+            {'txid': 10, 'seq': 3, 'table_name': 'genre_film_work',
+             'genre_id': 'a', 'film_work_id': 'f1'},
+        ]
+        loader = FakeFilmIdsLoader(entries, {'a'}, links={('a', 'f1')})
+        expected = [
+            FilmIdsDelta({'id': 'a', 'film_ids': ['f1']}, ('f2',), ('f1',)),
+            Checkpoint('change_log', (10, 3)),
+        ]
+        self.assertEqual(expected, list(loader.load_changes()))
+        self.assertEqual([(['a', 'a'], ['f1', 'f2'])], loader.delta_requests)
+
+    def test_skips_deltas_of_rebuilt_objects(self):
+        entries = [
+            {'txid': 10, 'seq': 1, 'table_name': 'genre', 'genre_id': 'a'},
+            {'txid': 10, 'seq': 2, 'table_name': 'genre_film_work',
+             'genre_id': 'a', 'film_work_id': 'f1'},
+        ]
+        loader = FakeFilmIdsLoader(entries, {'a'}, links={('a', 'f1')})
+        expected = [{'id': 'a'}, Checkpoint('change_log', (10, 2))]
+        self.assertEqual(expected, list(loader.load_changes()))
+        self.assertEqual([], loader.delta_requests)
+
+
+
+class GenreLoader(PostgresLoader):
+    validator = Genre
+
+
+class TestToDocument(TestCase):
+
+    def setUp(self):
+        self.row = {
+            'id': '3d8d9bf5-0d90-4353-88ba-4ccc5d2c07ff',
+            'name': 'Drama',
+            'description': None,
+            'film_ids': ['6c162475-c7ed-4461-9184-001ef3d9f26e'],
+        }
+        self.serializer = StdlibSerializer()
+
+    def test_trusted_document_is_the_same(self):
+        validated = GenreLoader(None, None).to_document(self.row)
+        loader = GenreLoader(None, None, validate_every=0)
+        trusted = loader.to_document(self.row)
+        self.assertEqual(
+            self.serializer.dumps(validated), self.serializer.dumps(trusted),
+        )
+
+    def test_validates_sampled_rows(self):
+        loader = GenreLoader(None, None, validate_every=2)
+        invalid = {'id': 'not-a-uuid', 'name': 'Drama'}
+        loader.to_document(self.row)
+        loader.to_document(invalid)
+        with self.assertRaises(ValidationError):
+            loader.to_document(invalid)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+from unittest import TestCase, main
+
+from extract.postgres_movie_loader import PostgresMovieLoader, StateKeys
+from storage import BaseStorage, Checkpoint, State
+
+
+class MemoryStorage(BaseStorage):
+
+    def __init__(self):
+        self.state = {}
+
+    def save_state(self, state):
+        self.state = dict(state)
+
+    def retrieve_state(self):
+        return dict(self.state)
+
+
+class FakeMovieLoader(PostgresMovieLoader):
+    """Загрузчик с заранее заданными потоками изменений."""
+
+    feeds = {
+        'genre': [(('a', 'b'), 'g1')],
+        'person': [(('b', 'c'), 'p1'), (('a',), 'p2')],
+        'film_work': [(('c', 'd'), 'f1')],
+    }
+
+    def __init__(self, state):
+        super().__init__(None, state)
+        self.fetched = []
+
+    def _now(self):
+        return 'now'
+
+    def ids_for_genre_since(self, since, until):
+        yield from self.feeds['genre']
+
+    def ids_for_person_since(self, since, until):
+        yield from self.feeds['person']
+
+    def ids_for_film_work_since(self, since, until):
+        yield from self.feeds['film_work']
+
+    def get_film_works(self, ids):
+        self.fetched.extend(ids)
+        for id in ids:
+            yield {'id': id}
+
+
+class TestMovieLoaderDeduplication(TestCase):
+
+    def setUp(self):
+        self.state = State(MemoryStorage())
+        self.loader = FakeMovieLoader(self.state)
+
+    def test_fetches_each_film_once(self):
+        rows = [
+            row for row in self.loader.load_all()
+            if not isinstance(row, Checkpoint)
+        ]
+        self.assertEqual(['a', 'b', 'c', 'd'], [row['id'] for row in rows])
+        self.assertEqual(['a', 'b', 'c', 'd'], self.loader.fetched)
+
+    def test_checkpoints_every_feed(self):
+        checkpoints = [
+            row for row in self.loader.load_all()
+            if isinstance(row, Checkpoint)
+        ]
+        expected = [
+            Checkpoint(StateKeys.GENRE, 'g1'),
+            Checkpoint(StateKeys.PERSON, 'p1'),
+            Checkpoint(StateKeys.PERSON, 'p2'),
+            Checkpoint(StateKeys.FILM_WORK, 'f1'),
+        ]
+        self.assertEqual(expected, checkpoints)
+
+
+class FakeChangeLogMovieLoader(PostgresMovieLoader):
+    """Загрузчик, который отвечает на SQL заранее заданными строками."""
+
+    def __init__(self, results):
+        super().__init__(None, None)
+        self.results = results
+
+    def _execute_sql(self, sql, values):
+        yield from self.results.pop(0)
+
+
+class TestMovieIdsForChanges(TestCase):
+
+    def test_resolves_genres_and_persons(self):
+        loader = FakeChangeLogMovieLoader([
+            [{'source_id': 'g', 'id': 'f2'}, {'source_id': 'g', 'id': 'f1'}],
+            [{'source_id': 'p', 'id': 'f3'}],
+        ])
+        entries = [
+            {'table_name': 'film_work', 'film_work_id': 'f1'},
+            {'table_name': 'genre', 'film_work_id': None, 'genre_id': 'g'},
+            {'table_name': 'person_film_work', 'film_work_id': 'f4'},
+            {'table_name': 'person', 'film_work_id': None, 'person_id': 'p'},
+        ]
+        ids = loader.ids_for_changes(entries)
+        self.assertEqual(['f1', 'f2', 'f4', 'f3'], ids)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,200 @@
+"""Асинхронная загрузка документов в Elastic Search."""
+
+import asyncio
+import itertools
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncGenerator, Optional
+
+from elasticsearch import AsyncElasticsearch
+from elasticsearch.exceptions import NotFoundError, TransportError
+from elasticsearch.serializer import Serializer
+
+import profiling
+from serializers import get_serializer
+from storage import CheckpointLedger
+
+from .bulk_controller import BulkController, is_transient
+from .dead_letters import DeadLetterFile
+from .elastic_search_saver import BulkAction, ElasticSearchSaver
+from .fingerprints import FingerprintStore
+
+
+@asynccontextmanager
+async def async_elastic_search_connection(
+        host: dict, serializer: Optional[Serializer] = None,
+        ) -> AsyncGenerator[AsyncElasticsearch, None]:
+    """Создает асинхронное подключение к ElasticSearch.
+
+    Args:
+        host: Настройки подключения.
+        serializer: Сериализатор JSON, по умолчанию самый быстрый
+            из установленных.
+
+    Yields:
+        Подключение к ElasticSearch.
+    """
+    es = AsyncElasticsearch([host], serializer=serializer or get_serializer())
+    try:
+        yield es
+    finally:
+        await es.close()
+
+
+async def async_index_uuid(
+        client: AsyncElasticsearch, index: str,
+        ) -> Optional[str]:
+    """Узнать uuid индекса, в который попадут документы.
+
+    Args:
+        client: Асинхронное подключение к ElasticSearch.
+        index: Название индекса или алиаса.
+
+    Returns:
+        uuid индекса или None, если индекса еще нет.
+    """
+    try:
+        settings = await client.indices.get_settings(
+            index=index, name='index.uuid',
+        )
+    except NotFoundError:
+        return None
+    uuids = [item['settings']['index']['uuid'] for item in settings.values()]
+    return uuids[0] if len(uuids) == 1 else None
+
+
+class AsyncElasticSearchSaver(ElasticSearchSaver):
+    """Загрузчик документов через AsyncElasticsearch.
+
+    Буфер, сериализация и журнал отметок те же, что у
+    ElasticSearchSaver, но bulk-запросы отправляются задачами asyncio
+    в том же цикле событий, а не в потоках.  В полете одновременно
+    не больше max_in_flight запросов.
+    """
+
+    def __init__(
+            self,
+            es_client: AsyncElasticsearch,
+            index: str,
+            batch_size: int = 100,
+            max_batch_bytes: int = 5 * 1024 * 1024,
+            max_in_flight: int = 2,
+            ledger: Optional[CheckpointLedger] = None,
+            controller: Optional[BulkController] = None,
+            dead_letters: Optional[DeadLetterFile] = None,
+            max_retries: int = 5,
+            retry_pause: float = 0.5,
+            ):
+        """Инициализация атрибутов класса.
+
+        База отпечатков подключается отдельно через bind_fingerprints,
+        потому что для этого нужен запрос к ElasticSearch.
+
+        Args:
+            es_client: Асинхронное подключение к ElasticSearch.
+            index: Индекс для сохранения документов.
+            batch_size: Размер буфера для сохраняемых объектов.
+            max_batch_bytes: Размер буфера в байтах.
+            max_in_flight: Сколько bulk-запросов отправлять одновременно.
+            ledger: Журнал отметок состояния.  Без него отметки
+                хранятся только в памяти и после завершения теряются.
+            controller: Регулятор размера и числа bulk-запросов.
+            dead_letters: Файл для документов с неисправимыми ошибками.
+            max_retries: Сколько раз повторять действия с временными
+                ошибками.
+            retry_pause: Пауза перед первым повтором в секундах.
+        """
+        super().__init__(
+            es_client, index, batch_size, max_batch_bytes, max_in_flight,
+            ledger,
+            controller=controller,
+            dead_letters=dead_letters,
+            max_retries=max_retries,
+            retry_pause=retry_pause,
+        )
+        # Задачи bulk-запросов и ID их документов.
+        self._tasks: deque[tuple[asyncio.Task, frozenset]] = deque()
+
+    def _create_executor(self, max_in_flight: int) -> None:
+        """Не создавать пул потоков: запросы отправляют задачи asyncio.
+
+        Args:
+            max_in_flight: Сколько bulk-запросов отправлять одновременно.
+        """
+        return None
+
+    async def bind_fingerprints(self, fingerprints: FingerprintStore) -> None:
+        """Подключить базу отпечатков сохраненных документов.
+
+        Args:
+            fingerprints: База отпечатков.
+        """
+        self._fingerprints = fingerprints
+        self._index_uuid = await async_index_uuid(self.client, self.index)
+        fingerprints.bind(self.index, self._index_uuid)
+
+    async def flush_async(self) -> None:
+        """Отправить все объекты из буфера в ElasticSearch.
+
+        Не дожидается ответа ElasticSearch, если в полете меньше
+        max_in_flight запросов и ни в одном из них нет документов
+        с теми же ID.  Иначе сначала ждет завершения самых старых
+        запросов и пробрасывает их ошибку.
+        """
+        with profiling.span('load.flush'):
+            while self._tasks and self._tasks[0][0].done():
+                self._tasks.popleft()[0].result()
+            batch = self._take_batch()
+            if batch is None:
+                return
+            ids = frozenset(action.id for action in batch[0])
+            while self._must_wait(self._tasks, ids):
+                await self._tasks.popleft()[0]
+            self._tasks.append(
+                (asyncio.ensure_future(self._send_async(*batch)), ids),
+            )
+
+    async def close_async(self) -> None:
+        """Отправить остаток буфера и дождаться ответов."""
+        await self.flush_async()
+        while self._tasks:
+            await self._tasks.popleft()[0]
+
+    def cancel(self) -> None:
+        """Отменить неподтвержденные bulk-запросы после ошибки."""
+        while self._tasks:
+            self._tasks.popleft()[0].cancel()
+
+    async def _send_async(
+            self, actions: list[BulkAction], ticket: int,
+            ) -> None:
+        """Отправить bulk-запрос в ElasticSearch.
+
+        Args:
+            actions: Действия запроса.
+            ticket: Номер запроса в журнале отметок.
+
+        Raises:
+            BulkIndexError: Если действия не удались и после повторов
+                или неисправимую ошибку некуда отложить.
+            TransportError: Если запрос не принят целиком не из-за
+                временного сбоя.
+        """
+        for attempt in itertools.count(1):
+            with profiling.span('load.send'):
+                started = time.monotonic()
+                try:
+                    response = await self.client.bulk(
+                        body=self._body(actions),
+                    )
+                except TransportError as error:
+                    if not is_transient(error):
+                        raise
+                    response = None
+                latency = time.monotonic() - started
+                actions, errors = self._settle(actions, response, latency)
+            if not actions:
+                break
+            await asyncio.sleep(self._retry_delay(attempt, actions, errors))
+        self._ledger.ack(ticket)
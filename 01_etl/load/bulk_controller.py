@@ -0,0 +1,132 @@
+"""Подстройка размера и числа bulk-запросов под нагрузку ElasticSearch."""
+
+import threading
+
+from elasticsearch.exceptions import ConnectionError, TransportError
+
+# Код ответа ElasticSearch, когда очередь записи кластера переполнена.
+TOO_MANY_REQUESTS = 429
+# Коды ошибок документа в bulk-запросе, с которыми документ стоит
+# отправить повторно: кластер перегружен или шард временно недоступен.
+RETRYABLE_STATUSES = frozenset((TOO_MANY_REQUESTS, 502, 503, 504))
+
+
+def is_retryable(result: dict) -> bool:
+    """Проверить, стоит ли повторить действие из bulk-запроса.
+
+    Действия bulk-запросов идемпотентны, поэтому повторять их можно.
+
+    Args:
+        result: Результат действия из ответа ElasticSearch.
+
+    Returns:
+        Истина, если действие не выполнено из-за временной ошибки.
+    """
+    return 'error' in result and result.get('status') in RETRYABLE_STATUSES
+
+
+def is_rejection(error: Exception) -> bool:
+    """Проверить, что запрос целиком отклонен из-за перегрузки кластера.
+
+    Args:
+        error: Исключение от клиента ElasticSearch.
+
+    Returns:
+        Истина, если запрос стоит повторить позже.
+    """
+    return (
+        isinstance(error, TransportError)
+        and error.status_code == TOO_MANY_REQUESTS
+    )
+
+
+def is_transient(error: Exception) -> bool:
+    """Проверить, что запрос целиком не выполнен из-за временного сбоя.
+
+    Кроме отказа перегруженного кластера, это обрыв соединения или
+    таймаут: клиент переподключается к узлу сам, а запрос достаточно
+    отправить еще раз.
+
+    Args:
+        error: Исключение от клиента ElasticSearch.
+
+    Returns:
+        Истина, если запрос стоит повторить позже.
+    """
+    return is_rejection(error) or isinstance(error, ConnectionError)
+
+
+class BulkController:
+    """AIMD-регулятор размера bulk-запросов и их числа в полете.
+
+    Пока запросы проходят быстрее target_latency, размер запроса
+    растет на batch_step документов, а упершись в max_batch_size,
+    растет число одновременных запросов.  Если запрос шел дольше
+    target_latency, размер запроса уменьшается вдвое.  Если кластер
+    отклонил запрос или его документы с кодом 429, вдвое уменьшается
+    и размер, и число запросов в полете.
+
+    Загрузчик ждет, пока в полете больше concurrency запросов,
+    поэтому при перегрузке кластера извлечение данных замедляется,
+    а не падает.  Безопасен для использования из нескольких потоков.
+    """
+
+    def __init__(
+            self,
+            batch_size: int = 100,
+            min_batch_size: int = 10,
+            max_batch_size: int = 1000,
+            max_concurrency: int = 4,
+            target_latency: float = 1,
+            batch_step: int = 50,
+            ):
+        """Проинициализировать регулятор.
+
+        Args:
+            batch_size: Начальный размер запроса в документах.
+            min_batch_size: Наименьший размер запроса.
+            max_batch_size: Наибольший размер запроса.
+            max_concurrency: Наибольшее число запросов в полете.
+            target_latency: Желаемое время ответа на запрос в секундах.
+            batch_step: На сколько документов увеличивать запрос.
+        """
+        self.min_batch_size = min_batch_size
+        self.max_batch_size = max_batch_size
+        self.max_concurrency = max_concurrency
+        self.target_latency = target_latency
+        self.batch_step = batch_step
+        self.batch_size = min(max(batch_size, min_batch_size), max_batch_size)
+        self.concurrency = max_concurrency
+        self._lock = threading.Lock()
+
+    def observe(self, latency: float, rejected: bool = False) -> None:
+        """Учесть результат bulk-запроса.
+
+        Args:
+            latency: Время ответа на запрос в секундах.
+            rejected: Отклонил ли кластер запрос из-за перегрузки.
+        """
+        with self._lock:
+            if rejected or latency > self.target_latency:
+                self._decrease(rejected)
+            else:
+                self._increase()
+
+    def _decrease(self, rejected: bool) -> None:
+        """Уменьшить вдвое размер запроса, а при отказе и число запросов.
+
+        Args:
+            rejected: Отклонил ли кластер запрос из-за перегрузки.
+        """
+        self.batch_size = max(self.batch_size // 2, self.min_batch_size)
+        if rejected:
+            self.concurrency = max(self.concurrency // 2, 1)
+
+    def _increase(self) -> None:
+        """Увеличить размер запроса, а если он уже наибольший, их число."""
+        if self.batch_size < self.max_batch_size:
+            self.batch_size = min(
+                self.batch_size + self.batch_step, self.max_batch_size,
+            )
+        elif self.concurrency < self.max_concurrency:
+            self.concurrency += 1
@@ -0,0 +1,51 @@
+"""Документы, которые ElasticSearch отказался сохранить."""
+
+import json
+import threading
+from collections.abc import Iterable
+from datetime import datetime, timezone
+
+
+class DeadLetterFile:
+    """Файл NDJSON, куда откладываются документы с неисправимыми ошибками.
+
+    Каждая строка файла - запись с индексом, id документа, ошибкой
+    ElasticSearch и строками действия Bulk API, по которым документ
+    можно отправить повторно после исправления.  Записи только
+    дописываются в конец файла, поэтому файл можно читать и чистить
+    между запусками ETL.
+    """
+
+    def __init__(self, path: str):
+        """Проинициализировать путь к файлу.
+
+        Args:
+            path: Путь к файлу.
+        """
+        self.path = path
+        self._lock = threading.Lock()
+
+    def write(
+            self, index: str, failures: Iterable[tuple[str, bytes, dict]],
+            ) -> None:
+        """Дописать в файл документы, которые не удалось сохранить.
+
+        Args:
+            index: Индекс, в который отправлялись документы.
+            failures: Тройки из id документа, строк действия Bulk API
+                и ответа ElasticSearch с ошибкой.
+        """
+        failed_at = datetime.now(timezone.utc).isoformat()
+        records = ''.join(
+            json.dumps({
+                'failed_at': failed_at,
+                'index': index,
+                'id': id,
+                'error': result.get('error'),
+                'status': result.get('status'),
+                'bulk': data.decode(),
+            }, ensure_ascii=False) + '\n'
+            for id, data, result in failures
+        )
+        with self._lock, open(self.path, 'a', encoding='utf-8') as f:
+            f.write(records)
@@ -0,0 +1,160 @@
+"""Управление версиями индексов ElasticSearch."""
+
+import json
+import logging
+import time
+from pathlib import Path
+
+from elasticsearch import Elasticsearch
+
+SCHEMAS_DIR = Path(__file__).parent / 'schemas'
+
+DEFAULT_REFRESH_INTERVAL = '1s'
+DEFAULT_REPLICAS = 1
+
+
+def read_schema(alias: str) -> dict:
+    """Прочитать настройки и маппинг индекса из load/schemas.
+
+    Args:
+        alias: Название индекса, по которому к нему обращаются клиенты.
+
+    Returns:
+        Тело запроса на создание индекса.
+    """
+    with open(SCHEMAS_DIR / f'{alias}.json') as schema_file:
+        return json.load(schema_file)
+
+
+def versioned_name(alias: str) -> str:
+    """Сформировать название новой версии индекса.
+
+    Args:
+        alias: Название индекса, по которому к нему обращаются клиенты.
+
+    Returns:
+        Название вида movies_v20220801120000.
+    """
+    return f'{alias}_v{time.strftime("%Y%m%d%H%M%S")}'
+
+
+def aliased_indices(client: Elasticsearch, alias: str) -> list[str]:
+    """Найти индексы, на которые сейчас указывает алиас.
+
+    Args:
+        client: Подключение к ElasticSearch.
+        alias: Название алиаса.
+
+    Returns:
+        Названия индексов.
+    """
+    if not client.indices.exists_alias(name=alias):
+        return []
+    return sorted(client.indices.get_alias(name=alias))
+
+
+def live_replicas(client: Elasticsearch, alias: str) -> int:
+    """Узнать число реплик у индекса, с которым сейчас работают клиенты.
+
+    Args:
+        client: Подключение к ElasticSearch.
+        alias: Название алиаса или индекса.
+
+    Returns:
+        Число реплик или DEFAULT_REPLICAS, если индекса еще нет.
+    """
+    if not client.indices.exists(index=alias):
+        return DEFAULT_REPLICAS
+    settings = client.indices.get_settings(
+        index=alias, name='index.number_of_replicas',
+    )
+    replicas = [
+        int(index['settings']['index']['number_of_replicas'])
+        for index in settings.values()
+    ]
+    return max(replicas, default=DEFAULT_REPLICAS)
+
+
+def create_bulk_index(client: Elasticsearch, alias: str) -> str:
+    """Создать новую версию индекса, настроенную на массовую загрузку.
+
+    Индекс создается по той же схеме, что и рабочий, но без
+    периодического refresh и без реплик: сегменты не сбрасываются
+    каждую секунду, а документы не копируются на реплики во время
+    загрузки.
+
+    Args:
+        client: Подключение к ElasticSearch.
+        alias: Название индекса, по которому к нему обращаются клиенты.
+
+    Returns:
+        Название созданного индекса.
+    """
+    body = read_schema(alias)
+    body.setdefault('settings', {}).update(
+        refresh_interval='-1', number_of_replicas=0,
+    )
+    name = versioned_name(alias)
+    client.indices.create(index=name, body=body)
+    logging.info(f'Created {name} index for {alias} reindex.')
+    return name
+
+
+def finish_bulk_index(
+        client: Elasticsearch, name: str, alias: str, replicas: int,
+        merge_timeout: float,
+        ) -> None:
+    """Вернуть индексу рабочие настройки после массовой загрузки.
+
+    Сегменты сливаются до включения реплик, чтобы реплики копировали
+    уже слитый индекс, а не повторяли слияние каждая у себя.
+
+    Args:
+        client: Подключение к ElasticSearch.
+        name: Название загруженного индекса.
+        alias: Название индекса, по которому к нему обращаются клиенты.
+        replicas: Число реплик рабочего индекса.
+        merge_timeout: Сколько секунд ждать окончания force merge.
+    """
+    refresh_interval = read_schema(alias).get('settings', {}).get(
+        'refresh_interval', DEFAULT_REFRESH_INTERVAL,
+    )
+    client.indices.refresh(index=name)
+    client.indices.forcemerge(
+        index=name, max_num_segments=1, request_timeout=merge_timeout,
+    )
+    client.indices.put_settings(
+        index=name,
+        body={'index': {
+            'refresh_interval': refresh_interval,
+            'number_of_replicas': replicas,
+        }},
+    )
+
+
+def swap_alias(client: Elasticsearch, name: str, alias: str) -> list[str]:
+    """Атомарно переключить алиас на новую версию индекса.
+
+    Если под этим именем до сих пор живет обычный индекс, созданный
+    скриптами из elastic_search, он удаляется в том же запросе, что
+    и добавляется алиас.
+
+    Args:
+        client: Подключение к ElasticSearch.
+        name: Название новой версии индекса.
+        alias: Название алиаса.
+
+    Returns:
+        Прежние версии индекса, с которых снят алиас.
+    """
+    old_indices = aliased_indices(client, alias)
+    actions = [
+        {'remove': {'index': index, 'alias': alias}}
+        for index in old_indices
+    ]
+    if not old_indices and client.indices.exists(index=alias):
+        actions.append({'remove_index': {'index': alias}})
+    actions.append({'add': {'index': name, 'alias': alias}})
+    client.indices.update_aliases(body={'actions': actions})
+    logging.info(f'Switched {alias} alias to {name} index.')
+    return old_indices
@@ -1,55 +1,212 @@
 """Загрузка фильмов в Elastic Search."""
 
+import contextvars
+import itertools
+import time
 import uuid
+from collections import deque
+from collections.abc import Iterable
+from concurrent.futures import Future, ThreadPoolExecutor
 from contextlib import contextmanager
-from typing import Generator, Union
+from dataclasses import dataclass
+from threading import Lock
+from typing import Generator, Optional, Union
 
-from elasticsearch import Elasticsearch, helpers
-from elasticsearch.exceptions import NotFoundError
+from elasticsearch import Elasticsearch
+from elasticsearch.exceptions import NotFoundError, TransportError
+from elasticsearch.helpers import BulkIndexError
+from elasticsearch.serializer import Serializer
 
+import metrics
+import profiling
+from availability.backoff import backoff_delay
+from serializers import get_serializer
+from storage import Checkpoint, CheckpointLedger, MemoryStorage, State
 
-def create_connection(host: dict) -> Elasticsearch:
+from .bulk_controller import (TOO_MANY_REQUESTS, BulkController, is_retryable,
+                              is_transient)
+from .dead_letters import DeadLetterFile
+from .fingerprints import FingerprintStore, fingerprint, index_uuid
+
+# Наибольшая пауза перед повтором действий с временными ошибками.
+MAX_RETRY_PAUSE = 30
+
+# Добавляет в film_ids фильмы из params.doc, убирает фильмы из
+# params.remove и перезаписывает остальные поля документа.
+FILM_IDS_SCRIPT = """
+    List ids = ctx._source.film_ids == null
+        ? new ArrayList() : ctx._source.film_ids;
+    ids.removeAll(params.remove);
+    for (def id : params.doc.film_ids) {
+        if (!ids.contains(id)) {
+            ids.add(id);
+        }
+    }
+    ctx._source.putAll(params.doc);
+    ctx._source.film_ids = ids;
+"""
+
+
+@dataclass(frozen=True)
+class BulkAction:
+    """Действие Bulk API, сериализованное для отправки."""
+
+    id: str
+    # Строки NDJSON: описание действия и тело документа, если нужно.
+    data: bytes
+    # Отпечаток документа, который запишется после сохранения.  None
+    # для удаления и частичного обновления: их отпечаток сбрасывается.
+    digest: Optional[bytes] = None
+
+
+# Действия bulk-запроса и номер запроса в журнале отметок.
+Batch = tuple[list[BulkAction], int]
+
+
+def create_connection(
+        host: dict, serializer: Optional[Serializer] = None,
+        ) -> Elasticsearch:
     """Создать подключение к ElasticSearch.
 
     Args:
         host: Настройки подключения к базе данных.
+        serializer: Сериализатор JSON, по умолчанию самый быстрый
+            из установленных.
 
     Returns:
         Подключение к ElasticSearch.
     """
-    es = Elasticsearch([host])
+    es = Elasticsearch([host], serializer=serializer or get_serializer())
     return es
 
 
 @contextmanager
-def elastic_search_connection(host: dict) -> Generator[Elasticsearch, None, None]:
+def elastic_search_connection(
+        host: dict, serializer: Optional[Serializer] = None,
+        ) -> Generator[Elasticsearch, None, None]:
     """Создает подключение к ElasticSearch, которое закроет на выходе.
 
     Args:
         host: Настройки подключения.
+        serializer: Сериализатор JSON.
 
     Yields:
         Подключение к ElasticSearch.
     """
-    es = create_connection(host)
+    es = create_connection(host, serializer)
     yield es
     es.close()
 
 
 class ElasticSearchSaver:
-    """Загрузчик фильмов в индекс ElasticSearch."""
+    """Загрузчик фильмов в индекс ElasticSearch.
+
+    Документы сразу сериализуются в строки NDJSON для Bulk API,
+    поэтому размер буфера известен в байтах.  Буфер отправляется,
+    когда в нем набирается batch_size документов или max_batch_bytes
+    байт.  Отправка идет в фоновых потоках: одновременно в полете
+    может быть до max_in_flight bulk-запросов, а извлечение данных
+    из PostgreSQL в это время продолжается.
+
+    Отметки состояния от загрузчика передаются в журнал ledger и
+    записываются в состояние только после подтверждения всех
+    bulk-запросов с документами, полученными до отметки.
+
+    С базой отпечатков fingerprints документы, которые не изменились
+    с прошлой отправки, в буфер не попадают вовсе.
+
+    По ответу на bulk-запрос каждое действие разбирается отдельно.
+    Действия с временными ошибками (429, 503 и подобные) повторяются
+    до max_retries раз с растущей паузой, а остальной запрос повторно
+    не отправляется.  Документы с неисправимыми ошибками, например,
+    не подходящие под схему, откладываются в файл dead_letters и не
+    мешают подтвердить запрос.  Без файла такая ошибка прерывает
+    загрузку.
 
-    def __init__(self, es_client: Elasticsearch, index: str, batch_size=100):
+    С регулятором controller размер запроса и число запросов в полете
+    подстраиваются под время ответа кластера.  batch_size и
+    max_in_flight тогда задает регулятор.
+    """
+
+    def __init__(
+            self,
+            es_client: Elasticsearch,
+            index: str,
+            batch_size: int = 100,
+            max_batch_bytes: int = 5 * 1024 * 1024,
+            max_in_flight: int = 2,
+            ledger: Optional[CheckpointLedger] = None,
+            fingerprints: Optional[FingerprintStore] = None,
+            controller: Optional[BulkController] = None,
+            dead_letters: Optional[DeadLetterFile] = None,
+            max_retries: int = 5,
+            retry_pause: float = 0.5,
+            ):
         """Инициализация атрибутов класса.
 
         Args:
             es_client: Подключение к ElasticSearch.
+            index: Индекс для сохранения документов.
             batch_size: Размер буфера для сохраняемых объектов.
+            max_batch_bytes: Размер буфера в байтах.
+            max_in_flight: Сколько bulk-запросов отправлять одновременно.
+            ledger: Журнал отметок состояния.  Без него отметки
+                хранятся только в памяти и после завершения теряются.
+            fingerprints: База отпечатков сохраненных документов.
+            controller: Регулятор размера и числа bulk-запросов.
+            dead_letters: Файл для документов с неисправимыми ошибками.
+            max_retries: Сколько раз повторять действия с временными
+                ошибками.
+            retry_pause: Пауза перед первым повтором в секундах.
         """
         self.client = es_client
         self.index = index
-        self._documents = []
         self._batch_size = batch_size
+        self._max_batch_bytes = max_batch_bytes
+        self._max_in_flight = max_in_flight
+        self._controller = controller
+        if controller:
+            max_in_flight = controller.max_concurrency
+        self._ledger = ledger or CheckpointLedger(State(MemoryStorage()))
+        self._fingerprints = fingerprints
+        self._index_uuid = None
+        if fingerprints:
+            self._index_uuid = index_uuid(es_client, index)
+            fingerprints.bind(index, self._index_uuid)
+        self._dead_letters = dead_letters
+        self._max_retries = max_retries
+        self._retry_pause = retry_pause
+        self.skipped_count = 0
+        self.retried_count = 0
+        self.dead_letter_count = 0
+        self._counts_lock = Lock()
+        serializer = es_client.transport.serializer
+        self._dumpb = getattr(serializer, 'dumpb', None) or (
+            lambda data: serializer.dumps(data).encode()
+        )
+        self._ticket = None
+        self._actions: list[BulkAction] = []
+        self._documents_count = 0
+        self._bytes_count = 0
+        # Запросы в полете и ID их документов.
+        self._in_flight: deque[tuple[Future, frozenset]] = deque()
+        self._executor = self._create_executor(max_in_flight)
+
+    def _create_executor(
+            self, max_in_flight: int,
+            ) -> Optional[ThreadPoolExecutor]:
+        """Создать пул потоков для отправки bulk-запросов.
+
+        Args:
+            max_in_flight: Сколько bulk-запросов отправлять одновременно.
+
+        Returns:
+            Пул потоков или None, если запросы отправляются без потоков.
+        """
+        return ThreadPoolExecutor(
+            max_workers=max_in_flight,
+            thread_name_prefix=f'bulk_{self.index}',
+        )
 
     def save(self, document: dict) -> None:
         """Создать или обновить документ.
@@ -57,29 +214,358 @@ class ElasticSearchSaver:
         Args:
             document: Документ для Elastic Search.
         """
-        self._documents.append(document)
+        self._save_source(str(document['id']), self._dumps(document))
+
+    def save_raw(self, id: str, document: Union[str, bytes]) -> None:
+        """Создать или обновить документ, уже сериализованный в JSON.
+
+        Args:
+            id: Идентификатор документа.
+            document: Документ в виде строки JSON без переводов строк.
+        """
+        if isinstance(document, str):
+            document = document.encode()
+        self._save_source(str(id), document + b'\n')
+
+    def _save_source(self, id: str, source: bytes) -> None:
+        """Добавить в буфер сериализованный документ.
+
+        Args:
+            id: Идентификатор документа.
+            source: Документ в виде строки NDJSON.
+        """
+        hash = None
+        if self._index_uuid:
+            hash = fingerprint(source)
+            if self._fingerprints.get(self._index_uuid, id) == hash:
+                self.skipped_count += 1
+                metrics.SKIPPED_DOCUMENTS.inc(index=self.index)
+                return
+        action = {'index': {'_index': self.index, '_id': id}}
+        self._append(BulkAction(id, self._dumps(action) + source, hash))
+
+    def delete(self, id: str) -> None:
+        """Удалить документ, если он есть в индексе.
+
+        Args:
+            id: Идентификатор документа.
+        """
+        action = {'delete': {'_index': self.index, '_id': id}}
+        self._append(BulkAction(str(id), self._dumps(action)))
+
+    def update_film_ids(
+            self, document: dict, removed: Iterable[str],
+            film_ids: Iterable[str],
+            ) -> None:
+        """Частично обновить список фильмов документа.
+
+        Скрипт применяет к документу в индексе только изменения.  Если
+        документа в индексе нет, он создается из document со всеми
+        фильмами film_ids, а не только с добавленными.
+
+        Args:
+            document: Документ, в film_ids которого только добавленные
+                фильмы.
+            removed: Фильмы, которые нужно убрать из film_ids.
+            film_ids: Все фильмы объекта для создания документа.
+        """
+        id = str(document['id'])
+        action = {'update': {
+            '_index': self.index, '_id': id, 'retry_on_conflict': 3,
+        }}
+        source = {
+            'script': {
+                'source': FILM_IDS_SCRIPT,
+                'lang': 'painless',
+                'params': {'doc': document, 'remove': list(removed)},
+            },
+            'upsert': {**document, 'film_ids': list(film_ids)},
+        }
+        data = self._dumps(action) + self._dumps(source)
+        self._append(BulkAction(id, data))
+
+    def _dumps(self, line: dict) -> bytes:
+        """Сериализовать строку NDJSON для Bulk API.
+
+        Args:
+            line: Описание действия или тело документа.
+
+        Returns:
+            Строка с переводом строки в конце.
+        """
+        return self._dumpb(line) + b'\n'
+
+    def _append(self, action: BulkAction) -> None:
+        """Добавить действие Bulk API в буфер.
+
+        Args:
+            action: Сериализованное действие.
+        """
+        if self._ticket is None:
+            self._ticket = self._ledger.open_batch()
+        self._actions.append(action)
+        self._bytes_count += len(action.data)
+        self._documents_count += 1
+
+    @property
+    def batch_size(self) -> int:
+        """Текущий размер bulk-запроса в документах."""
+        if self._controller:
+            return self._controller.batch_size
+        return self._batch_size
+
+    @property
+    def max_in_flight(self) -> int:
+        """Сколько bulk-запросов сейчас можно держать в полете."""
+        if self._controller:
+            return self._controller.concurrency
+        return self._max_in_flight
+
+    def checkpoint(self, checkpoint: Checkpoint) -> None:
+        """Сохранить отметку состояния после уже сохраненных документов.
+
+        Args:
+            checkpoint: Отметка состояния от загрузчика.
+        """
+        self._ledger.add(checkpoint)
 
     def is_batch_ready(self) -> bool:
         """Проверить заполнен ли буфер.
 
         Returns:
-            Истина, если в буфере больше self._batch_size объектов.
+            Истина, если в буфере больше self.batch_size объектов
+            или self._max_batch_bytes байт.
         """
-        return len(self._documents) >= self._batch_size
+        return (
+            self._documents_count >= self.batch_size
+            or self._bytes_count >= self._max_batch_bytes
+        )
 
     def flush(self) -> None:
-        """Сохранить все объекты из буфера в ElasticSearch."""
-        def get_actions(documents: list[dict]) -> Generator[dict, None, None]:
-            for document in documents:
-                action = {
-                    '_index': self.index,
-                    '_op_type': 'index',
-                    '_id': document['id'],
-                    '_source': document,
-                }
-                yield action
-        helpers.bulk(self.client, get_actions(self._documents))
-        self._documents = []
+        """Отправить все объекты из буфера в ElasticSearch.
+
+        Не дожидается ответа ElasticSearch, если в полете меньше
+        max_in_flight запросов и ни в одном из них нет документов
+        с теми же ID.  Иначе сначала ждет завершения самых старых
+        запросов и пробрасывает их ошибку.
+        """
+        with profiling.span('load.flush'):
+            self._reap()
+            batch = self._take_batch()
+            if batch is None:
+                return
+            ids = frozenset(action.id for action in batch[0])
+            while self._must_wait(self._in_flight, ids):
+                self._in_flight.popleft()[0].result()
+            # Поток отправки наследует контекст, в том числе профиль.
+            future = self._executor.submit(
+                contextvars.copy_context().run, self._send, *batch,
+            )
+            self._in_flight.append((future, ids))
+
+    def _must_wait(self, in_flight: deque, ids: frozenset) -> bool:
+        """Проверить, нужно ли дождаться самого старого запроса.
+
+        Запросы в полете могут завершиться в любом порядке.  Если
+        документ с тем же ID уже отправлен, новая версия ждет его
+        ответа, иначе старая версия могла бы перезаписать новую.
+
+        Args:
+            in_flight: Запросы в полете и ID их документов.
+            ids: ID документов нового запроса.
+
+        Returns:
+            Истина, если новый запрос пока отправлять нельзя.
+        """
+        return bool(in_flight) and (
+            len(in_flight) >= self.max_in_flight
+            or any(not ids.isdisjoint(sent) for _, sent in in_flight)
+        )
+
+    def join(self) -> None:
+        """Дождаться ответа на все отправленные bulk-запросы."""
+        while self._in_flight:
+            self._in_flight.popleft()[0].result()
+
+    def close(self) -> None:
+        """Отправить остаток буфера, дождаться ответов и остановить потоки."""
+        try:
+            self.flush()
+            self.join()
+        except BaseException:
+            self.cancel()
+            raise
+        self._executor.shutdown()
+
+    def cancel(self) -> None:
+        """Остановить отправку после ошибки, не отправляя остаток буфера.
+
+        Запросы, которые еще не начали отправляться, отменяются, а уже
+        отправленные дожидаются ответа, чтобы их отпечатки не писались
+        после закрытия базы отпечатков.
+        """
+        self._in_flight.clear()
+        self._executor.shutdown(cancel_futures=True)
+
+    def _take_batch(self) -> Optional[Batch]:
+        """Забрать содержимое буфера для отправки и очистить буфер.
+
+        Returns:
+            Действия bulk-запроса и номер запроса в журнале отметок
+            или None, если буфер пуст.
+        """
+        if not self._actions:
+            return None
+        batch = (self._actions, self._ticket)
+        self._actions = []
+        self._documents_count = 0
+        self._bytes_count = 0
+        self._ticket = None
+        return batch
+
+    def _reap(self) -> None:
+        """Забрать результаты уже завершенных bulk-запросов."""
+        while self._in_flight and self._in_flight[0][0].done():
+            self._in_flight.popleft()[0].result()
+
+    def _send(self, actions: list[BulkAction], ticket: int) -> None:
+        """Отправить bulk-запрос в ElasticSearch.
+
+        Args:
+            actions: Действия запроса.
+            ticket: Номер запроса в журнале отметок.
+
+        Raises:
+            BulkIndexError: Если действия не удались и после повторов
+                или неисправимую ошибку некуда отложить.
+            TransportError: Если запрос не принят целиком не из-за
+                временного сбоя.
+        """
+        for attempt in itertools.count(1):
+            with profiling.span('load.send'):
+                started = time.monotonic()
+                try:
+                    response = self.client.bulk(
+                        body=self._body(actions),
+                    )
+                except TransportError as error:
+                    if not is_transient(error):
+                        raise
+                    response = None
+                latency = time.monotonic() - started
+                actions, errors = self._settle(actions, response, latency)
+            if not actions:
+                break
+            time.sleep(self._retry_delay(attempt, actions, errors))
+        self._ledger.ack(ticket)
+
+    def _body(self, actions: list[BulkAction]) -> bytes:
+        """Собрать тело bulk-запроса.
+
+        Args:
+            actions: Действия запроса.
+
+        Returns:
+            Тело запроса в формате NDJSON.
+        """
+        return b''.join(action.data for action in actions)
+
+    def _settle(
+            self,
+            actions: list[BulkAction],
+            response: Optional[dict],
+            latency: float,
+            ) -> tuple[list[BulkAction], list[dict]]:
+        """Разобрать ответ на bulk-запрос по действиям.
+
+        Записывает отпечатки сохраненных документов, откладывает
+        документы с неисправимыми ошибками и сообщает регулятору
+        время ответа и отказы.
+
+        Args:
+            actions: Отправленные действия.
+            response: Ответ ElasticSearch или None, если запрос
+                не выполнен целиком из-за перегрузки или обрыва
+                соединения.
+            latency: Время ответа в секундах.
+
+        Returns:
+            Действия, которые нужно повторить, и их ошибки.
+
+        Raises:
+            BulkIndexError: Если есть неисправимые ошибки, а файла для
+                них нет.
+        """
+        metrics.BULK_SECONDS.observe(latency, index=self.index)
+        if response is not None:
+            metrics.BULK_DOCUMENTS.inc(len(actions), index=self.index)
+            metrics.BULK_BYTES.inc(
+                sum(len(action.data) for action in actions),
+                index=self.index,
+            )
+        stored, retry, errors, failed = [], [], [], []
+        if response is None:
+            retry = actions
+        elif not response['errors']:
+            stored = actions
+        else:
+            for action, item in zip(actions, response['items']):
+                result = next(iter(item.values()))
+                if 'error' not in result:
+                    stored.append(action)
+                elif is_retryable(result):
+                    retry.append(action)
+                    errors.append(item)
+                else:
+                    failed.append((action, item, result))
+        if self._controller:
+            rejected = response is None or any(
+                next(iter(item.values())).get('status') == TOO_MANY_REQUESTS
+                for item in errors
+            )
+            self._controller.observe(latency, rejected)
+        if self._index_uuid:
+            self._fingerprints.update(self._index_uuid, [
+                (action.id, action.digest) for action in stored
+            ] + [(action.id, None) for action, _, _ in failed])
+        if failed and not self._dead_letters:
+            raise BulkIndexError(
+                f'{len(failed)} document(s) failed to index.',
+                [item for _, item, _ in failed],
+            )
+        if failed:
+            self._dead_letters.write(self.index, [
+                (action.id, action.data, result)
+                for action, _, result in failed
+            ])
+        with self._counts_lock:
+            self.retried_count += len(retry)
+            self.dead_letter_count += len(failed)
+        return retry, errors
+
+    def _retry_delay(
+            self, attempt: int, actions: list[BulkAction], errors: list[dict],
+            ) -> float:
+        """Узнать паузу перед повтором действий с временными ошибками.
+
+        Args:
+            attempt: Номер повтора, начиная с 1.
+            actions: Действия, которые нужно повторить.
+            errors: Их ошибки из ответа ElasticSearch.
+
+        Returns:
+            Пауза в секундах.
+
+        Raises:
+            BulkIndexError: Если повторы исчерпаны.
+        """
+        if attempt > self._max_retries:
+            raise BulkIndexError(
+                f'{len(actions)} document(s) failed to index '
+                f'after {self._max_retries} retries.',
+                errors,
+            )
+        return backoff_delay(attempt, self._retry_pause, 2, MAX_RETRY_PAUSE)
 
     def get(self, id: uuid.UUID) -> Union[dict, None]:
         """Получить документ по id.
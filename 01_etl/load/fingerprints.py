@@ -0,0 +1,179 @@
+"""Отпечатки документов, уже сохраненных в ElasticSearch."""
+
+import hashlib
+import sqlite3
+import threading
+from collections.abc import Iterable
+from contextlib import contextmanager
+from typing import Generator, Optional
+
+from elasticsearch import Elasticsearch
+from elasticsearch.exceptions import NotFoundError
+
+
+def fingerprint(source: bytes) -> bytes:
+    """Посчитать отпечаток сериализованного документа.
+
+    Args:
+        source: Документ в виде строки NDJSON.
+
+    Returns:
+        Хэш документа.
+    """
+    return hashlib.blake2b(source, digest_size=16).digest()
+
+
+def index_uuid(client: Elasticsearch, index: str) -> Optional[str]:
+    """Узнать uuid индекса, в который попадут документы.
+
+    Для алиаса возвращается uuid индекса, на который он указывает,
+    поэтому отпечатки новой версии индекса из reindex.py остаются
+    в силе после переключения алиаса.
+
+    Args:
+        client: Подключение к ElasticSearch.
+        index: Название индекса или алиаса.
+
+    Returns:
+        uuid индекса или None, если индекса еще нет.
+    """
+    try:
+        settings = client.indices.get_settings(index=index, name='index.uuid')
+    except NotFoundError:
+        return None
+    uuids = [item['settings']['index']['uuid'] for item in settings.values()]
+    return uuids[0] if len(uuids) == 1 else None
+
+
+class FingerprintStore:
+    """Отпечатки документов в SQLite по uuid индекса и id документа.
+
+    Отпечаток записывается только после того, как ElasticSearch
+    подтвердил bulk-запрос с документом, и удаляется вместе с
+    документом.  Если индекс пересоздан, его uuid меняется и старые
+    отпечатки сбрасываются.  Если файл потерян, отпечатков просто нет,
+    и каждый документ один раз отправляется заново.
+    """
+
+    def __init__(self, path: str):
+        """Открыть или создать базу отпечатков.
+
+        Args:
+            path: Путь к файлу SQLite.
+        """
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._db:
+            self._db.execute('PRAGMA journal_mode=WAL;')
+            self._db.execute("""
+                CREATE TABLE IF NOT EXISTS fingerprints (
+                    index_uuid TEXT NOT NULL,
+                    id TEXT NOT NULL,
+                    hash BLOB NOT NULL,
+                    PRIMARY KEY (index_uuid, id)
+                ) WITHOUT ROWID;
+            """)
+            self._db.execute("""
+                CREATE TABLE IF NOT EXISTS indices (
+                    name TEXT PRIMARY KEY,
+                    index_uuid TEXT NOT NULL
+                );
+            """)
+
+    def bind(self, name: str, uuid: Optional[str]) -> None:
+        """Запомнить, какой индекс сейчас скрывается под названием.
+
+        Если раньше под этим названием был другой индекс, его
+        отпечатки удаляются: документов в нем больше никто не увидит.
+
+        Args:
+            name: Название индекса или алиаса.
+            uuid: uuid индекса.
+        """
+        with self._lock, self._db:
+            row = self._db.execute(
+                'SELECT index_uuid FROM indices WHERE name = ?;', (name,),
+            ).fetchone()
+            if row and row[0] != uuid:
+                self._db.execute(
+                    'DELETE FROM fingerprints WHERE index_uuid = ?;', row,
+                )
+                self._db.execute(
+                    'DELETE FROM indices WHERE index_uuid = ?;', row,
+                )
+            if uuid is None:
+                self._db.execute('DELETE FROM indices WHERE name = ?;', (name,))
+                return
+            self._db.execute(
+                'INSERT OR REPLACE INTO indices (name, index_uuid) '
+                'VALUES (?, ?);',
+                (name, uuid),
+            )
+
+    def get(self, uuid: str, id: str) -> Optional[bytes]:
+        """Получить отпечаток документа.
+
+        Args:
+            uuid: uuid индекса.
+            id: Идентификатор документа.
+
+        Returns:
+            Отпечаток или None, если документа нет.
+        """
+        with self._lock:
+            row = self._db.execute(
+                'SELECT hash FROM fingerprints '
+                'WHERE index_uuid = ? AND id = ?;',
+                (uuid, id),
+            ).fetchone()
+        return row[0] if row else None
+
+    def update(
+            self,
+            uuid: str,
+            fingerprints: Iterable[tuple[str, Optional[bytes]]],
+            ) -> None:
+        """Записать отпечатки сохраненных и удалить отпечатки удаленных.
+
+        Args:
+            uuid: uuid индекса.
+            fingerprints: Пары из id документа и отпечатка, None для
+                удаленных документов.
+        """
+        saved, deleted = [], []
+        for id, hash in fingerprints:
+            if hash is None:
+                deleted.append((uuid, id))
+            else:
+                saved.append((uuid, id, hash))
+        with self._lock, self._db:
+            self._db.executemany(
+                'INSERT OR REPLACE INTO fingerprints (index_uuid, id, hash) '
+                'VALUES (?, ?, ?);',
+                saved,
+            )
+            self._db.executemany(
+                'DELETE FROM fingerprints WHERE index_uuid = ? AND id = ?;',
+                deleted,
+            )
+
+    def close(self) -> None:
+        """Закрыть базу отпечатков."""
+        self._db.close()
+
+
+@contextmanager
+def fingerprint_store(path: str) -> Generator[FingerprintStore, None, None]:
+    """Открывает базу отпечатков, которую закроет на выходе.
+
+    Args:
+        path: Путь к файлу SQLite.
+
+    Yields:
+        База отпечатков.
+    """
+    store = FingerprintStore(path)
+    try:
+        yield store
+    finally:
+        store.close()
@@ -0,0 +1,126 @@
+import asyncio
+from unittest import IsolatedAsyncioTestCase, main
+
+from elasticsearch.helpers import BulkIndexError
+
+from load.async_elastic_search_saver import AsyncElasticSearchSaver
+from load.bulk_controller import BulkController
+from load.fingerprints import FingerprintStore
+from load.unit_tests.elastic_search_saver_tests import FakeClient
+from load.unit_tests.fingerprints_tests import FakeIndices
+from storage import Checkpoint, CheckpointLedger, MemoryStorage, State
+
+
+class FakeAsyncIndices(FakeIndices):
+
+    async def get_settings(self, index, name):
+        return super().get_settings(index, name)
+
+
+class FakeAsyncClient(FakeClient):
+
+    def __init__(self, errors=False, delay=0):
+        super().__init__(errors=errors)
+        self.delay = delay
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.indices = FakeAsyncIndices('uuid-1')
+
+    async def bulk(self, body):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(self.delay)
+        self.in_flight -= 1
+        return super().bulk(body)
+
+
+class TestAsyncElasticSearchSaver(IsolatedAsyncioTestCase):
+
+    async def test_close_sends_all_documents(self):
+        client = FakeAsyncClient()
+        saver = AsyncElasticSearchSaver(client, 'movies', batch_size=2)
+        for id in range(3):
+            saver.save({'id': str(id)})
+            if saver.is_batch_ready():
+                await saver.flush_async()
+        await saver.close_async()
+        self.assertEqual(2, len(client.bodies))
+        self.assertIsNone(saver._executor)
+
+    async def test_bounds_requests_in_flight(self):
+        client = FakeAsyncClient(delay=0.01)
+        saver = AsyncElasticSearchSaver(
+            client, 'movies', batch_size=1, max_in_flight=2,
+        )
+        for id in range(6):
+            saver.save({'id': str(id)})
+            await saver.flush_async()
+        await saver.close_async()
+        self.assertEqual(6, len(client.bodies))
+        self.assertEqual(2, client.max_in_flight)
+
+    async def test_waits_for_same_id_in_flight(self):
+        client = FakeAsyncClient(delay=0.01)
+        saver = AsyncElasticSearchSaver(
+            client, 'movies', batch_size=1, max_in_flight=3,
+        )
+        for _ in range(3):
+            saver.save({'id': '1'})
+            await saver.flush_async()
+        await saver.close_async()
+        self.assertEqual(3, len(client.bodies))
+        self.assertEqual(1, client.max_in_flight)
+
+    async def test_checkpoint_after_acknowledged_bulk(self):
+        state = State(MemoryStorage())
+        saver = AsyncElasticSearchSaver(
+            FakeAsyncClient(), 'movies', ledger=CheckpointLedger(state),
+        )
+        saver.save({'id': '1'})
+        saver.checkpoint(Checkpoint('movies', 1))
+        self.assertIsNone(state.get_state('movies'))
+        await saver.close_async()
+        self.assertEqual(1, state.get_state('movies'))
+
+    async def test_raises_bulk_errors(self):
+        saver = AsyncElasticSearchSaver(FakeAsyncClient(errors=True), 'movies')
+        saver.save({'id': '1'})
+        with self.assertRaises(BulkIndexError):
+            await saver.close_async()
+
+    async def test_retries_rejected_documents(self):
+        client = FakeAsyncClient()
+        responses = [{'errors': True, 'items': [
+            {'index': {'status': 429, 'error': {}}},
+        ]}]
+        bulk = client.bulk
+
+        async def reject_once(body):
+            if responses:
+                return responses.pop()
+            return await bulk(body)
+
+        client.bulk = reject_once
+        saver = AsyncElasticSearchSaver(
+            client, 'movies', controller=BulkController(), retry_pause=0,
+        )
+        saver.save({'id': '1'})
+        await saver.close_async()
+        self.assertEqual(1, len(client.bodies))
+        self.assertEqual(1, saver.retried_count)
+
+    async def test_skips_unchanged_documents(self):
+        client = FakeAsyncClient()
+        store = FingerprintStore(':memory:')
+        self.addCleanup(store.close)
+        for _ in range(2):
+            saver = AsyncElasticSearchSaver(client, 'movies')
+            await saver.bind_fingerprints(store)
+            saver.save({'id': '1'})
+            await saver.close_async()
+        self.assertEqual(1, saver.skipped_count)
+        self.assertEqual(1, len(client.bodies))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+from unittest import TestCase, main
+
+from load.bulk_controller import BulkController, is_retryable
+from load.elastic_search_saver import ElasticSearchSaver
+from load.unit_tests.elastic_search_saver_tests import (FakeClient,
+                                                        RejectingClient)
+
+
+class TestBulkController(TestCase):
+
+    def setUp(self):
+        self.controller = BulkController(
+            batch_size=100, min_batch_size=10, max_batch_size=200,
+            max_concurrency=4, target_latency=1, batch_step=50,
+        )
+
+    def test_grows_batch_then_concurrency(self):
+        self.controller.concurrency = 2
+        for _ in range(3):
+            self.controller.observe(0.1)
+        self.assertEqual(200, self.controller.batch_size)
+        self.assertEqual(3, self.controller.concurrency)
+
+    def test_halves_batch_on_slow_response(self):
+        self.controller.observe(2)
+        self.assertEqual(50, self.controller.batch_size)
+        self.assertEqual(4, self.controller.concurrency)
+
+    def test_halves_batch_and_concurrency_on_rejection(self):
+        for _ in range(5):
+            self.controller.observe(0.1, rejected=True)
+        self.assertEqual(10, self.controller.batch_size)
+        self.assertEqual(1, self.controller.concurrency)
+
+    def test_is_retryable(self):
+        self.assertTrue(is_retryable({'status': 429, 'error': {}}))
+        self.assertTrue(is_retryable({'status': 503, 'error': {}}))
+        self.assertFalse(is_retryable({'status': 400, 'error': {}}))
+        self.assertFalse(is_retryable({'status': 201}))
+
+
+class TestSaverController(TestCase):
+
+    def test_rejections_reduce_concurrency(self):
+        controller = BulkController()
+        saver = ElasticSearchSaver(
+            RejectingClient(2), 'movies', controller=controller,
+            retry_pause=0,
+        )
+        saver.save({'id': '1'})
+        saver.close()
+        self.assertEqual(1, controller.concurrency)
+
+    def test_batch_size_follows_controller(self):
+        controller = BulkController(batch_size=20, min_batch_size=10)
+        saver = ElasticSearchSaver(
+            FakeClient(), 'movies', controller=controller,
+        )
+        controller.observe(5)
+        self.assertEqual(10, saver.batch_size)
+        saver.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+from unittest import TestCase, main
+
+from load.elastic_search_index import (create_bulk_index, finish_bulk_index,
+                                       live_replicas, read_schema, swap_alias)
+
+
+class FakeIndices:
+
+    def __init__(self, indices=None, aliases=None):
+        self.indices = dict(indices or {})
+        self.aliases = dict(aliases or {})
+        self.calls = []
+
+    def exists(self, index):
+        return index in self.indices or index in self.aliases.values()
+
+    def exists_alias(self, name):
+        return name in self.aliases.values()
+
+    def get_alias(self, name):
+        return {
+            index: {'aliases': {alias: {}}}
+            for index, alias in self.aliases.items() if alias == name
+        }
+
+    def get_settings(self, index, name):
+        return {
+            name: {'settings': {'index': {'number_of_replicas': '2'}}}
+            for name, alias in self.aliases.items() if alias == index
+        }
+
+    def create(self, index, body):
+        self.indices[index] = body
+
+    def put_settings(self, index, body):
+        self.calls.append(('put_settings', index, body))
+
+    def refresh(self, index):
+        self.calls.append(('refresh', index))
+
+    def forcemerge(self, index, max_num_segments, request_timeout):
+        self.calls.append(
+            ('forcemerge', index, max_num_segments, request_timeout),
+        )
+
+    def update_aliases(self, body):
+        self.calls.append(('update_aliases', body['actions']))
+
+
+class FakeClient:
+
+    def __init__(self, indices=None, aliases=None):
+        self.indices = FakeIndices(indices, aliases)
+
+
+class TestElasticSearchIndex(TestCase):
+
+    def test_bulk_index_has_no_refresh_and_replicas(self):
+        client = FakeClient()
+        name = create_bulk_index(client, 'movies')
+        self.assertTrue(name.startswith('movies_v'))
+        body = client.indices.indices[name]
+        self.assertEqual(body['settings']['refresh_interval'], '-1')
+        self.assertEqual(body['settings']['number_of_replicas'], 0)
+        self.assertEqual(body['mappings'], read_schema('movies')['mappings'])
+
+    def test_finish_merges_before_restoring_settings(self):
+        client = FakeClient()
+        finish_bulk_index(client, 'genres_v1', 'genres', 1, 600)
+        self.assertEqual(client.indices.calls, [
+            ('refresh', 'genres_v1'),
+            ('forcemerge', 'genres_v1', 1, 600),
+            ('put_settings', 'genres_v1', {'index': {
+                'refresh_interval': '1s', 'number_of_replicas': 1,
+            }}),
+        ])
+
+    def test_live_replicas(self):
+        client = FakeClient(aliases={'movies_v1': 'movies'})
+        self.assertEqual(live_replicas(client, 'movies'), 2)
+        self.assertEqual(live_replicas(FakeClient(), 'movies'), 1)
+
+    def test_swap_alias_from_old_version(self):
+        client = FakeClient(aliases={'movies_v1': 'movies'})
+        old_indices = swap_alias(client, 'movies_v2', 'movies')
+        self.assertEqual(old_indices, ['movies_v1'])
+        self.assertEqual(client.indices.calls, [('update_aliases', [
+            {'remove': {'index': 'movies_v1', 'alias': 'movies'}},
+            {'add': {'index': 'movies_v2', 'alias': 'movies'}},
+        ])])
+
+    def test_swap_alias_replaces_concrete_index(self):
+        client = FakeClient(indices={'movies': {}})
+        old_indices = swap_alias(client, 'movies_v1', 'movies')
+        self.assertEqual(old_indices, [])
+        self.assertEqual(client.indices.calls, [('update_aliases', [
+            {'remove_index': {'index': 'movies'}},
+            {'add': {'index': 'movies_v1', 'alias': 'movies'}},
+        ])])
+
+
+if __name__ == '__main__':
+    main()
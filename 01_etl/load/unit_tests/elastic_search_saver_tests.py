@@ -0,0 +1,349 @@
+import json
+import os
+import tempfile
+import threading
+import time
+from unittest import TestCase, main
+
+from elasticsearch.exceptions import ConnectionError, TransportError
+from elasticsearch.helpers import BulkIndexError
+from elasticsearch.serializer import JSONSerializer
+
+import metrics
+import profiling
+from load.dead_letters import DeadLetterFile
+from load.elastic_search_saver import ElasticSearchSaver
+from storage import Checkpoint, CheckpointLedger
+
+
+class FakeTransport:
+    serializer = JSONSerializer()
+
+
+class FakeClient:
+    transport = FakeTransport()
+
+    def __init__(self, errors=False):
+        self.bodies = []
+        self.errors = errors
+        self.lock = threading.Lock()
+
+    def bulk(self, body):
+        with self.lock:
+            self.bodies.append(body)
+        lines = [json.loads(line) for line in body.splitlines()]
+        items = []
+        for line in lines:
+            for op_type, meta in line.items():
+                if op_type in ('index', 'delete', 'update'):
+                    items.append({op_type: {'_id': meta['_id'], 'status': 200}})
+        if self.errors:
+            items[0]['index']['error'] = {'type': 'mapper_parsing_exception'}
+        return {'errors': self.errors, 'items': items}
+
+
+class SlowClient(FakeClient):
+    """Считает, сколько bulk-запросов выполняется одновременно."""
+
+    def __init__(self):
+        super().__init__()
+        self.running = 0
+        self.peak = 0
+
+    def bulk(self, body):
+        with self.lock:
+            self.running += 1
+            self.peak = max(self.peak, self.running)
+        time.sleep(0.02)
+        with self.lock:
+            self.running -= 1
+        return super().bulk(body)
+
+
+class RejectingClient(FakeClient):
+    """Отклоняет последний документ первых rejections запросов."""
+
+    def __init__(self, rejections, status=429, whole_request=False):
+        super().__init__()
+        self.rejections = rejections
+        self.status = status
+        self.whole_request = whole_request
+
+    def bulk(self, body):
+        if not self.rejections:
+            return super().bulk(body)
+        self.rejections -= 1
+        if self.whole_request:
+            raise TransportError(429, 'es_rejected_execution_exception')
+        response = super().bulk(body)
+        result = next(iter(response['items'][-1].values()))
+        result['status'] = self.status
+        result['error'] = {'type': 'es_rejected_execution_exception'}
+        response['errors'] = True
+        return response
+
+
+class DisconnectingClient(FakeClient):
+    """Теряет соединение на первых disconnects запросах."""
+
+    def __init__(self, disconnects):
+        super().__init__()
+        self.disconnects = disconnects
+
+    def bulk(self, body):
+        if not self.disconnects:
+            return super().bulk(body)
+        self.disconnects -= 1
+        raise ConnectionError('N/A', 'Connection reset by peer')
+
+
+class TestElasticSearchSaver(TestCase):
+
+    def setUp(self):
+        self.client = FakeClient()
+
+    def test_batch_ready_by_count(self):
+        saver = ElasticSearchSaver(self.client, 'movies', batch_size=2)
+        saver.save({'id': '1'})
+        self.assertFalse(saver.is_batch_ready())
+        saver.save({'id': '2'})
+        self.assertTrue(saver.is_batch_ready())
+        saver.close()
+
+    def test_batch_ready_by_bytes(self):
+        saver = ElasticSearchSaver(
+            self.client, 'movies', batch_size=100, max_batch_bytes=100,
+        )
+        saver.save({'id': '1', 'title': 'x' * 100})
+        self.assertTrue(saver.is_batch_ready())
+        saver.close()
+
+    def test_close_sends_all_documents(self):
+        saver = ElasticSearchSaver(self.client, 'movies', batch_size=2)
+        for i in range(5):
+            saver.save({'id': str(i)})
+            if saver.is_batch_ready():
+                saver.flush()
+        saver.close()
+        self.assertEqual(3, len(self.client.bodies))
+        ids = [
+            json.loads(line)['index']['_id']
+            for body in self.client.bodies
+            for line in body.splitlines()[::2]
+        ]
+        self.assertEqual(['0', '1', '2', '3', '4'], sorted(ids))
+
+    def test_counts_bulk_metrics(self):
+        documents = metrics.BULK_DOCUMENTS.value(index='metered')
+        sent = metrics.BULK_BYTES.value(index='metered')
+        saver = ElasticSearchSaver(self.client, 'metered')
+        saver.save({'id': '1'})
+        saver.delete('2')
+        saver.close()
+        self.assertEqual(
+            documents + 2, metrics.BULK_DOCUMENTS.value(index='metered'),
+        )
+        self.assertEqual(
+            sent + len(self.client.bodies[0]),
+            metrics.BULK_BYTES.value(index='metered'),
+        )
+
+    def test_counts_only_answered_requests(self):
+        documents = metrics.BULK_DOCUMENTS.value(index='metered')
+        saver = ElasticSearchSaver(
+            DisconnectingClient(2), 'metered', retry_pause=0,
+        )
+        saver.save({'id': '1'})
+        saver.close()
+        self.assertEqual(
+            documents + 1, metrics.BULK_DOCUMENTS.value(index='metered'),
+        )
+
+    def test_profiles_requests_in_sending_threads(self):
+        with (
+            tempfile.TemporaryDirectory() as directory,
+            profiling.cycle(frozenset(('spans',)), directory) as profiles,
+            profiling.profile('movies'),
+        ):
+            saver = ElasticSearchSaver(self.client, 'movies', batch_size=1)
+            for id in ('1', '2'):
+                saver.save({'id': id})
+                saver.flush()
+            saver.close()
+        self.assertEqual(2, profiles[0].timings()['load.send'][0])
+
+    def test_deletes_documents(self):
+        saver = ElasticSearchSaver(self.client, 'movies')
+        saver.save({'id': '1'})
+        saver.delete('2')
+        saver.close()
+        lines = [json.loads(line) for line in self.client.bodies[0].splitlines()]
+        self.assertEqual({'delete': {'_index': 'movies', '_id': '2'}}, lines[-1])
+
+    def test_saves_raw_documents(self):
+        saver = ElasticSearchSaver(self.client, 'movies')
+        saver.save_raw('1', '{"id" : "1", "title" : "x"}')
+        saver.close()
+        action, source = self.client.bodies[0].splitlines()
+        self.assertEqual('1', json.loads(action)['index']['_id'])
+        self.assertEqual(b'{"id" : "1", "title" : "x"}', source)
+
+    def test_updates_film_ids(self):
+        saver = ElasticSearchSaver(self.client, 'genres')
+        saver.update_film_ids(
+            {'id': '1', 'film_ids': ['f1']}, ('f2',), ('f1', 'f3'),
+        )
+        saver.close()
+        action, source = [
+            json.loads(line) for line in self.client.bodies[0].splitlines()
+        ]
+        self.assertEqual('1', action['update']['_id'])
+        self.assertEqual(['f2'], source['script']['params']['remove'])
+        self.assertEqual(['f1'], source['script']['params']['doc']['film_ids'])
+        self.assertEqual(
+            {'id': '1', 'film_ids': ['f1', 'f3']}, source['upsert'],
+        )
+
+    def test_raises_failed_documents(self):
+        saver = ElasticSearchSaver(FakeClient(errors=True), 'movies')
+        saver.save({'id': '1'})
+        with self.assertRaises(BulkIndexError):
+            saver.close()
+        with self.assertRaises(RuntimeError):
+            saver._executor.submit(print)
+
+    def test_checkpoint_without_ledger(self):
+        client = FakeClient()
+        saver = ElasticSearchSaver(client, 'movies')
+        saver.save({'id': '1'})
+        saver.checkpoint(Checkpoint('movies', 1))
+        saver.close()
+        self.assertEqual(1, len(client.bodies))
+
+    def test_keeps_max_in_flight(self):
+        client = SlowClient()
+        saver = ElasticSearchSaver(
+            client, 'movies', batch_size=1, max_in_flight=2,
+        )
+        for i in range(6):
+            saver.save({'id': str(i)})
+            saver.flush()
+        saver.close()
+        self.assertEqual(6, len(client.bodies))
+        self.assertEqual(2, client.peak)
+
+    def test_waits_for_same_id_in_flight(self):
+        client = SlowClient()
+        saver = ElasticSearchSaver(
+            client, 'movies', batch_size=1, max_in_flight=3,
+        )
+        for version in range(3):
+            saver.save({'id': '1', 'version': version})
+            saver.flush()
+        saver.close()
+        versions = [
+            json.loads(body.splitlines()[1])['version']
+            for body in client.bodies
+        ]
+        self.assertEqual([0, 1, 2], versions)
+        self.assertEqual(1, client.peak)
+
+
+class TestSaverRetries(TestCase):
+
+    def save(self, client, *ids, **kwargs):
+        saver = ElasticSearchSaver(client, 'movies', retry_pause=0, **kwargs)
+        for id in ids:
+            saver.save({'id': id})
+        saver.close()
+        return saver
+
+    def test_retries_only_rejected_documents(self):
+        client = RejectingClient(2)
+        saver = self.save(client, '1', '2')
+        ids = [
+            [
+                json.loads(line)['index']['_id']
+                for line in body.splitlines()[::2]
+            ]
+            for body in client.bodies
+        ]
+        self.assertEqual([['1', '2'], ['2'], ['2']], ids)
+        self.assertEqual(2, saver.retried_count)
+
+    def test_retries_rejected_request(self):
+        client = RejectingClient(1, whole_request=True)
+        self.save(client, '1')
+        self.assertEqual(1, len(client.bodies))
+
+    def test_resends_request_after_lost_connection(self):
+        client = DisconnectingClient(2)
+        saver = self.save(client, '1', '2')
+        self.assertEqual(1, len(client.bodies))
+        self.assertEqual(4, saver.retried_count)
+
+    def test_raises_when_retries_exhausted(self):
+        with self.assertRaises(BulkIndexError):
+            self.save(RejectingClient(3), '1', max_retries=2)
+
+    def test_dead_letters_permanent_failures(self):
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        self.addCleanup(os.unlink, path)
+        state = FakeState()
+        client = RejectingClient(1, status=400)
+        saver = ElasticSearchSaver(
+            client, 'movies',
+            ledger=CheckpointLedger(state),
+            dead_letters=DeadLetterFile(path),
+        )
+        saver.save({'id': '1'})
+        saver.save({'id': '2'})
+        saver.checkpoint(Checkpoint('key', 2))
+        saver.close()
+        self.assertEqual(1, len(client.bodies))
+        self.assertEqual(1, saver.dead_letter_count)
+        self.assertEqual({'key': 2}, state.state)
+        with open(path) as f:
+            record = json.loads(f.read())
+        self.assertEqual('2', record['id'])
+        self.assertEqual(400, record['status'])
+        self.assertIn('"_id":"2"', record['bulk'])
+
+
+class FakeState:
+
+    def __init__(self):
+        self.state = {}
+
+    def set_state(self, key, value):
+        self.state[key] = value
+
+
+class TestSaverCheckpoints(TestCase):
+
+    def setUp(self):
+        self.state = FakeState()
+        self.ledger = CheckpointLedger(self.state)
+
+    def test_commits_checkpoint_after_bulk(self):
+        saver = ElasticSearchSaver(FakeClient(), 'movies', ledger=self.ledger)
+        saver.save({'id': '1'})
+        saver.checkpoint(Checkpoint('key', 1))
+        self.assertEqual({}, self.state.state)
+        saver.close()
+        self.assertEqual({'key': 1}, self.state.state)
+
+    def test_keeps_checkpoint_of_failed_bulk(self):
+        saver = ElasticSearchSaver(
+            FakeClient(errors=True), 'movies', ledger=self.ledger,
+        )
+        saver.save({'id': '1'})
+        saver.checkpoint(Checkpoint('key', 1))
+        with self.assertRaises(BulkIndexError):
+            saver.close()
+        self.assertEqual({}, self.state.state)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+from unittest import TestCase, main
+
+from load.elastic_search_saver import ElasticSearchSaver
+from load.fingerprints import FingerprintStore, fingerprint
+from load.unit_tests.elastic_search_saver_tests import FakeClient
+
+
+class FakeIndices:
+
+    def __init__(self, uuid):
+        self.uuid = uuid
+
+    def get_settings(self, index, name):
+        return {f'{index}_v1': {'settings': {'index': {'uuid': self.uuid}}}}
+
+
+class FakeIndexedClient(FakeClient):
+
+    def __init__(self, uuid='uuid-1', errors=False):
+        super().__init__(errors=errors)
+        self.indices = FakeIndices(uuid)
+
+
+class TestFingerprintStore(TestCase):
+
+    def setUp(self):
+        self.store = FingerprintStore(':memory:')
+
+    def tearDown(self):
+        self.store.close()
+
+    def test_update_and_delete(self):
+        self.store.update('uuid-1', [('1', b'a'), ('2', b'b')])
+        self.store.update('uuid-1', [('1', None)])
+        self.assertIsNone(self.store.get('uuid-1', '1'))
+        self.assertEqual(b'b', self.store.get('uuid-1', '2'))
+
+    def test_rebind_drops_fingerprints_of_old_index(self):
+        self.store.bind('movies', 'uuid-1')
+        self.store.update('uuid-1', [('1', b'a')])
+        self.store.bind('movies', 'uuid-1')
+        self.assertEqual(b'a', self.store.get('uuid-1', '1'))
+        self.store.bind('movies', 'uuid-2')
+        self.assertIsNone(self.store.get('uuid-1', '1'))
+
+
+class TestSaverFingerprints(TestCase):
+
+    def setUp(self):
+        self.store = FingerprintStore(':memory:')
+
+    def tearDown(self):
+        self.store.close()
+
+    def save(self, client, *documents):
+        saver = ElasticSearchSaver(client, 'movies', fingerprints=self.store)
+        for document in documents:
+            saver.save(document)
+        saver.close()
+        return saver
+
+    def test_skips_unchanged_documents(self):
+        client = FakeIndexedClient()
+        self.save(client, {'id': '1', 'title': 'a'}, {'id': '2', 'title': 'b'})
+        saver = self.save(
+            client, {'id': '1', 'title': 'a'}, {'id': '2', 'title': 'c'},
+        )
+        self.assertEqual(1, saver.skipped_count)
+        self.assertEqual(2, len(client.bodies))
+        self.assertNotIn(b'"a"', client.bodies[1])
+
+    def test_resends_after_failed_bulk(self):
+        with self.assertRaises(Exception):
+            self.save(FakeIndexedClient(errors=True), {'id': '1'})
+        client = FakeIndexedClient()
+        saver = self.save(client, {'id': '1'})
+        self.assertEqual(0, saver.skipped_count)
+        self.assertEqual(1, len(client.bodies))
+
+    def test_resends_to_recreated_index(self):
+        self.save(FakeIndexedClient('uuid-1'), {'id': '1'})
+        client = FakeIndexedClient('uuid-2')
+        saver = self.save(client, {'id': '1'})
+        self.assertEqual(0, saver.skipped_count)
+
+    def test_resends_deleted_document(self):
+        client = FakeIndexedClient()
+        self.save(client, {'id': '1'})
+        saver = ElasticSearchSaver(client, 'movies', fingerprints=self.store)
+        saver.delete('1')
+        saver.close()
+        saver = self.save(client, {'id': '1'})
+        self.assertEqual(0, saver.skipped_count)
+
+    def test_fingerprint_depends_on_content(self):
+        self.assertNotEqual(fingerprint(b'{"a":1}'), fingerprint(b'{"a":2}'))
+
+
+if __name__ == '__main__':
+    main()
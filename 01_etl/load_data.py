@@ -1,69 +1,340 @@
 """Основной модуль для импорта кино из PostgreSQL в ElasticSearch."""
 
 import logging
+import signal
 import time
+from collections.abc import Iterable, Sequence
+from concurrent.futures import Executor, ThreadPoolExecutor, as_completed
+from contextlib import nullcontext
+from typing import ContextManager, Optional
 
+from elasticsearch import Elasticsearch
 from elasticsearch.exceptions import ConnectionError
+from elasticsearch.serializer import Serializer
 from psycopg2 import OperationalError
+from psycopg2.extensions import connection as pg_connection
 
+import metrics
+import pipeline
+import profiling
 import settings
-from availability.backoff import backoff
+from availability.backoff import RetryBudget, backoff
 from extract.postgres_genre_loader import PostgresGenreLoader
-from extract.postgres_loader import PostgresLoader, postgres_connection
+from extract.postgres_listener import PostgresListener
+from extract.postgres_loader import (Deleted, FilmIdsDelta, PostgresLoader,
+                                     pooled_connection, postgres_connection,
+                                     postgres_pool, purge_change_log)
 from extract.postgres_movie_loader import PostgresMovieLoader
 from extract.postgres_person_loader import PostgresPersonLoader
 from load.elastic_search_saver import (ElasticSearchSaver,
                                        elastic_search_connection)
+from load_data_async import run_pipelines_async
 from logger import logger
-from storage import JsonFileStorage, State
+from serializers import get_serializer
+from storage import Checkpoint, CheckpointLedger, JsonFileStorage, State
+from transform.parallel import Serialized, TransformPool, create_executor
 
 logging.basicConfig(**logger.settings)
 
+# Общий бюджет перезапусков etl после ошибок подключения.
+RETRY_BUDGET = (
+    RetryBudget(settings.ETL_RETRY_BUDGET, settings.ETL_RETRY_BUDGET_PERIOD)
+    if settings.ETL_RETRY_BUDGET else None
+)
+
+PROFILE_MODES = profiling.parse_modes(settings.ETL_PROFILE)
+
+INDEX_LOADERS = (
+    PostgresMovieLoader,
+    PostgresGenreLoader,
+    PostgresPersonLoader,
+)
+
+
 def load(
         loader: PostgresLoader, saver: ElasticSearchSaver,
+        change_log: bool = False,
+        transform_pool: Optional[TransformPool] = None,
         ) -> None:
     """Для каждой строки фильма из PostgreSQL создать документ в ElasticSearch.
 
     Args:
         loader: загрузчик фильмов из PostgreSQL.
         saver: загрузчик фильмов в ElasticSearch.
+        change_log: Брать изменения из журнала, а не сканом таблиц.
+        transform_pool: Собирать документы в пуле процессов.
     """
-    validator = loader.validator
-    for row in loader.load_all():
-        obj = validator(**row)
-        saver.save(obj.as_document())
-        if saver.is_batch_ready():
-            saver.flush()
-    saver.flush()
-
-
-@backoff((OperationalError,))
-@backoff((ConnectionError,))
-def etl() -> None:
-    """Инициировать загрузку фильмов из PostgreSQL в ElasticSearch."""
-    logging.info(f'Initializing postgresql and elasticsearch connection.')
+    # Извлекать из PostgreSQL столько объектов за запрос, сколько
+    # документов сейчас уходит в bulk-запросе.
+    loader.bunch_size = saver.batch_size
+    rows = loader.load_changes() if change_log else loader.load_all()
+    if transform_pool:
+        rows = transform_pool.transform(rows)
+    save_rows(loader, saver, rows)
+
+
+def save_rows(
+        loader: PostgresLoader, saver: ElasticSearchSaver, rows: Iterable,
+        ) -> None:
+    """Сохранить строки загрузчика в ElasticSearch.
+
+    Args:
+        loader: Загрузчик, который выдал строки.
+        saver: Загрузчик в ElasticSearch.
+        rows: Строки объектов и отметки из потока загрузчика.
+    """
+    try:
+        for row in rows:
+            if isinstance(row, Checkpoint):
+                saver.checkpoint(row)
+                continue
+            if isinstance(row, Deleted):
+                saver.delete(row.id)
+                continue
+            if isinstance(row, FilmIdsDelta):
+                document = loader.build_document(row.row)
+                saver.update_film_ids(document, row.removed, row.film_ids)
+                if saver.is_batch_ready():
+                    saver.flush()
+                    loader.bunch_size = saver.batch_size
+                continue
+            if isinstance(row, Serialized):
+                saver.save_raw(row.id, row.source)
+            elif loader.pass_through:
+                saver.save_raw(row['id'], row['document'])
+            else:
+                saver.save(loader.build_document(row))
+            if saver.is_batch_ready():
+                saver.flush()
+                loader.bunch_size = saver.batch_size
+    except BaseException:
+        # Не оставлять потоки отправки после ошибки.
+        saver.cancel()
+        raise
+    saver.close()
+
+
+def run_pipeline(
+        index_loader: type[PostgresLoader],
+        pg_conn: pg_connection,
+        es_client: Elasticsearch,
+        state: State,
+        transform_executor: Optional[Executor] = None,
+        ) -> None:
+    """Загрузить один индекс из PostgreSQL в ElasticSearch.
 
+    Args:
+        index_loader: Класс загрузчика объектов индекса из PostgreSQL.
+        pg_conn: Подключение к PostgreSQL.
+        es_client: Подключение к ElasticSearch.
+        state: Состояние загрузки данных.
+        transform_executor: Пул процессов для сборки документов.
+    """
+    loader = pipeline.create_loader(index_loader, pg_conn, state)
+    logging.info(f'Started {loader.es_index} extraction.')
+    transform_pool = pipeline.transform_pool(loader, transform_executor)
+    with pipeline.fingerprints() as fingerprints:
+        saver = ElasticSearchSaver(
+            es_client,
+            loader.es_index,
+            ledger=CheckpointLedger(state),
+            fingerprints=fingerprints,
+            **pipeline.saver_options(),
+        )
+        logging.info(f'Started {loader.es_index} loading.')
+        try:
+            with profiling.profile(loader.es_index):
+                load(
+                    loader, saver,
+                    change_log=settings.ETL_EXTRACTOR == 'change_log',
+                    transform_pool=transform_pool,
+                )
+        finally:
+            loader.close()
+    pipeline.log_summary(saver)
+
+
+def run_pipelines_concurrently(
+        index_loaders: Sequence[type[PostgresLoader]],
+        es_client: Elasticsearch,
+        state: State,
+        transform_executor: Optional[Executor] = None,
+        ) -> None:
+    """Загрузить индексы параллельно.
+
+    Каждый индекс загружается в своем потоке через свое подключение
+    из пула PostgreSQL, а клиент ElasticSearch общий.  Ошибка в одном
+    индексе не прерывает загрузку остальных: она логируется, а после
+    завершения всех потоков первая из ошибок пробрасывается дальше,
+    чтобы сработал backoff.
+
+    Args:
+        index_loaders: Классы загрузчиков индексов из PostgreSQL.
+        es_client: Подключение к ElasticSearch.
+        state: Состояние загрузки данных.
+        transform_executor: Пул процессов для сборки документов.
+    """
+    def run_pooled_pipeline(index_loader: type[PostgresLoader]) -> None:
+        with pooled_connection(pool) as pg_conn:
+            run_pipeline(
+                index_loader, pg_conn, es_client, state, transform_executor,
+            )
+
+    size = len(index_loaders)
     with (
-        postgres_connection(settings.POSTGRES_DB) as pg_conn,
-        elastic_search_connection(settings.ELASTIC_HOST) as es_client,
+        postgres_pool(settings.POSTGRES_DB, size) as pool,
+        ThreadPoolExecutor(max_workers=size) as executor,
     ):
-        index_loaders = (
-            PostgresMovieLoader,
-            PostgresGenreLoader,
-            PostgresPersonLoader,
-        )
+        futures = {
+            executor.submit(run_pooled_pipeline, index_loader): index_loader
+            for index_loader in index_loaders
+        }
+        errors = []
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception as error:
+                es_index = futures[future].es_index
+                logging.exception(f'Failed {es_index} loading.')
+                errors.append(error)
+        if errors:
+            raise errors[0]
 
-        state = State(JsonFileStorage(settings.STATE_FILE))
 
-        for index_loader in index_loaders:
-            loader = index_loader(pg_conn, state)
-            logging.info(f'Started {loader.es_index} extraction.')
-            saver = ElasticSearchSaver(es_client, loader.es_index)
-            logging.info(f'Started {loader.es_index} loading.')
-            load(loader, saver)
+def run_pipelines(
+        index_loaders: Sequence[type[PostgresLoader]],
+        serializer: Serializer,
+        state: State,
+        transform_executor: ContextManager[Optional[Executor]],
+        ) -> None:
+    """Загрузить индексы синхронным движком.
 
+    Args:
+        index_loaders: Классы загрузчиков индексов, которые нужно обновить.
+        serializer: Сериализатор JSON для ElasticSearch.
+        state: Состояние загрузки данных.
+        transform_executor: Пул процессов для сборки документов.
+    """
+    with (
+        elastic_search_connection(
+            settings.ELASTIC_HOST, serializer,
+        ) as es_client,
+        transform_executor as transform_executor,
+    ):
+        if settings.ETL_CONCURRENT:
+            run_pipelines_concurrently(
+                index_loaders, es_client, state, transform_executor,
+            )
+        else:
+            with postgres_connection(settings.POSTGRES_DB) as pg_conn:
+                for index_loader in index_loaders:
+                    run_pipeline(
+                        index_loader, pg_conn, es_client, state,
+                        transform_executor,
+                    )
 
-if __name__ == '__main__':
-    while True:
+
+def purge_consumed_changes(state: State) -> None:
+    """Удалить записи журнала изменений, прочитанные всеми индексами.
+
+    Args:
+        state: Состояние загрузки данных.
+    """
+    cursors = [
+        state.get_state(index_loader.change_log_key)
+        for index_loader in INDEX_LOADERS
+    ]
+    if not all(cursors):
+        return
+    up_to = min(tuple(cursor) for cursor in cursors)
+    # Сначала состояние должно попасть на диск, иначе после падения
+    # загрузка продолжится с уже удаленных записей.
+    state.flush()
+    with postgres_connection(settings.POSTGRES_DB) as pg_conn:
+        deleted = purge_change_log(pg_conn, up_to)
+    logging.info(f'Purged {deleted} change log entries.')
+
+
+@backoff((OperationalError,), budget=RETRY_BUDGET)
+@backoff((ConnectionError,), budget=RETRY_BUDGET)
+def etl(index_loaders: Sequence[type[PostgresLoader]] = INDEX_LOADERS) -> None:
+    """Инициировать загрузку фильмов из PostgreSQL в ElasticSearch.
+
+    Args:
+        index_loaders: Классы загрузчиков индексов, которые нужно обновить.
+    """
+    logging.info(f'Initializing postgresql and elasticsearch connection.')
+
+    serializer = get_serializer(settings.JSON_SERIALIZER)
+    state = State(
+        JsonFileStorage(settings.STATE_FILE, serializer),
+        flush_every=settings.STATE_FLUSH_EVERY,
+        flush_interval=settings.STATE_FLUSH_INTERVAL,
+    )
+    metrics.watch_watermarks(state, [
+        key for index_loader in INDEX_LOADERS
+        for key in index_loader.watermark_keys
+    ])
+
+    transform_executor = (
+        create_executor(settings.ETL_TRANSFORM_WORKERS)
+        if settings.ETL_TRANSFORM_WORKERS else nullcontext()
+    )
+    profile_cycle = profiling.cycle(PROFILE_MODES, settings.ETL_PROFILE_DIR)
+    try:
+        if settings.ETL_ENGINE == 'async':
+            with transform_executor as transform_executor, profile_cycle:
+                run_pipelines_async(index_loaders, state, transform_executor)
+        else:
+            with profile_cycle:
+                run_pipelines(
+                    index_loaders, serializer, state, transform_executor,
+                )
+        if settings.ETL_EXTRACTOR == 'change_log':
+            purge_consumed_changes(state)
+    finally:
+        state.flush()
+
+
+@backoff((OperationalError,), budget=RETRY_BUDGET)
+def etl_on_notify() -> None:
+    """Загружать индексы сразу после уведомлений об изменениях.
+
+    Подписывается на уведомления PostgreSQL и, получив их, обновляет
+    только индексы, зависящие от измененных таблиц.  Если уведомлений
+    нет settings.ETL_TIMEOUT секунд, обновляет все индексы, чтобы не
+    пропустить правки, сделанные в обход триггеров.
+    """
+    with postgres_connection(settings.POSTGRES_DB) as listen_conn:
+        listener = PostgresListener(listen_conn, settings.ETL_NOTIFY_CHANNEL)
+        # Подписаться до первой загрузки, чтобы не пропустить правки,
+        # сделанные во время нее.
+        listener.listen()
         etl()
-        time.sleep(settings.ETL_TIMEOUT)
+        scan_at = time.monotonic() + settings.ETL_TIMEOUT
+        while True:
+            tables = listener.wait(max(0, scan_at - time.monotonic()))
+            if not tables:
+                etl()
+                scan_at = time.monotonic() + settings.ETL_TIMEOUT
+                continue
+            logging.info(f'Notified of changes in {", ".join(sorted(tables))}.')
+            index_loaders = [
+                index_loader for index_loader in INDEX_LOADERS
+                if tables.intersection(index_loader.source_tables)
+            ]
+            etl(index_loaders)
+
+
+if __name__ == '__main__':
+    profiling.install_signal_handler(
+        signal.SIGUSR1, profiling.parse_modes(settings.ETL_PROFILE_ON_SIGNAL),
+    )
+    if settings.ETL_METRICS_PORT:
+        metrics.serve(settings.ETL_METRICS_HOST, settings.ETL_METRICS_PORT)
+    if settings.ETL_LISTEN:
+        etl_on_notify()
+    else:
+        while True:
+            etl()
+            time.sleep(settings.ETL_TIMEOUT)
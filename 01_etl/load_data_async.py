@@ -0,0 +1,307 @@
+"""Асинхронный движок импорта кино из PostgreSQL в ElasticSearch.
+
+Извлечение, сборка документов и отправка bulk-запросов работают как
+отдельные задачи, связанные очередями ограниченного размера.  Пока
+ElasticSearch обрабатывает bulk-запрос, из PostgreSQL читаются
+следующие строки, а когда очередь заполнена, извлечение ждет.
+
+Загрузчики PostgreSQL и их SQL те же, что у синхронного движка:
+запросы выполняются через psycopg2 в отдельном потоке на каждый
+индекс, а отметки состояния те же, что в load_data.py.
+"""
+
+import asyncio
+import contextvars
+import logging
+import threading
+from collections.abc import Iterator, Sequence
+from concurrent.futures import Executor
+from typing import Any, Optional
+
+from elasticsearch import AsyncElasticsearch
+from psycopg2.extensions import connection as pg_connection
+
+import pipeline
+import profiling
+import settings
+from extract.postgres_loader import (Deleted, FilmIdsDelta, PostgresLoader,
+                                     pooled_connection, postgres_pool)
+from load.async_elastic_search_saver import (AsyncElasticSearchSaver,
+                                             async_elastic_search_connection)
+from serializers import get_serializer
+from storage import Checkpoint, CheckpointLedger, State
+from transform.parallel import Serialized, TransformPool
+
+# Конец потока строк в очереди.
+_DONE = object()
+# Сколько строк из очереди собирать в документы за один переход в поток.
+TRANSFORM_CHUNK_SIZE = 100
+
+
+def _extract(
+        rows: Iterator[Any],
+        queue: asyncio.Queue,
+        loop: asyncio.AbstractEventLoop,
+        stopped: threading.Event,
+        ) -> None:
+    """Перекладывать строки из загрузчика в очередь.
+
+    Выполняется в отдельном потоке, потому что psycopg2 блокирует
+    поток на время запроса.
+
+    Args:
+        rows: Строки и отметки от загрузчика.
+        queue: Очередь извлеченных строк.
+        loop: Цикл событий, которому принадлежит очередь.
+        stopped: Флаг остановки загрузки после ошибки.
+    """
+    try:
+        for row in rows:
+            if stopped.is_set():
+                return
+            asyncio.run_coroutine_threadsafe(queue.put(row), loop).result()
+        asyncio.run_coroutine_threadsafe(queue.put(_DONE), loop).result()
+    finally:
+        rows.close()
+
+
+def _build_documents(loader: PostgresLoader, rows: list[Any]) -> list[Any]:
+    """Собрать документы из строк PostgreSQL, отметки оставить как есть.
+
+    Args:
+        loader: Загрузчик, который умеет собирать документ.
+        rows: Строки и отметки по порядку.
+
+    Returns:
+        Документы и отметки в том же порядке.
+    """
+    items = []
+    for row in rows:
+        if isinstance(row, dict):
+            if loader.pass_through:
+                row = Serialized(str(row['id']), row['document'].encode())
+            else:
+                row = loader.build_document(row)
+        items.append(row)
+    return items
+
+
+async def _transform(
+        loader: PostgresLoader,
+        source: asyncio.Queue,
+        sink: asyncio.Queue,
+        ) -> None:
+    """Собрать документы из строк PostgreSQL.
+
+    Документы собираются в отдельном потоке, чтобы сборка не
+    останавливала цикл событий и отправку bulk-запросов.  В поток
+    уходят сразу все строки, накопившиеся в очереди, но не больше
+    TRANSFORM_CHUNK_SIZE.
+
+    Args:
+        loader: Загрузчик, который умеет собирать документ.
+        source: Очередь извлеченных строк.
+        sink: Очередь документов и отметок.
+    """
+    while True:
+        rows = [await source.get()]
+        while len(rows) < TRANSFORM_CHUNK_SIZE and not source.empty():
+            rows.append(source.get_nowait())
+        for item in await asyncio.to_thread(_build_documents, loader, rows):
+            await sink.put(item)
+            if item is _DONE:
+                return
+
+
+async def _index(
+        loader: PostgresLoader,
+        saver: AsyncElasticSearchSaver,
+        source: asyncio.Queue,
+        ) -> None:
+    """Отправить документы и отметки в ElasticSearch.
+
+    Args:
+        loader: Загрузчик, который умеет собирать документ.
+        saver: Загрузчик документов в ElasticSearch.
+        source: Очередь документов и отметок.
+    """
+    while True:
+        item = await source.get()
+        if item is _DONE:
+            break
+        if isinstance(item, Checkpoint):
+            saver.checkpoint(item)
+            continue
+        if isinstance(item, Deleted):
+            saver.delete(item.id)
+            continue
+        if isinstance(item, FilmIdsDelta):
+            document = await asyncio.to_thread(
+                loader.build_document, item.row,
+            )
+            saver.update_film_ids(document, item.removed, item.film_ids)
+        elif isinstance(item, Serialized):
+            saver.save_raw(item.id, item.source)
+        else:
+            saver.save(item)
+        if saver.is_batch_ready():
+            await saver.flush_async()
+            loader.bunch_size = saver.batch_size
+    await saver.close_async()
+
+
+async def load_async(
+        loader: PostgresLoader,
+        saver: AsyncElasticSearchSaver,
+        change_log: bool = False,
+        transform_pool: Optional[TransformPool] = None,
+        queue_size: int = 1000,
+        ) -> None:
+    """Загрузить индекс тремя задачами, связанными очередями.
+
+    Если одна из задач упала, остальные останавливаются, а ошибка
+    пробрасывается дальше.
+
+    Args:
+        loader: Загрузчик из PostgreSQL.
+        saver: Загрузчик в ElasticSearch.
+        change_log: Брать изменения из журнала, а не сканом таблиц.
+        transform_pool: Собирать документы в пуле процессов.
+        queue_size: Сколько строк и документов держать в каждой очереди.
+    """
+    loader.bunch_size = saver.batch_size
+    rows = loader.load_changes() if change_log else loader.load_all()
+    if transform_pool:
+        rows = transform_pool.transform(rows)
+    extracted = asyncio.Queue(queue_size)
+    transformed = asyncio.Queue(queue_size)
+    stopped = threading.Event()
+    loop = asyncio.get_running_loop()
+    # Поток извлечения наследует контекст задачи, в том числе профиль.
+    extraction = loop.run_in_executor(
+        None, contextvars.copy_context().run,
+        _extract, rows, extracted, loop, stopped,
+    )
+    stages = [
+        asyncio.ensure_future(_transform(loader, extracted, transformed)),
+        asyncio.ensure_future(_index(loader, saver, transformed)),
+    ]
+    try:
+        done, _ = await asyncio.wait(
+            [extraction, *stages], return_when=asyncio.FIRST_EXCEPTION,
+        )
+        for task in done:
+            task.result()
+    except BaseException:
+        stopped.set()
+        for stage in stages:
+            stage.cancel()
+        saver.cancel()
+        # Поток извлечения может ждать места в очереди: освобождать
+        # очередь, пока он не заметит флаг остановки.
+        while not extraction.done():
+            while not extracted.empty():
+                extracted.get_nowait()
+            await asyncio.wait([extraction], timeout=0.1)
+        raise
+
+
+async def run_pipeline_async(
+        index_loader: type[PostgresLoader],
+        pg_conn: pg_connection,
+        es_client: AsyncElasticsearch,
+        state: State,
+        transform_executor: Optional[Executor] = None,
+        ) -> None:
+    """Загрузить один индекс из PostgreSQL в ElasticSearch.
+
+    Args:
+        index_loader: Класс загрузчика объектов индекса из PostgreSQL.
+        pg_conn: Подключение к PostgreSQL.
+        es_client: Асинхронное подключение к ElasticSearch.
+        state: Состояние загрузки данных.
+        transform_executor: Пул процессов для сборки документов.
+    """
+    loader = pipeline.create_loader(index_loader, pg_conn, state)
+    logging.info(f'Started {loader.es_index} extraction.')
+    transform_pool = pipeline.transform_pool(loader, transform_executor)
+    with pipeline.fingerprints() as fingerprints:
+        saver = AsyncElasticSearchSaver(
+            es_client,
+            loader.es_index,
+            ledger=CheckpointLedger(state),
+            **pipeline.saver_options(),
+        )
+        if fingerprints:
+            await saver.bind_fingerprints(fingerprints)
+        logging.info(f'Started {loader.es_index} loading.')
+        try:
+            with profiling.profile(loader.es_index):
+                await load_async(
+                    loader, saver,
+                    change_log=settings.ETL_EXTRACTOR == 'change_log',
+                    transform_pool=transform_pool,
+                    queue_size=settings.ETL_ASYNC_QUEUE_SIZE,
+                )
+        finally:
+            loader.close()
+    pipeline.log_summary(saver)
+
+
+async def _run_pipelines(
+        index_loaders: Sequence[type[PostgresLoader]],
+        state: State,
+        transform_executor: Optional[Executor] = None,
+        ) -> None:
+    """Загрузить индексы одновременно в одном цикле событий.
+
+    Args:
+        index_loaders: Классы загрузчиков индексов из PostgreSQL.
+        state: Состояние загрузки данных.
+        transform_executor: Пул процессов для сборки документов.
+    """
+    async def run_pooled_pipeline(index_loader: type[PostgresLoader]):
+        with pooled_connection(pool) as pg_conn:
+            await run_pipeline_async(
+                index_loader, pg_conn, es_client, state, transform_executor,
+            )
+
+    serializer = get_serializer(settings.JSON_SERIALIZER)
+    with postgres_pool(settings.POSTGRES_DB, len(index_loaders)) as pool:
+        async with async_elastic_search_connection(
+            settings.ELASTIC_HOST, serializer,
+        ) as es_client:
+            results = await asyncio.gather(
+                *map(run_pooled_pipeline, index_loaders),
+                return_exceptions=True,
+            )
+    errors = []
+    for index_loader, result in zip(index_loaders, results):
+        if isinstance(result, Exception):
+            logging.error(
+                f'Failed {index_loader.es_index} loading.', exc_info=result,
+            )
+            errors.append(result)
+    if errors:
+        raise errors[0]
+
+
+def run_pipelines_async(
+        index_loaders: Sequence[type[PostgresLoader]],
+        state: State,
+        transform_executor: Optional[Executor] = None,
+        ) -> None:
+    """Загрузить индексы асинхронным движком.
+
+    Каждый индекс загружается через свое подключение из пула
+    PostgreSQL, а подключение к ElasticSearch общее.  Ошибка в одном
+    индексе не прерывает загрузку остальных: после завершения всех
+    индексов первая из ошибок пробрасывается дальше, чтобы сработал
+    backoff.
+
+    Args:
+        index_loaders: Классы загрузчиков индексов из PostgreSQL.
+        state: Состояние загрузки данных.
+        transform_executor: Пул процессов для сборки документов.
+    """
+    asyncio.run(_run_pipelines(index_loaders, state, transform_executor))
@@ -0,0 +1,462 @@
+"""Метрики ETL в текстовом формате Prometheus.
+
+Метрики копятся в памяти процесса всегда: счетчик - это словарь под
+блокировкой, поэтому без сервера метрик они почти ничего не стоят.
+serve() отдает их по HTTP на /metrics.
+"""
+
+import bisect
+import threading
+import time
+from collections.abc import Callable, Iterable, Iterator
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Generator, Optional
+
+from dateutil.parser import parse
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+# Границы корзин гистограмм времени в секундах.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+Labels = tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    """Экранировать значение метки.
+
+    Args:
+        value: Значение метки.
+
+    Returns:
+        Значение, которое можно поставить в кавычки.
+    """
+    return (
+        value.replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+    )
+
+
+def _format(name: str, labels: dict[str, str], value: float) -> str:
+    """Собрать строку значения метрики.
+
+    Args:
+        name: Название ряда.
+        labels: Метки ряда.
+        value: Значение.
+
+    Returns:
+        Строка в формате Prometheus.
+    """
+    if labels:
+        pairs = ','.join(
+            f'{key}="{_escape(str(label))}"' for key, label in labels.items()
+        )
+        name = f'{name}{{{pairs}}}'
+    return f'{name} {value!r}'
+
+
+class Metric:
+    """Метрика с рядами по набору меток.  Безопасна для потоков."""
+
+    kind = 'untyped'
+
+    def __init__(self, name: str, help: str, labels: Labels = ()):
+        """Проинициализировать метрику.
+
+        Args:
+            name: Название метрики.
+            help: Описание метрики.
+            labels: Названия меток.
+        """
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values: dict[Labels, Any] = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict[str, str]) -> Labels:
+        """Получить ключ ряда по значениям меток.
+
+        Args:
+            labels: Значения всех меток метрики.
+
+        Returns:
+            Значения меток в порядке self.labels.
+        """
+        return tuple(str(labels[label]) for label in self.labels)
+
+    def samples(self) -> Iterator[tuple[str, dict[str, str], float]]:
+        """Получить значения рядов.
+
+        Yields:
+            Название ряда, его метки и значение.
+        """
+        with self._lock:
+            values = dict(self._values)
+        for key, value in sorted(values.items()):
+            yield self.name, dict(zip(self.labels, key)), value
+
+    def render(self) -> str:
+        """Вывести метрику в формате Prometheus.
+
+        Returns:
+            Описание, тип и значения рядов.
+        """
+        lines = [
+            f'# HELP {self.name} {self.help}',
+            f'# TYPE {self.name} {self.kind}',
+        ]
+        lines.extend(
+            _format(name, labels, value)
+            for name, labels, value in self.samples()
+        )
+        return '\n'.join(lines) + '\n'
+
+
+class Counter(Metric):
+    """Счетчик, который только растет."""
+
+    kind = 'counter'
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        """Увеличить счетчик.
+
+        Args:
+            amount: На сколько увеличить.
+            labels: Значения меток ряда.
+        """
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels: str) -> float:
+        """Получить значение ряда.
+
+        Args:
+            labels: Значения меток ряда.
+
+        Returns:
+            Значение счетчика.
+        """
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+
+class Gauge(Metric):
+    """Значение, которое считается в момент сбора метрик."""
+
+    kind = 'gauge'
+
+    def __init__(self, name: str, help: str, labels: Labels = ()):
+        """Проинициализировать метрику.
+
+        Args:
+            name: Название метрики.
+            help: Описание метрики.
+            labels: Названия меток.
+        """
+        super().__init__(name, help, labels)
+        self._function: Optional[Callable[[], dict[Labels, float]]] = None
+
+    def set_function(
+            self, function: Optional[Callable[[], dict[Labels, float]]],
+            ) -> None:
+        """Считать ряды функцией при каждом сборе метрик.
+
+        Args:
+            function: Функция, которая возвращает значения рядов по
+                значениям меток, или None, чтобы отключить метрику.
+        """
+        self._function = function
+
+    def samples(self) -> Iterator[tuple[str, dict[str, str], float]]:
+        """Получить значения рядов.
+
+        Yields:
+            Название ряда, его метки и значение.
+        """
+        if not self._function:
+            return
+        for key, value in sorted(self._function().items()):
+            yield self.name, dict(zip(self.labels, key)), value
+
+
+class Histogram(Metric):
+    """Распределение значений по корзинам."""
+
+    kind = 'histogram'
+
+    def __init__(
+            self,
+            name: str,
+            help: str,
+            labels: Labels = (),
+            buckets: tuple[float, ...] = LATENCY_BUCKETS,
+            ):
+        """Проинициализировать метрику.
+
+        Args:
+            name: Название метрики.
+            help: Описание метрики.
+            labels: Названия меток.
+            buckets: Верхние границы корзин по возрастанию.
+        """
+        super().__init__(name, help, labels)
+        self.buckets = buckets
+
+    def observe(self, value: float, count: int = 1, **labels: str) -> None:
+        """Учесть значение.
+
+        Args:
+            value: Значение.
+            count: Сколько раз учесть значение.
+            labels: Значения меток ряда.
+        """
+        key = self._key(labels)
+        position = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.get(
+                key, ([0] * (len(self.buckets) + 1), 0),
+            )
+            counts[position] += count
+            self._values[key] = (counts, total + value * count)
+
+    @contextmanager
+    def time(self, **labels: str) -> Generator[None, None, None]:
+        """Учесть время выполнения блока в секундах.
+
+        Args:
+            labels: Значения меток ряда.
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self) -> Iterator[tuple[str, dict[str, str], float]]:
+        """Получить значения корзин, сумму и число значений.
+
+        Yields:
+            Название ряда, его метки и значение.
+        """
+        with self._lock:
+            values = {
+                key: (list(counts), total)
+                for key, (counts, total) in self._values.items()
+            }
+        for key, (counts, total) in sorted(values.items()):
+            labels = dict(zip(self.labels, key))
+            cumulative = 0
+            bounds = [f'{bound:g}' for bound in self.buckets] + ['+Inf']
+            for bound, count in zip(bounds, counts):
+                cumulative += count
+                yield (
+                    f'{self.name}_bucket', {**labels, 'le': bound}, cumulative,
+                )
+            yield f'{self.name}_sum', labels, total
+            yield f'{self.name}_count', labels, cumulative
+
+
+class Registry:
+    """Набор метрик, которые отдаются вместе."""
+
+    def __init__(self):
+        """Проинициализировать пустой набор."""
+        self._metrics: list[Metric] = []
+
+    def register(self, metric: Metric) -> Metric:
+        """Добавить метрику в набор.
+
+        Args:
+            metric: Метрика.
+
+        Returns:
+            Та же метрика.
+        """
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        """Вывести все метрики в формате Prometheus.
+
+        Returns:
+            Текст для ответа на /metrics.
+        """
+        return ''.join(metric.render() for metric in self._metrics)
+
+
+REGISTRY = Registry()
+
+ROWS_SCANNED = REGISTRY.register(Counter(
+    'etl_rows_scanned_total',
+    'Rows read by ids_for_*_since scans of changed rows.',
+    ('index', 'table'),
+))
+QUERY_SECONDS = REGISTRY.register(Histogram(
+    'etl_get_objects_seconds',
+    'Time spent in get_* queries fetching index objects.',
+    ('index',),
+))
+TRANSFORM_SECONDS = REGISTRY.register(Histogram(
+    'etl_transform_seconds',
+    'Time spent building one document from a database row.',
+    ('index',),
+))
+TRANSFORMED_DOCUMENTS = REGISTRY.register(Counter(
+    'etl_transformed_documents_total',
+    'Documents built from database rows.',
+    ('index',),
+))
+BULK_SECONDS = REGISTRY.register(Histogram(
+    'etl_bulk_seconds',
+    'Elasticsearch bulk request latency.',
+    ('index',),
+))
+BULK_BYTES = REGISTRY.register(Counter(
+    'etl_bulk_bytes_total',
+    'Bytes sent in Elasticsearch bulk requests.',
+    ('index',),
+))
+BULK_DOCUMENTS = REGISTRY.register(Counter(
+    'etl_bulk_documents_total',
+    'Actions sent in Elasticsearch bulk requests.',
+    ('index',),
+))
+SKIPPED_DOCUMENTS = REGISTRY.register(Counter(
+    'etl_skipped_documents_total',
+    'Unchanged documents that were not sent to Elasticsearch.',
+    ('index',),
+))
+BACKOFF_RETRIES = REGISTRY.register(Counter(
+    'etl_backoff_retries_total',
+    'Restarts of functions wrapped in backoff.',
+    ('function', 'exception'),
+))
+WATERMARK_AGE = REGISTRY.register(Gauge(
+    'etl_watermark_age_seconds',
+    'Age of the last processed change for each state key.',
+    ('key',),
+))
+
+
+def timed(
+        rows: Iterable[Any], histogram: Histogram, **labels: str,
+        ) -> Generator[Any, None, None]:
+    """Учесть время, потраченное на получение строк.
+
+    Время, пока строки обрабатывает вызывающий код, не считается,
+    поэтому в гистограмму попадает только время запроса.
+
+    Args:
+        rows: Строки, например, из курсора.
+        histogram: Гистограмма времени.
+        labels: Значения меток ряда.
+
+    Yields:
+        Те же строки.
+    """
+    elapsed = 0
+    iterator = iter(rows)
+    try:
+        while True:
+            started = time.perf_counter()
+            try:
+                row = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                elapsed += time.perf_counter() - started
+            yield row
+    finally:
+        histogram.observe(elapsed, **labels)
+
+
+def _modified(value: Any) -> Optional[datetime]:
+    """Достать время правки из значения ключа состояния.
+
+    Args:
+        value: Курсор (modified, id) или время правки в старом формате.
+
+    Returns:
+        Время правки или None, если значение его не содержит.
+    """
+    if isinstance(value, (list, tuple)) and value:
+        value = value[0]
+    if isinstance(value, str):
+        try:
+            value = parse(value)
+        except (ValueError, OverflowError):
+            return None
+    if not isinstance(value, datetime):
+        return None
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value
+
+
+def watch_watermarks(state: Any, keys: Iterable[str]) -> None:
+    """Отдавать возраст отметок состояния в etl_watermark_age_seconds.
+
+    Args:
+        state: Состояние загрузки, у которого есть get_state.
+        keys: Ключи состояния с курсорами (modified, id).
+    """
+    keys = tuple(keys)
+
+    def ages() -> dict[Labels, float]:
+        now = datetime.now(timezone.utc)
+        result = {}
+        for key in keys:
+            modified = _modified(state.get_state(key))
+            if modified:
+                result[(key,)] = (now - modified).total_seconds()
+        return result
+
+    WATERMARK_AGE.set_function(ages)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    """Ответ на запрос метрик."""
+
+    registry = REGISTRY
+
+    def do_GET(self) -> None:
+        """Отдать метрики на /metrics."""
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = self.registry.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        """Не писать каждый запрос в stderr."""
+
+
+def serve(
+        host: str, port: int, registry: Registry = REGISTRY,
+        ) -> ThreadingHTTPServer:
+    """Запустить HTTP-сервер метрик в фоновом потоке.
+
+    Args:
+        host: Адрес, на котором слушать.
+        port: Порт, 0 - любой свободный.
+        registry: Набор метрик.
+
+    Returns:
+        Сервер.  Остановить его можно через shutdown().
+    """
+    handler = type(
+        '_RegistryHandler', (_MetricsHandler,), {'registry': registry},
+    )
+    server = ThreadingHTTPServer((host, port), handler)
+    thread = threading.Thread(
+        target=server.serve_forever, name='metrics', daemon=True,
+    )
+    thread.start()
+    return server
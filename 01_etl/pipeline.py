@@ -0,0 +1,154 @@
+"""Общие части загрузки индекса для синхронного и асинхронного движков.
+
+Оба движка собирают загрузчик PostgreSQL, пул сборки документов,
+базу отпечатков и загрузчик ElasticSearch по одним и тем же
+настройкам, а после загрузки одинаково пишут итоги в лог.
+"""
+
+import logging
+from concurrent.futures import Executor
+from contextlib import nullcontext
+from typing import ContextManager, Optional
+
+from psycopg2.extensions import connection as pg_connection
+
+import settings
+from extract.postgres_loader import PostgresLoader
+from load.bulk_controller import BulkController
+from load.dead_letters import DeadLetterFile
+from load.elastic_search_saver import ElasticSearchSaver
+from load.fingerprints import FingerprintStore, fingerprint_store
+from storage import State
+from transform.parallel import TransformPool
+
+
+def bulk_controller() -> Optional[BulkController]:
+    """Создать регулятор bulk-запросов по настройкам.
+
+    Returns:
+        Регулятор или None, если размер запросов задан жестко.
+    """
+    if not settings.ES_BULK_ADAPTIVE:
+        return None
+    return BulkController(
+        batch_size=settings.ES_BULK_SIZE,
+        min_batch_size=settings.ES_BULK_MIN_SIZE,
+        max_batch_size=settings.ES_BULK_MAX_SIZE,
+        max_concurrency=settings.ES_BULK_CONCURRENCY,
+        target_latency=settings.ES_BULK_TARGET_LATENCY,
+    )
+
+
+def dead_letter_file() -> Optional[DeadLetterFile]:
+    """Создать файл для документов, которые не удалось сохранить.
+
+    Returns:
+        Файл или None, если такие документы должны прерывать загрузку.
+    """
+    if not settings.DEAD_LETTERS_FILE:
+        return None
+    return DeadLetterFile(settings.DEAD_LETTERS_FILE)
+
+
+def saver_options() -> dict:
+    """Собрать аргументы загрузчика в ElasticSearch по настройкам.
+
+    Каждый вызов создает свой регулятор bulk-запросов.
+
+    Returns:
+        Именованные аргументы ElasticSearchSaver и
+        AsyncElasticSearchSaver кроме подключения, индекса и журнала.
+    """
+    return {
+        'batch_size': settings.ES_BULK_SIZE,
+        'max_batch_bytes': settings.ES_BULK_MAX_BYTES,
+        'max_in_flight': settings.ES_BULK_CONCURRENCY,
+        'controller': bulk_controller(),
+        'dead_letters': dead_letter_file(),
+        'max_retries': settings.ES_BULK_MAX_RETRIES,
+        'retry_pause': settings.ES_BULK_RETRY_PAUSE,
+    }
+
+
+def create_loader(
+        index_loader: type[PostgresLoader],
+        pg_conn: pg_connection,
+        state: State,
+        ) -> PostgresLoader:
+    """Создать загрузчик объектов индекса по настройкам.
+
+    Args:
+        index_loader: Класс загрузчика объектов индекса из PostgreSQL.
+        pg_conn: Подключение к PostgreSQL.
+        state: Состояние загрузки данных.
+
+    Returns:
+        Загрузчик.
+    """
+    return index_loader(
+        pg_conn, state,
+        itersize=settings.POSTGRES_ITERSIZE,
+        film_ids_deltas=settings.ETL_FILM_IDS_DELTAS,
+        pass_through=settings.ETL_PASS_THROUGH,
+        validate_every=settings.ETL_VALIDATE_EVERY,
+        dsl=settings.POSTGRES_DB,
+        reconnect_attempts=settings.POSTGRES_RECONNECT_ATTEMPTS,
+    )
+
+
+def transform_pool(
+        loader: PostgresLoader, transform_executor: Optional[Executor],
+        ) -> Optional[TransformPool]:
+    """Создать пул сборки документов для загрузчика.
+
+    Args:
+        loader: Загрузчик объектов индекса.
+        transform_executor: Пул процессов для сборки документов.
+
+    Returns:
+        Пул сборки или None, если документы собираются на месте.
+    """
+    if not transform_executor or loader.pass_through:
+        return None
+    return TransformPool(
+        transform_executor,
+        type(loader),
+        chunk_size=settings.ETL_TRANSFORM_CHUNK_SIZE,
+        max_pending=2 * settings.ETL_TRANSFORM_WORKERS,
+        validate_every=settings.ETL_VALIDATE_EVERY,
+        serializer_name=settings.JSON_SERIALIZER,
+    )
+
+
+def fingerprints() -> ContextManager[Optional[FingerprintStore]]:
+    """Открыть базу отпечатков, если пропуск документов включен.
+
+    Returns:
+        Контекст с базой отпечатков или с None.
+    """
+    if not settings.ETL_SKIP_UNCHANGED:
+        return nullcontext()
+    return fingerprint_store(settings.FINGERPRINTS_FILE)
+
+
+def log_summary(saver: ElasticSearchSaver) -> None:
+    """Записать в лог итоги загрузки индекса.
+
+    Args:
+        saver: Загрузчик в ElasticSearch после завершения загрузки.
+    """
+    if saver.skipped_count:
+        logging.info(
+            f'Skipped {saver.skipped_count} unchanged '
+            f'{saver.index} documents.',
+        )
+    if saver.retried_count:
+        logging.info(
+            f'Retried {saver.retried_count} {saver.index} documents '
+            'after transient errors.',
+        )
+    if saver.dead_letter_count:
+        logging.warning(
+            f'Failed to index {saver.dead_letter_count} {saver.index} '
+            f'documents, see {settings.DEAD_LETTERS_FILE}.',
+        )
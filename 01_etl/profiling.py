@@ -0,0 +1,386 @@
+"""Профилирование этапов ETL по запросу.
+
+Загрузка индекса оборачивается в profile(), а этапы извлечения,
+сборки и отправки документов - в span() и traced().  Пока цикл ETL
+не профилируется, span() возвращает общий пустой контекст, а traced()
+возвращает итератор как есть, поэтому накладные расходы - одно чтение
+ContextVar на вызов.
+
+Профилирование включается на каждый цикл настройкой ETL_PROFILE или
+на один цикл сигналом (см. install_signal_handler).  Режимы:
+
+- spans - время этапов: число вызовов, сумма, среднее и максимум;
+- cprofile - cProfile потока, который загружает индекс;
+- tracemalloc - рост памяти за загрузку индекса по строкам кода.
+
+После загрузки индекса отчет пишется в отдельный файл.
+"""
+
+import cProfile
+import io
+import logging
+import os
+import pstats
+import signal
+import threading
+import time
+import tracemalloc
+from collections.abc import Iterable, Iterator
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Any, ContextManager, Generator, Optional
+
+MODES = frozenset(('spans', 'cprofile', 'tracemalloc'))
+# Сколько строк выводить в отчетах cProfile и tracemalloc.
+REPORT_LIMIT = 40
+
+_NOOP = nullcontext()
+_current: ContextVar[Optional['Profile']] = ContextVar(
+    'profile', default=None,
+)
+# Режимы текущего цикла, директория отчетов и завершенные профили.
+_cycle: Optional[tuple[frozenset, str, list['Profile']]] = None
+# Запрос профилирования следующего цикла по сигналу и его режимы.
+_signalled = threading.Event()
+_signal_modes = frozenset(('spans', 'cprofile'))
+# Потоки с работающим cProfile: он может быть только один на поток,
+# а профили индексов в асинхронном движке делят один поток.
+_cprofile_threads: set[int] = set()
+_cprofile_lock = threading.Lock()
+
+
+def parse_modes(value: str) -> frozenset:
+    """Разобрать список режимов через запятую.
+
+    Args:
+        value: Например, 'spans,cprofile'.
+
+    Returns:
+        Режимы профилирования.
+
+    Raises:
+        ValueError: Если режим неизвестен.
+    """
+    modes = frozenset(
+        mode.strip() for mode in value.split(',') if mode.strip()
+    )
+    unknown = modes - MODES
+    if unknown:
+        raise ValueError(f'Unknown profiling modes: {", ".join(unknown)}.')
+    return modes
+
+
+class _Span:
+    """Замер времени одного этапа."""
+
+    __slots__ = ('_profile', '_name', '_started')
+
+    def __init__(self, profile: 'Profile', name: str):
+        """Проинициализировать замер.
+
+        Args:
+            profile: Профиль, в который записать время.
+            name: Название этапа.
+        """
+        self._profile = profile
+        self._name = name
+
+    def __enter__(self) -> None:
+        """Начать замер."""
+        self._started = time.perf_counter()
+
+    def __exit__(self, *args: Any) -> None:
+        """Записать время этапа."""
+        self._profile.record(self._name, time.perf_counter() - self._started)
+
+
+class Profile:
+    """Профиль загрузки одного индекса."""
+
+    def __init__(self, index: str, modes: frozenset, directory: str):
+        """Проинициализировать профиль.
+
+        Args:
+            index: Индекс, загрузка которого профилируется.
+            modes: Режимы профилирования.
+            directory: Куда писать отчет.
+        """
+        self.index = index
+        self.modes = modes
+        self.directory = directory
+        self.spans = 'spans' in modes
+        self._timings: dict[str, list[float]] = {}
+        self._lock = threading.Lock()
+        self._profiler: Optional[cProfile.Profile] = None
+        self._snapshot: Optional[tracemalloc.Snapshot] = None
+        self._notes: list[str] = []
+        self._started_at = datetime.now()
+        self._started = time.perf_counter()
+
+    def record(self, name: str, elapsed: float) -> None:
+        """Учесть время этапа.
+
+        Args:
+            name: Название этапа.
+            elapsed: Время в секундах.
+        """
+        with self._lock:
+            timing = self._timings.get(name)
+            if timing is None:
+                self._timings[name] = [1, elapsed, elapsed]
+                return
+            timing[0] += 1
+            timing[1] += elapsed
+            timing[2] = max(timing[2], elapsed)
+
+    def timings(self) -> dict[str, tuple[int, float, float]]:
+        """Получить время этапов.
+
+        Returns:
+            Число вызовов, общее и наибольшее время по этапам.
+        """
+        with self._lock:
+            return {
+                name: tuple(timing) for name, timing in self._timings.items()
+            }
+
+    def start(self) -> None:
+        """Запустить cProfile и tracemalloc, если они нужны."""
+        if 'cprofile' in self.modes:
+            self._start_cprofile()
+        if 'tracemalloc' in self.modes:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            self._snapshot = tracemalloc.take_snapshot()
+            self._notes.append(
+                'tracemalloc is process-wide: indexes loaded at the same '
+                'time share allocations.',
+            )
+
+    def _start_cprofile(self) -> None:
+        """Запустить cProfile в текущем потоке, если он там свободен."""
+        thread = threading.get_ident()
+        with _cprofile_lock:
+            busy = thread in _cprofile_threads
+            _cprofile_threads.add(thread)
+        if busy:
+            self._notes.append(
+                'cProfile is busy with another index in this thread.',
+            )
+            return
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError as error:
+            # Другой профилировщик уже работает.
+            self._notes.append(f'cProfile is not available: {error}')
+            with _cprofile_lock:
+                _cprofile_threads.discard(thread)
+            return
+        self._profiler = profiler
+
+    def stop(self) -> None:
+        """Остановить cProfile."""
+        if self._profiler:
+            self._profiler.disable()
+            with _cprofile_lock:
+                _cprofile_threads.discard(threading.get_ident())
+
+    def report(self) -> str:
+        """Собрать текст отчета.
+
+        Returns:
+            Отчет по всем включенным режимам.
+        """
+        duration = time.perf_counter() - self._started
+        lines = [
+            f'index: {self.index}',
+            f'started: {self._started_at.isoformat(timespec="seconds")}',
+            f'duration: {duration:.3f} s',
+            f'modes: {", ".join(sorted(self.modes))}',
+            *(f'note: {note}' for note in self._notes),
+        ]
+        if self.spans:
+            lines += ['', '== spans', self._spans_report()]
+        if self._profiler:
+            stream = io.StringIO()
+            stats = pstats.Stats(self._profiler, stream=stream)
+            stats.sort_stats('cumulative').print_stats(REPORT_LIMIT)
+            lines += ['', '== cprofile', stream.getvalue()]
+        if self._snapshot:
+            stats = tracemalloc.take_snapshot().compare_to(
+                self._snapshot, 'lineno',
+            )
+            lines += ['', '== tracemalloc']
+            lines += [str(stat) for stat in stats[:REPORT_LIMIT]]
+        return '\n'.join(lines) + '\n'
+
+    def _spans_report(self) -> str:
+        """Собрать таблицу времени этапов.
+
+        Returns:
+            Таблица по убыванию общего времени.
+        """
+        with self._lock:
+            timings = sorted(
+                self._timings.items(), key=lambda item: -item[1][1],
+            )
+        lines = [
+            f'{"span":<28}{"calls":>10}{"total, s":>12}'
+            f'{"mean, ms":>12}{"max, ms":>12}',
+        ]
+        for name, (calls, total, longest) in timings:
+            lines.append(
+                f'{name:<28}{calls:>10}{total:>12.3f}'
+                f'{total / calls * 1000:>12.3f}{longest * 1000:>12.3f}',
+            )
+        return '\n'.join(lines)
+
+    def write(self) -> str:
+        """Записать отчет в файл.
+
+        Returns:
+            Путь к файлу отчета.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        stamp = self._started_at.strftime('%Y%m%dT%H%M%S')
+        path = os.path.join(self.directory, f'{self.index}-{stamp}.txt')
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(self.report())
+        return path
+
+    def trace(self, rows: Iterable[Any], name: str) -> Iterator[Any]:
+        """Учесть время, потраченное на получение элементов итератора.
+
+        Args:
+            rows: Итератор.
+            name: Название этапа.
+
+        Yields:
+            Те же элементы.
+        """
+        iterator = iter(rows)
+        try:
+            while True:
+                started = time.perf_counter()
+                try:
+                    row = next(iterator)
+                except StopIteration:
+                    return
+                finally:
+                    self.record(name, time.perf_counter() - started)
+                yield row
+        finally:
+            close = getattr(iterator, 'close', None)
+            if close:
+                close()
+
+
+def span(name: str) -> ContextManager:
+    """Замерить время блока как этап текущего профиля.
+
+    Args:
+        name: Название этапа, например, 'transform.validate'.
+
+    Returns:
+        Контекст замера или пустой контекст, если профиля нет.
+    """
+    profile = _current.get()
+    if profile is None or not profile.spans:
+        return _NOOP
+    return _Span(profile, name)
+
+
+def traced(rows: Iterable[Any], name: str) -> Iterable[Any]:
+    """Замерить время получения элементов как этап текущего профиля.
+
+    Время, пока элементы обрабатывает вызывающий код, не считается.
+
+    Args:
+        rows: Итератор, например, строк из курсора.
+        name: Название этапа.
+
+    Returns:
+        Итератор с замером или тот же итератор, если профиля нет.
+    """
+    profile = _current.get()
+    if profile is None or not profile.spans:
+        return rows
+    return profile.trace(rows, name)
+
+
+@contextmanager
+def cycle(
+        modes: frozenset, directory: str,
+        ) -> Generator[list[Profile], None, None]:
+    """Профилировать загрузки индексов в этом цикле ETL.
+
+    Args:
+        modes: Режимы на каждый цикл.  Если их нет, цикл
+            профилируется, только если пришел сигнал.
+        directory: Куда писать отчеты.
+
+    Yields:
+        Список, в который попадают профили завершенных загрузок.
+    """
+    global _cycle
+    finished = []
+    if not modes and _signalled.is_set():
+        _signalled.clear()
+        modes = _signal_modes
+    if not modes:
+        yield finished
+        return
+    tracing = tracemalloc.is_tracing()
+    _cycle = (modes, directory, finished)
+    try:
+        yield finished
+    finally:
+        _cycle = None
+        if 'tracemalloc' in modes and not tracing:
+            tracemalloc.stop()
+
+
+@contextmanager
+def profile(index: str) -> Generator[None, None, None]:
+    """Профилировать загрузку индекса, если цикл профилируется.
+
+    Вызывается в потоке или задаче, которая загружает индекс.
+
+    Args:
+        index: Индекс.
+    """
+    if _cycle is None:
+        yield
+        return
+    modes, directory, finished = _cycle
+    current = Profile(index, modes, directory)
+    token = _current.set(current)
+    current.start()
+    try:
+        yield
+    finally:
+        current.stop()
+        _current.reset(token)
+        path = current.write()
+        logging.info(f'Wrote {index} profile to {path}.')
+        finished.append(current)
+
+
+def install_signal_handler(
+        signum: int = signal.SIGUSR1, modes: frozenset = _signal_modes,
+        ) -> None:
+    """Профилировать следующий цикл ETL по сигналу.
+
+    Args:
+        signum: Сигнал.
+        modes: Режимы для цикла, запрошенного сигналом.
+    """
+    global _signal_modes
+    _signal_modes = modes
+
+    def request_profile(signum: int, frame: Any) -> None:
+        _signalled.set()
+
+    signal.signal(signum, request_profile)
@@ -0,0 +1,278 @@
+"""Сверка индексов ElasticSearch с PostgreSQL.
+
+Находит документы, которых нет в индексе, и документы объектов,
+которых больше нет в базе, и исправляет их: первые загружает заново,
+вторые удаляет.  Содержимое документов не сравнивается, его
+обновляет регулярная загрузка.
+
+ID сравниваются по диапазонам, как в дереве Меркла.  Пространство
+UUID делится на 16 диапазонов по первой шестнадцатеричной цифре, и
+для каждого диапазона PostgreSQL и ElasticSearch считают число ID и
+их контрольную сумму.  Совпавшие диапазоны пропускаются, а
+несовпавшие делятся по следующей цифре, пока в диапазоне не останется
+не больше RECONCILE_LEAF_SIZE документов - их ID сравниваются
+поштучно.  Поэтому число запросов растет с числом расхождений, а не
+с размером каталога.
+
+Контрольная сумма - сумма последних 6 цифр ID как чисел.  В
+ElasticSearch она считается агрегацией sum, которая копит double,
+поэтому точна, пока в диапазоне меньше 2^29 документов.
+
+Запуск: python reconcile.py [--dry-run] [movies genres persons]
+"""
+
+import argparse
+import logging
+import uuid
+from collections.abc import Sequence
+from typing import Optional
+
+from elasticsearch import Elasticsearch
+from psycopg2.extensions import connection as pg_connection
+
+import settings
+from extract.postgres_loader import PostgresLoader, postgres_connection
+from load.elastic_search_saver import (ElasticSearchSaver,
+                                       elastic_search_connection)
+from load_data import INDEX_LOADERS, save_rows
+from pipeline import saver_options
+from serializers import get_serializer
+from storage import MemoryStorage, State
+
+HEX_DIGITS = '0123456789abcdef'
+# Число шестнадцатеричных цифр в UUID.
+ID_DIGITS = 32
+# Контрольная сумма ID документа, та же, что в
+# PostgresLoader.range_checksums.
+CHECKSUM_SCRIPT = "Long.parseLong(doc['id'].value.substring(30), 16)"
+
+# Число документов и контрольная сумма их ID.
+Checksum = tuple[int, int]
+
+
+def id_range(prefix: str) -> tuple[str, Optional[str]]:
+    """Получить границы диапазона UUID с общими первыми цифрами.
+
+    Args:
+        prefix: Первые шестнадцатеричные цифры UUID.
+
+    Returns:
+        Наименьший UUID диапазона и UUID, с которого начинается
+        следующий диапазон, или None, если диапазон идет до конца.
+    """
+    low = str(uuid.UUID(hex=prefix.ljust(ID_DIGITS, '0')))
+    if not prefix.strip('f'):
+        return low, None
+    following = format(int(prefix, 16) + 1, f'0{len(prefix)}x')
+    return low, str(uuid.UUID(hex=following.ljust(ID_DIGITS, '0')))
+
+
+def _range_query(prefix: str) -> dict:
+    """Собрать запрос документов из диапазона ID.
+
+    Args:
+        prefix: Первые цифры ID диапазона.
+
+    Returns:
+        Запрос range к полю id.
+    """
+    low, high = id_range(prefix)
+    bounds = {'gte': low}
+    if high:
+        bounds['lt'] = high
+    return {'range': {'id': bounds}}
+
+
+def es_checksums(
+        client: Elasticsearch, index: str, prefix: str,
+        ) -> dict[str, Checksum]:
+    """Посчитать число и контрольную сумму ID документов по поддиапазонам.
+
+    Args:
+        client: Подключение к ElasticSearch.
+        index: Индекс.
+        prefix: Первые цифры ID диапазона, который делится на 16
+            поддиапазонов по следующей цифре.
+
+    Returns:
+        Число документов и контрольная сумма по первым цифрам ID.
+        Пустые поддиапазоны пропускаются.
+    """
+    body = {
+        'size': 0,
+        'query': _range_query(prefix),
+        'aggs': {
+            'ranges': {
+                'filters': {
+                    'filters': {
+                        prefix + digit: _range_query(prefix + digit)
+                        for digit in HEX_DIGITS
+                    },
+                },
+                'aggs': {
+                    'checksum': {'sum': {'script': CHECKSUM_SCRIPT}},
+                },
+            },
+        },
+    }
+    buckets = client.search(index=index, body=body)[
+        'aggregations']['ranges']['buckets']
+    return {
+        child: (bucket['doc_count'], int(bucket['checksum']['value']))
+        for child, bucket in buckets.items()
+        if bucket['doc_count']
+    }
+
+
+def es_ids(
+        client: Elasticsearch, index: str, prefix: str, size: int,
+        ) -> list[str]:
+    """Получить ID документов из диапазона.
+
+    Args:
+        client: Подключение к ElasticSearch.
+        index: Индекс.
+        prefix: Первые цифры ID диапазона.
+        size: Сколько документов в диапазоне самое большее.
+
+    Returns:
+        ID документов.
+    """
+    body = {'query': _range_query(prefix), '_source': False, 'size': size}
+    hits = client.search(index=index, body=body)['hits']['hits']
+    return [hit['_id'] for hit in hits]
+
+
+def find_drift(
+        loader: PostgresLoader, client: Elasticsearch, index: str,
+        leaf_size: int,
+        ) -> tuple[list[str], list[str]]:
+    """Найти расхождения ID объектов в PostgreSQL и документов в индексе.
+
+    Args:
+        loader: Загрузчик объектов индекса из PostgreSQL.
+        client: Подключение к ElasticSearch.
+        index: Индекс или алиас.
+        leaf_size: С какого числа документов в диапазоне сравнивать
+            их ID поштучно.
+
+    Returns:
+        ID объектов, которых нет в индексе, и ID документов, которых
+        нет в PostgreSQL.
+    """
+    missing, orphaned = [], []
+    prefixes = ['']
+    while prefixes:
+        prefix = prefixes.pop()
+        low, high = id_range(prefix)
+        in_postgres = loader.range_checksums(low, high, len(prefix) + 1)
+        in_elastic = es_checksums(client, index, prefix)
+        for child in sorted(in_postgres.keys() | in_elastic.keys()):
+            postgres = in_postgres.get(child, (0, 0))
+            elastic = in_elastic.get(child, (0, 0))
+            if postgres == elastic:
+                continue
+            size = max(postgres[0], elastic[0])
+            if size > leaf_size and len(child) < ID_DIGITS:
+                prefixes.append(child)
+                continue
+            postgres_ids = set(loader.range_ids(*id_range(child)))
+            elastic_ids = set(es_ids(client, index, child, size))
+            missing += sorted(postgres_ids - elastic_ids)
+            orphaned += sorted(elastic_ids - postgres_ids)
+    return missing, orphaned
+
+
+def reconcile(
+        index_loader: type[PostgresLoader],
+        pg_conn: pg_connection,
+        es_client: Elasticsearch,
+        dry_run: bool = False,
+        ) -> tuple[int, int]:
+    """Сверить индекс с PostgreSQL и исправить расхождения.
+
+    Перед загрузкой или удалением каждый ID заново проверяется в
+    PostgreSQL, поэтому объект, созданный или удаленный во время
+    сверки, не пострадает.
+
+    Args:
+        index_loader: Класс загрузчика объектов индекса из PostgreSQL.
+        pg_conn: Подключение к PostgreSQL.
+        es_client: Подключение к ElasticSearch.
+        dry_run: Только найти расхождения.
+
+    Returns:
+        Число недостающих и лишних документов.
+    """
+    loader = index_loader(
+        pg_conn, State(MemoryStorage()),
+        itersize=settings.POSTGRES_ITERSIZE,
+        pass_through=settings.ETL_PASS_THROUGH,
+        validate_every=settings.ETL_VALIDATE_EVERY,
+        dsl=settings.POSTGRES_DB,
+        reconnect_attempts=settings.POSTGRES_RECONNECT_ATTEMPTS,
+    )
+    index = loader.es_index
+    try:
+        missing, orphaned = find_drift(
+            loader, es_client, index, settings.RECONCILE_LEAF_SIZE,
+        )
+        logging.info(
+            f'{index}: {len(missing)} documents are missing, '
+            f'{len(orphaned)} documents are orphaned.',
+        )
+        if dry_run or not (missing or orphaned):
+            return len(missing), len(orphaned)
+        # Без отпечатков: у пропавшего документа отпечаток мог остаться.
+        saver = ElasticSearchSaver(es_client, index, **saver_options())
+        loader.bunch_size = saver.batch_size
+        save_rows(loader, saver, loader.load_ids(missing + orphaned))
+    finally:
+        loader.close()
+    if saver.dead_letter_count:
+        logging.warning(
+            f'Failed to fix {saver.dead_letter_count} {index} documents, '
+            f'see {settings.DEAD_LETTERS_FILE}.',
+        )
+    return len(missing), len(orphaned)
+
+
+def reconcile_all(
+        index_loaders: Sequence[type[PostgresLoader]], dry_run: bool = False,
+        ) -> None:
+    """Сверить индексы с PostgreSQL.
+
+    Args:
+        index_loaders: Классы загрузчиков индексов, которые нужно сверить.
+        dry_run: Только найти расхождения.
+    """
+    serializer = get_serializer(settings.JSON_SERIALIZER)
+    with (
+        elastic_search_connection(
+            settings.ELASTIC_HOST, serializer,
+        ) as es_client,
+        postgres_connection(settings.POSTGRES_DB) as pg_conn,
+    ):
+        for index_loader in index_loaders:
+            reconcile(index_loader, pg_conn, es_client, dry_run)
+
+
+if __name__ == '__main__':
+    loaders = {
+        index_loader.es_index: index_loader for index_loader in INDEX_LOADERS
+    }
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        'indices', nargs='*', metavar='index',
+        help=f'Индексы для сверки: {", ".join(loaders)}.',
+    )
+    parser.add_argument(
+        '--dry-run', action='store_true',
+        help='Только найти расхождения, ничего не исправлять.',
+    )
+    args = parser.parse_args()
+    if unknown := set(args.indices).difference(loaders):
+        parser.error(f'unknown indices: {", ".join(sorted(unknown))}')
+    reconcile_all(
+        [loaders[index] for index in args.indices or loaders], args.dry_run,
+    )
@@ -0,0 +1,164 @@
+"""Полная переиндексация без простоя поиска.
+
+Каждый индекс загружается с нуля в новую версию, например
+movies_v20220801120000, пока клиенты продолжают читать старую через
+алиас movies.  После загрузки алиас атомарно переключается на новую
+версию, а старые версии удаляются.
+
+Запуск: python reindex.py [--allow-missing] [movies genres persons]
+"""
+
+import argparse
+import logging
+from collections.abc import Sequence
+
+from elasticsearch import Elasticsearch
+from psycopg2.extensions import connection as pg_connection
+
+import settings
+from extract.postgres_loader import PostgresLoader, postgres_connection
+from load.elastic_search_index import (create_bulk_index, finish_bulk_index,
+                                       live_replicas, swap_alias)
+from load.elastic_search_saver import (ElasticSearchSaver,
+                                       elastic_search_connection)
+from load_data import INDEX_LOADERS, load
+from pipeline import saver_options
+from serializers import get_serializer
+from storage import CheckpointLedger, JsonFileStorage, MemoryStorage, State
+
+
+class ReindexError(Exception):
+    """Новая версия индекса загружена, но алиас на нее не переключен."""
+
+
+def reindex(
+        index_loader: type[PostgresLoader],
+        pg_conn: pg_connection,
+        es_client: Elasticsearch,
+        allow_missing: bool = False,
+        ) -> dict:
+    """Загрузить индекс в новую версию и переключить на нее алиас.
+
+    Если загрузка не удалась, новая версия удаляется.  Если не удалось
+    то, что идет после загрузки, новая версия остается в ElasticSearch,
+    чтобы ее можно было проверить и переключить алиас вручную.
+
+    Args:
+        index_loader: Класс загрузчика объектов индекса из PostgreSQL.
+        pg_conn: Подключение к PostgreSQL.
+        es_client: Подключение к ElasticSearch.
+        allow_missing: Переключать алиас, даже если часть документов
+            отложена в файл несохраненных документов.
+
+    Returns:
+        Состояние загрузки новой версии индекса.
+
+    Raises:
+        ReindexError: В новой версии не хватает документов или ей не
+            удалось вернуть рабочие настройки.
+    """
+    alias = index_loader.es_index
+    replicas = live_replicas(es_client, alias)
+    name = create_bulk_index(es_client, alias)
+    storage = MemoryStorage()
+    state = State(storage)
+    try:
+        loader = index_loader(
+            pg_conn, state,
+            itersize=settings.POSTGRES_ITERSIZE,
+            pass_through=settings.ETL_PASS_THROUGH,
+            validate_every=settings.ETL_VALIDATE_EVERY,
+            dsl=settings.POSTGRES_DB,
+            reconnect_attempts=settings.POSTGRES_RECONNECT_ATTEMPTS,
+        )
+        saver = ElasticSearchSaver(
+            es_client,
+            name,
+            ledger=CheckpointLedger(state),
+            **saver_options(),
+        )
+        try:
+            load(loader, saver)
+        finally:
+            loader.close()
+    except BaseException:
+        logging.exception(f'Failed {alias} reindex, dropping {name} index.')
+        es_client.indices.delete(index=name, ignore_unavailable=True)
+        raise
+    if saver.dead_letter_count:
+        message = (
+            f'{saver.dead_letter_count} {alias} documents are missing '
+            f'from {name}, see {settings.DEAD_LETTERS_FILE}.'
+        )
+        if not allow_missing:
+            raise ReindexError(f'{message} Keeping {alias} alias.')
+        logging.warning(message)
+    try:
+        finish_bulk_index(
+            es_client, name, alias, replicas, settings.ES_FORCEMERGE_TIMEOUT,
+        )
+    except Exception as error:
+        raise ReindexError(
+            f'Loaded {name}, but failed to finish it. Keeping {alias} alias.',
+        ) from error
+    for old_index in swap_alias(es_client, name, alias):
+        es_client.indices.delete(index=old_index)
+        logging.info(f'Deleted {old_index} index.')
+    state.flush()
+    return storage.retrieve_state()
+
+
+def reindex_all(
+        index_loaders: Sequence[type[PostgresLoader]],
+        allow_missing: bool = False,
+        ) -> None:
+    """Переиндексировать индексы и продолжить обновления с их состояния.
+
+    Загрузка новой версии заканчивается на изменениях, сделанных до ее
+    начала, поэтому регулярная загрузка после переключения подхватывает
+    все, что изменилось за время переиндексации.  Пока идет
+    переиндексация, регулярную загрузку нужно остановить, иначе она
+    перезапишет файл состояния.
+
+    Args:
+        index_loaders: Классы загрузчиков индексов, которые нужно
+            переиндексировать.
+        allow_missing: Переключать алиас, даже если часть документов
+            отложена в файл несохраненных документов.
+    """
+    serializer = get_serializer(settings.JSON_SERIALIZER)
+    state = State(JsonFileStorage(settings.STATE_FILE, serializer))
+    with (
+        elastic_search_connection(
+            settings.ELASTIC_HOST, serializer,
+        ) as es_client,
+        postgres_connection(settings.POSTGRES_DB) as pg_conn,
+    ):
+        for index_loader in index_loaders:
+            for key, value in reindex(
+                index_loader, pg_conn, es_client, allow_missing,
+            ).items():
+                state.set_state(key, value)
+            state.flush()
+
+
+if __name__ == '__main__':
+    loaders = {
+        index_loader.es_index: index_loader for index_loader in INDEX_LOADERS
+    }
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        'indices', nargs='*', metavar='index',
+        help=f'Индексы для переиндексации: {", ".join(loaders)}.',
+    )
+    parser.add_argument(
+        '--allow-missing', action='store_true',
+        help='Переключать алиас, даже если часть документов не сохранена.',
+    )
+    args = parser.parse_args()
+    if unknown := set(args.indices).difference(loaders):
+        parser.error(f'unknown indices: {", ".join(sorted(unknown))}')
+    reindex_all(
+        [loaders[index] for index in args.indices or loaders],
+        args.allow_missing,
+    )
@@ -0,0 +1,159 @@
+"""Сериализация JSON для ElasticSearch и файла состояния.
+
+Быстрый сериализатор на orjson используется, если библиотека
+установлена, иначе стандартный модуль json.  Оба умеют UUID, datetime
+и Decimal и совместимы с транспортом elasticsearch-py.
+"""
+
+import json
+import uuid
+from datetime import date
+from decimal import Decimal
+from typing import Any, Union
+
+from elasticsearch.serializer import JSONSerializer
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _default(value: Any) -> Any:
+    """Привести к JSON типы, которых нет в стандартном json.
+
+    Args:
+        value: Значение, которое json не умеет сериализовать.
+
+    Returns:
+        Значение, которое json умеет сериализовать.
+
+    Raises:
+        TypeError: Если тип значения неизвестен.
+    """
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f'Unable to serialize {value!r} (type: {type(value)})')
+
+
+class StdlibSerializer(JSONSerializer):
+    """Сериализатор на стандартном модуле json."""
+
+    def dumps(self, data: Any) -> Union[str, bytes]:
+        """Сериализовать данные в строку JSON.
+
+        Готовые строки и байты, например, тело bulk-запроса в NDJSON,
+        возвращаются как есть.
+
+        Args:
+            data: Данные или уже готовая строка JSON.
+
+        Returns:
+            Строка JSON.
+        """
+        if isinstance(data, (str, bytes)):
+            return data
+        return json.dumps(
+            data, default=_default, ensure_ascii=False, separators=(',', ':'),
+        )
+
+    def dumpb(self, data: Any) -> bytes:
+        """Сериализовать данные в JSON в кодировке UTF-8.
+
+        Args:
+            data: Данные для сериализации.
+
+        Returns:
+            JSON в байтах.
+        """
+        return self.dumps(data).encode()
+
+    def loads(self, s: Union[str, bytes]) -> Any:
+        """Разобрать JSON.
+
+        Args:
+            s: Строка JSON.
+
+        Returns:
+            Разобранные данные.
+
+        Raises:
+            json.JSONDecodeError: Если строка не JSON.
+        """
+        return json.loads(s)
+
+
+class OrjsonSerializer(StdlibSerializer):
+    """Сериализатор на orjson, который сам умеет UUID и datetime."""
+
+    def dumps(self, data: Any) -> Union[str, bytes]:
+        """Сериализовать данные в строку JSON.
+
+        Готовые строки и байты, например, тело bulk-запроса в NDJSON,
+        возвращаются как есть.
+
+        Args:
+            data: Данные или уже готовая строка JSON.
+
+        Returns:
+            Строка JSON.
+        """
+        if isinstance(data, (str, bytes)):
+            return data
+        return orjson.dumps(data, default=_default).decode()
+
+    def dumpb(self, data: Any) -> bytes:
+        """Сериализовать данные в JSON в кодировке UTF-8.
+
+        Args:
+            data: Данные для сериализации.
+
+        Returns:
+            JSON в байтах.
+        """
+        return orjson.dumps(data, default=_default)
+
+    def loads(self, s: Union[str, bytes]) -> Any:
+        """Разобрать JSON.
+
+        Args:
+            s: Строка JSON.
+
+        Returns:
+            Разобранные данные.
+
+        Raises:
+            json.JSONDecodeError: Если строка не JSON.
+        """
+        return orjson.loads(s)
+
+
+SERIALIZERS = {
+    'json': StdlibSerializer,
+    'orjson': OrjsonSerializer,
+}
+
+
+def get_serializer(name: str = 'auto') -> StdlibSerializer:
+    """Выбрать сериализатор по названию.
+
+    Args:
+        name: json, orjson или auto - orjson, если он установлен.
+
+    Returns:
+        Сериализатор.
+
+    Raises:
+        ValueError: Если сериализатор неизвестен или не установлен.
+    """
+    if name == 'auto':
+        name = 'orjson' if orjson else 'json'
+    if name not in SERIALIZERS:
+        raise ValueError(f'Unknown JSON serializer {name}.')
+    if name == 'orjson' and not orjson:
+        raise ValueError('JSON serializer orjson is not installed.')
+    return SERIALIZERS[name]()
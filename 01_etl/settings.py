@@ -5,6 +5,14 @@ from dotenv import load_dotenv
 load_dotenv()
 
 
+def _env_flag(name: str, default: bool = False) -> bool:
+    """Прочитать логический флаг из переменной окружения."""
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
+
 POSTGRES_DB = {
     'dbname': os.getenv('POSTGRES_NAME'),
     'user': os.getenv('POSTGRES_USER'),
@@ -27,5 +35,94 @@ ELASTIC_TEST_HOST = {
     'host': os.getenv('ELASTIC_TEST_HOST'),
     'port': os.getenv('ELASTIC_TEST_PORT'),
 }
+# Сериализатор JSON для ElasticSearch и файла состояния: json, orjson
+# или auto - orjson, если он установлен.
+JSON_SERIALIZER = os.getenv('JSON_SERIALIZER', 'auto')
 STATE_FILE = './state.json'
+# Не отправлять в ElasticSearch документы, которые не изменились с
+# прошлой отправки.  Отпечатки документов хранятся в SQLite.
+# Выключено по умолчанию: правки индекса в обход ETL с ним не
+# исправляются, пока не удален файл отпечатков.
+ETL_SKIP_UNCHANGED = _env_flag('ETL_SKIP_UNCHANGED', False)
+FINGERPRINTS_FILE = os.getenv('FINGERPRINTS_FILE', './fingerprints.db')
+# Записывать состояние на диск раз в столько изменений или секунд.
+STATE_FLUSH_EVERY = int(os.getenv('STATE_FLUSH_EVERY', 100))
+STATE_FLUSH_INTERVAL = float(os.getenv('STATE_FLUSH_INTERVAL', 5))
+# Сколько строк за раз забирать из серверного курсора PostgreSQL.
+POSTGRES_ITERSIZE = int(os.getenv('POSTGRES_ITERSIZE', 1000))
+# Сколько раз подряд переподключаться к PostgreSQL посреди запроса,
+# прежде чем перезапускать весь ETL.
+POSTGRES_RECONNECT_ATTEMPTS = int(os.getenv('POSTGRES_RECONNECT_ATTEMPTS', 3))
+# Ограничения bulk-запроса в ElasticSearch по числу документов и байтам.
+ES_BULK_SIZE = int(os.getenv('ES_BULK_SIZE', 100))
+ES_BULK_MAX_BYTES = int(os.getenv('ES_BULK_MAX_BYTES', 5 * 1024 * 1024))
+# Сколько bulk-запросов одного индекса держать в полете одновременно.
+ES_BULK_CONCURRENCY = int(os.getenv('ES_BULK_CONCURRENCY', 4))
+# Подстраивать размер bulk-запроса в пределах от ES_BULK_MIN_SIZE до
+# ES_BULK_MAX_SIZE и число запросов в полете до ES_BULK_CONCURRENCY
+# под время ответа кластера (цель - ES_BULK_TARGET_LATENCY секунд) и
+# повторять запросы, отклоненные с кодом 429, вместо перезапуска ETL.
+ES_BULK_ADAPTIVE = _env_flag('ES_BULK_ADAPTIVE', True)
+ES_BULK_MIN_SIZE = int(os.getenv('ES_BULK_MIN_SIZE', 10))
+ES_BULK_MAX_SIZE = int(os.getenv('ES_BULK_MAX_SIZE', 1000))
+ES_BULK_TARGET_LATENCY = float(os.getenv('ES_BULK_TARGET_LATENCY', 1))
+# Сколько раз повторять документы bulk-запроса, не сохраненные из-за
+# временных ошибок (429, 503), и пауза перед первым повтором.
+ES_BULK_MAX_RETRIES = int(os.getenv('ES_BULK_MAX_RETRIES', 5))
+ES_BULK_RETRY_PAUSE = float(os.getenv('ES_BULK_RETRY_PAUSE', 0.5))
+# Сколько секунд ждать force merge новой версии индекса при
+# переиндексации.
+ES_FORCEMERGE_TIMEOUT = float(os.getenv('ES_FORCEMERGE_TIMEOUT', 3600))
+# Куда откладывать документы, которые ElasticSearch не принял из-за
+# неисправимых ошибок.  Пустая строка - прерывать загрузку на них.
+DEAD_LETTERS_FILE = os.getenv('DEAD_LETTERS_FILE', '')
+# Сколько перезапусков ETL после ошибок подключения разрешено за
+# ETL_RETRY_BUDGET_PERIOD секунд.  Когда бюджет исчерпан, ETL падает,
+# а не повторяет попытки бесконечно.  0 - без ограничения.
+ETL_RETRY_BUDGET = int(os.getenv('ETL_RETRY_BUDGET', 0))
+ETL_RETRY_BUDGET_PERIOD = float(os.getenv('ETL_RETRY_BUDGET_PERIOD', 600))
+# Адрес и порт, на которых отдавать метрики Prometheus по пути
+# /metrics.  Порт 0 - не запускать сервер метрик.
+ETL_METRICS_HOST = os.getenv('ETL_METRICS_HOST', '127.0.0.1')
+ETL_METRICS_PORT = int(os.getenv('ETL_METRICS_PORT', 0))
+# Профилировать каждый цикл ETL: режимы через запятую из spans,
+# cprofile, tracemalloc.  Пустая строка - профилировать только цикл
+# после сигнала SIGUSR1 в режимах ETL_PROFILE_ON_SIGNAL.  Отчеты по
+# индексам пишутся в ETL_PROFILE_DIR.
+ETL_PROFILE = os.getenv('ETL_PROFILE', '')
+ETL_PROFILE_ON_SIGNAL = os.getenv('ETL_PROFILE_ON_SIGNAL', 'spans,cprofile')
+ETL_PROFILE_DIR = os.getenv('ETL_PROFILE_DIR', './profiles')
+# reconcile.py сравнивает ID в диапазоне поштучно, когда в нем не
+# больше RECONCILE_LEAF_SIZE документов, а до того делит диапазон дальше.
+RECONCILE_LEAF_SIZE = int(os.getenv('RECONCILE_LEAF_SIZE', 1000))
 ETL_TIMEOUT = 60        # Пауза между перезапусками импорта.
+# Загружать индексы movies, genres и persons параллельно, каждый
+# через свое подключение из пула.
+ETL_CONCURRENT = _env_flag('ETL_CONCURRENT')
+# Загружать изменения сразу по уведомлениям PostgreSQL (LISTEN/NOTIFY),
+# а полный проход делать раз в ETL_TIMEOUT как страховку.
+# Требует триггеров из postgres/etl_notify.sql.
+ETL_LISTEN = _env_flag('ETL_LISTEN')
+ETL_NOTIFY_CHANNEL = 'etl_changes'
+# Откуда брать изменения: scan - сканировать таблицы по времени правки,
+# change_log - читать журнал из postgres/etl_change_log.sql.
+ETL_EXTRACTOR = os.getenv('ETL_EXTRACTOR', 'scan')
+# В режиме change_log обновлять film_ids у жанров и персон частично,
+# по изменениям связей с фильмами, а не собирать документ заново.
+ETL_FILM_IDS_DELTAS = _env_flag('ETL_FILM_IDS_DELTAS')
+# Собирать документы индексов в PostgreSQL и отправлять их в
+# ElasticSearch как есть, без разбора и повторной сериализации.
+ETL_PASS_THROUGH = _env_flag('ETL_PASS_THROUGH')
+# Проверять pydantic-валидатором жанров и персон каждую N-ю строку,
+# остальные собирать без проверки.  1 - проверять все строки,
+# 0 - не проверять совсем.
+ETL_VALIDATE_EVERY = int(os.getenv('ETL_VALIDATE_EVERY', 1))
+# Собирать документы в стольких процессах, 0 - в основном процессе.
+# Строки уходят в процессы пачками по ETL_TRANSFORM_CHUNK_SIZE.
+ETL_TRANSFORM_WORKERS = int(os.getenv('ETL_TRANSFORM_WORKERS', 0))
+ETL_TRANSFORM_CHUNK_SIZE = int(os.getenv('ETL_TRANSFORM_CHUNK_SIZE', 500))
+# Движок загрузки: sync - генераторы в одном потоке на индекс,
+# async - извлечение, сборка и отправка документов отдельными задачами
+# asyncio, связанными очередями по ETL_ASYNC_QUEUE_SIZE элементов.
+ETL_ENGINE = os.getenv('ETL_ENGINE', 'sync')
+ETL_ASYNC_QUEUE_SIZE = int(os.getenv('ETL_ASYNC_QUEUE_SIZE', 1000))
@@ -1,9 +1,20 @@
 """Хранение состояния загрузки данных в ElasticSearch."""
 
 import abc
-import json
+import itertools
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
 from typing import Any, Optional
 
+from elasticsearch.serializer import Serializer
+
+from serializers import get_serializer
+
 
 class BaseStorage:
     """Интерфейс хранилища состояния."""
@@ -30,22 +41,51 @@ class BaseStorage:
 class JsonFileStorage(BaseStorage):
     """Хранилище состояния в виде JSON в файле."""
 
-    def __init__(self, file_path: Optional[str] = None):
+    def __init__(
+            self,
+            file_path: Optional[str] = None,
+            serializer: Optional[Serializer] = None,
+            ):
         """Проинициализировать путь к файлу.
 
         Args:
             file_path: Путь к файлу для хранения состояния.
+            serializer: Сериализатор JSON, по умолчанию самый быстрый
+                из установленных.
         """
         self.file_path = file_path
+        self.serializer = serializer or get_serializer()
+        self._dumpb = getattr(self.serializer, 'dumpb', None) or (
+            lambda data: self.serializer.dumps(data).encode()
+        )
 
     def save_state(self, state: dict) -> None:
         """Записать JSON-состояние в файл.
 
+        Состояние пишется во временный файл рядом с основным, который
+        после fsync атомарно подменяет основной.  Поэтому при падении
+        процесса на диске остается либо старое, либо новое состояние,
+        но не обрезанный файл.
+
         Args:
             state: состояние в виде JSON.
         """
-        with open(self.file_path, 'w') as f:
-            f.write(json.dumps(state, default=str))
+        directory = os.path.dirname(os.path.abspath(self.file_path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(self._dumpb(state))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.file_path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        dir_fd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
 
     def retrieve_state(self) -> dict:
         """Получить JSON-состояние из файла.
@@ -54,33 +94,83 @@ class JsonFileStorage(BaseStorage):
             JSON-состояние из файла.
         """
         try:
-            with open(self.file_path) as f:
+            with open(self.file_path, 'rb') as f:
                 state = f.read()
         except FileNotFoundError:
             return {}
         try:
-            return json.loads(state)
-        except json.decoder.JSONDecodeError:
+            return self.serializer.loads(state)
+        except ValueError:
+            logging.error(
+                f'State file {self.file_path} is corrupted, '
+                'loading starts from scratch.',
+            )
             return {}
 
 
+class MemoryStorage(BaseStorage):
+    """Хранилище состояния в памяти процесса."""
+
+    def __init__(self, state: Optional[dict] = None):
+        """Проинициализировать начальное состояние.
+
+        Args:
+            state: Начальное состояние.
+        """
+        self.state = dict(state or {})
+
+    def save_state(self, state: dict) -> None:
+        """Запомнить копию состояния.
+
+        Args:
+            state: Состояние для записи в хранилище.
+        """
+        self.state = dict(state)
+
+    def retrieve_state(self) -> dict:
+        """Получить копию состояния.
+
+        Returns:
+            Сохраненное состояние.
+        """
+        return dict(self.state)
+
+
 class State:
     """Класс для хранения состояния при работе с данными.
 
     Предназначен для хранения актуального состояния процесса
     обработки данных.  Дает возможность после перезапуска
     процесса продолжить не с начала, а с позиции, на которой
-    остановился.
+    остановился.  Безопасен для использования из нескольких потоков.
+
+    Состояние читается из хранилища один раз и дальше живет в памяти.
+    В хранилище оно записывается не при каждом изменении, а раз в
+    flush_every изменений или раз в flush_interval секунд, а также
+    при явном вызове flush().  Потеря незаписанных изменений при
+    падении означает лишь повторную загрузку части данных.
     """
 
-    def __init__(self, storage: BaseStorage):
+    def __init__(
+            self,
+            storage: BaseStorage,
+            flush_every: int = 1,
+            flush_interval: float = 0,
+            ):
         """Проинициализировать состояние и хранилище состояния.
 
         Args:
             storage: Постоянное хранилище состояния.
+            flush_every: Через сколько изменений записывать состояние.
+            flush_interval: Через сколько секунд записывать состояние.
         """
         self.storage = storage
-        self._state = {}
+        self._state = storage.retrieve_state()
+        self._lock = threading.Lock()
+        self._flush_every = flush_every
+        self._flush_interval = flush_interval
+        self._changes = 0
+        self._flushed_at = time.monotonic()
 
     def set_state(self, key: str, value: Any) -> None:
         """Установить состояние для определённого ключа.
@@ -89,8 +179,27 @@ class State:
             key: Ключ состояния.
             value: Значение ключа.
         """
-        self._state[key] = value
+        with self._lock:
+            self._state[key] = value
+            self._changes += 1
+            elapsed = time.monotonic() - self._flushed_at
+            if (
+                self._changes >= self._flush_every
+                or elapsed >= self._flush_interval
+            ):
+                self._flush()
+
+    def flush(self) -> None:
+        """Записать изменения состояния в хранилище."""
+        with self._lock:
+            if self._changes:
+                self._flush()
+
+    def _flush(self) -> None:
+        """Записать состояние в хранилище без захвата блокировки."""
         self.storage.save_state(self._state)
+        self._changes = 0
+        self._flushed_at = time.monotonic()
 
     def get_state(self, key: str) -> Any:
         """Получить состояние по определённому ключу.
@@ -101,5 +210,88 @@ class State:
         Returns:
             Значение ключа.
         """
-        self._state = self.storage.retrieve_state()
-        return self._state.get(key)
+        with self._lock:
+            return self._state.get(key)
+
+
+@dataclass(frozen=True)
+class Checkpoint:
+    """Отметка в потоке строк: все строки до нее можно считать загруженными.
+
+    Загрузчики выдают ее вместо прямой записи состояния, чтобы
+    состояние сохранялось только после того, как ElasticSearch
+    подтвердит сохранение всех предшествующих документов.
+    """
+
+    key: str
+    value: Any
+
+
+class CheckpointLedger:
+    """Журнал отметок состояния, ожидающих подтверждения от ElasticSearch.
+
+    Каждый bulk-запрос получает номер.  Отметка привязывается к
+    последнему открытому запросу: она покрывает его документы и
+    документы всех запросов до него.  Когда запрос подтвержден, а
+    все запросы до него тоже подтверждены, его отметки записываются
+    в состояние.  Поэтому bulk-запросы можно отправлять параллельно,
+    а после падения загрузка продолжится не дальше последнего
+    документа, сохраненного без пропусков.
+    """
+
+    def __init__(self, state: State):
+        """Проинициализировать журнал.
+
+        Args:
+            state: Состояние, в которое записывать подтвержденные отметки.
+        """
+        self.state = state
+        self._tickets = itertools.count()
+        # Записи вида [номер запроса, подтвержден ли, отметки].
+        self._pending: deque[list] = deque()
+        self._lock = threading.Lock()
+
+    def open_batch(self) -> int:
+        """Зарегистрировать новый bulk-запрос.
+
+        Returns:
+            Номер запроса для последующего подтверждения.
+        """
+        with self._lock:
+            ticket = next(self._tickets)
+            self._pending.append([ticket, False, []])
+            return ticket
+
+    def add(self, checkpoint: Checkpoint) -> None:
+        """Привязать отметку к последнему зарегистрированному запросу.
+
+        Если неподтвержденных запросов нет, отметка сразу
+        записывается в состояние.
+
+        Args:
+            checkpoint: Отметка состояния.
+        """
+        with self._lock:
+            if self._pending:
+                self._pending[-1][2].append(checkpoint)
+            else:
+                self.state.set_state(checkpoint.key, checkpoint.value)
+
+    def ack(self, ticket: int) -> None:
+        """Подтвердить запрос и записать отметки, ставшие надежными.
+
+        Args:
+            ticket: Номер подтвержденного запроса.
+        """
+        with self._lock:
+            for entry in self._pending:
+                if entry[0] == ticket:
+                    entry[1] = True
+                    break
+            committed = []
+            while self._pending and self._pending[0][1]:
+                committed.extend(self._pending.popleft()[2])
+            # Запись в состояние под блокировкой сохраняет порядок
+            # отметок при подтверждениях из разных потоков.
+            for checkpoint in committed:
+                self.state.set_state(checkpoint.key, checkpoint.value)
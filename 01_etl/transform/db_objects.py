@@ -1,9 +1,9 @@
 """Python-представление данных о фильмах."""
 
-from typing import Optional
 import uuid
 from dataclasses import dataclass, field, fields
 from datetime import datetime
+from typing import Any, Mapping, Optional
 
 from dateutil.parser import parse
 from pydantic import BaseModel
@@ -100,6 +100,52 @@ class FilmWork(DBData):
         return doc
 
 
+def film_work_document(row: Mapping[str, Any]) -> dict:
+    """Собрать документ фильма для ElasticSearch прямо из строки БД.
+
+    Дает тот же документ, что и FilmWork(**row).as_document(), но без
+    промежуточного объекта: не разбирает даты, которых нет в
+    документе, и раскладывает персон по ролям за один проход.
+
+    Args:
+        row: Строка БД с информацией о фильме.
+
+    Returns:
+        Документ ElasticSearch в виде dict.
+
+    Raises:
+        KeyError: Если у персоны неизвестная роль.
+    """
+    director, actors_names, writers_names = [], [], []
+    actors, writers = [], []
+    for person in row['persons']:
+        role = person['role']
+        name = person['name']
+        if role == 'actor':
+            actors_names.append(name)
+            actors.append({'id': person['id'], 'name': name})
+        elif role == 'writer':
+            writers_names.append(name)
+            writers.append({'id': person['id'], 'name': name})
+        elif role == 'director':
+            director.append(name)
+        else:
+            raise KeyError(role)
+    return {
+        'id': row['id'],
+        'imdb_rating': row.get('rating', 0.0),
+        'genre': row['genre'],
+        'genres': row['genres'],
+        'title': row['title'],
+        'description': row['description'],
+        'director': director,
+        'actors_names': actors_names,
+        'writers_names': writers_names,
+        'actors': actors,
+        'writers': writers,
+    }
+
+
 class Genre(BaseModel):
     """Объектное представление строк таблицы genre."""
 
@@ -111,7 +157,12 @@ class Genre(BaseModel):
 
     def as_document(self) -> dict:
         """Костыль, чтобы использовать параллельно с dataclsses."""
-        return self.dict()
+        return {
+            'id': self.id,
+            'name': self.name,
+            'description': self.description,
+            'film_ids': self.film_ids,
+        }
 
 
 class Person(BaseModel):
@@ -0,0 +1,183 @@
+"""Сборка документов в пуле процессов."""
+
+import multiprocessing
+import time
+from collections import deque
+from collections.abc import Iterable, Iterator
+from concurrent.futures import Executor, Future, ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Any
+
+import metrics
+from serializers import get_serializer
+
+
+@dataclass(frozen=True)
+class Serialized:
+    """Документ, уже собранный и сериализованный в другом процессе."""
+
+    id: str
+    source: bytes
+
+
+def create_executor(workers: int) -> ProcessPoolExecutor:
+    """Создать пул процессов для сборки документов.
+
+    Процессы запускаются через spawn, а не fork: к этому моменту в
+    основном процессе уже работают потоки bulk-запросов, и fork может
+    унести в дочерний процесс захваченные ими блокировки.
+
+    Args:
+        workers: Число процессов.
+
+    Returns:
+        Пул процессов.
+    """
+    return ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context('spawn'),
+    )
+
+
+def transform_chunk(
+        index_loader: type,
+        rows: list[dict],
+        validate_every: int,
+        serializer_name: str,
+        ) -> tuple[float, list[tuple[str, bytes]]]:
+    """Собрать и сериализовать документы из строк БД.
+
+    Выполняется в процессе из пула.
+
+    Args:
+        index_loader: Класс загрузчика, который умеет собирать документ.
+        rows: Строки БД.
+        validate_every: Как часто проверять строки валидатором.
+        serializer_name: Название сериализатора JSON.
+
+    Returns:
+        Время сборки в секундах и пары из id документа и документа
+        в JSON.
+    """
+    started = time.perf_counter()
+    loader = index_loader(None, None, validate_every=validate_every)
+    serializer = get_serializer(serializer_name)
+    documents = [
+        (str(row['id']), serializer.dumpb(loader.to_document(row)))
+        for row in rows
+    ]
+    return time.perf_counter() - started, documents
+
+
+class TransformPool:
+    """Этап сборки документов в пуле процессов.
+
+    Строки из загрузчика собираются в пачки по chunk_size и уходят в
+    процессы пула, а отметки загрузчика (Checkpoint, Deleted и другие)
+    проходят мимо пула.  На выходе документы и отметки идут в том же
+    порядке, что и на входе.  В работе одновременно не больше
+    max_pending пачек: пока они не готовы, следующие строки из
+    загрузчика не читаются, поэтому память ограничена.
+    """
+
+    def __init__(
+            self,
+            executor: Executor,
+            index_loader: type,
+            chunk_size: int = 500,
+            max_pending: int = 4,
+            validate_every: int = 1,
+            serializer_name: str = 'auto',
+            ):
+        """Проинициализировать этап.
+
+        Args:
+            executor: Пул процессов.
+            index_loader: Класс загрузчика, который умеет собирать документ.
+            chunk_size: Сколько строк отправлять в процесс за раз.
+            max_pending: Сколько пачек может быть в работе одновременно.
+            validate_every: Как часто проверять строки валидатором.
+            serializer_name: Название сериализатора JSON.
+        """
+        self._executor = executor
+        self._index_loader = index_loader
+        self._chunk_size = chunk_size
+        self._max_pending = max_pending
+        self._validate_every = validate_every
+        self._serializer_name = serializer_name
+
+    def transform(self, rows: Iterable[Any]) -> Iterator[Any]:
+        """Собрать документы из строк, сохранив порядок строк и отметок.
+
+        Args:
+            rows: Строки БД и отметки от загрузчика.
+
+        Yields:
+            Serialized вместо каждой строки и отметки как есть.
+        """
+        pending = deque()
+        pending_chunks = 0
+        chunk = []
+        for row in rows:
+            if isinstance(row, dict):
+                chunk.append(dict(row))
+                if len(chunk) < self._chunk_size:
+                    continue
+            if chunk:
+                pending.append(self._submit(chunk))
+                pending_chunks += 1
+                chunk = []
+            if not isinstance(row, dict):
+                pending.append(row)
+            while pending and (
+                pending_chunks > self._max_pending
+                or not isinstance(pending[0], Future)
+                or pending[0].done()
+            ):
+                pending_chunks -= isinstance(pending[0], Future)
+                yield from self._results(pending.popleft())
+        if chunk:
+            pending.append(self._submit(chunk))
+        while pending:
+            yield from self._results(pending.popleft())
+
+    def _submit(self, chunk: list[dict]) -> Future:
+        """Отправить пачку строк в пул.
+
+        Args:
+            chunk: Строки БД.
+
+        Returns:
+            Future со списком документов.
+        """
+        return self._executor.submit(
+            transform_chunk,
+            self._index_loader,
+            chunk,
+            self._validate_every,
+            self._serializer_name,
+        )
+
+    def _results(self, item: Any) -> Iterator[Any]:
+        """Развернуть готовую пачку в документы или вернуть отметку.
+
+        Args:
+            item: Future пачки или отметка загрузчика.
+
+        Yields:
+            Serialized или отметка.
+        """
+        if not isinstance(item, Future):
+            yield item
+            return
+        elapsed, documents = item.result()
+        index = self._index_loader.es_index
+        if documents:
+            # В пачке известно только общее время: каждому документу
+            # достается среднее.
+            metrics.TRANSFORM_SECONDS.observe(
+                elapsed / len(documents), count=len(documents), index=index,
+            )
+        metrics.TRANSFORMED_DOCUMENTS.inc(len(documents), index=index)
+        for id, source in documents:
+            yield Serialized(id, source)
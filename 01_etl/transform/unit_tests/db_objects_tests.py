@@ -1,7 +1,7 @@
 from datetime import datetime
 from unittest import TestCase, main
 
-from transform.db_objects import FilmWork
+from transform.db_objects import FilmWork, film_work_document
 
 
 class TestFilmWork(TestCase):
@@ -64,5 +64,49 @@ class TestFilmWork(TestCase):
         self.assertEqual(writer, self.film_work.writers[0])
 
 
+
+class TestFilmWorkDocument(TestCase):
+
+    def setUp(self):
+        self.row = {
+            'id': '3d8d9bf5-0d90-4353-88ba-4ccc5d2c07ff',
+            'title': 'Star Wars: Episode IV - A New Hope',
+            'description': 'The Imperial Forces...',
+            'rating': 8.6,
+            'type': 'movie',
+            'created': '2021-06-16 20:14:09.313086+00',
+            'modified': '2021-06-16 20:14:09.313086+00',
+            'genre': ['Action', 'Sci-Fi'],
+            'genres': [
+                {'id': '3d8d9bf5-0d90-4353-88ba-4ccc5d2c07ff', 'name': 'Action'},
+                {'id': '6c162475-c7ed-4461-9184-001ef3d9f26e', 'name': 'Sci-Fi'},
+            ],
+            'persons': [
+                {'id': '1', 'name': 'Mark Hamill', 'role': 'actor'},
+                {'id': '2', 'name': 'George Lucas', 'role': 'director'},
+                {'id': '2', 'name': 'George Lucas', 'role': 'writer'},
+                {'id': '3', 'name': 'Harrison Ford', 'role': 'actor'},
+            ],
+        }
+
+    def test_same_as_film_work(self):
+        self.assertEqual(
+            FilmWork(**self.row).as_document(),
+            film_work_document(self.row),
+        )
+
+    def test_same_as_film_work_without_persons(self):
+        self.row.update(persons=[], genre=[None], genres=[], rating=None)
+        self.assertEqual(
+            FilmWork(**self.row).as_document(),
+            film_work_document(self.row),
+        )
+
+    def test_unknown_role(self):
+        self.row['persons'].append({'id': '4', 'name': 'X', 'role': 'grip'})
+        with self.assertRaises(KeyError):
+            film_work_document(self.row)
+
+
 if __name__ == '__main__':
     main()
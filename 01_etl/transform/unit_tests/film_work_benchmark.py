@@ -0,0 +1,91 @@
+"""Сравнение скорости сборки документов фильмов.
+
+Запуск: python -m transform.unit_tests.film_work_benchmark
+"""
+
+import random
+import timeit
+import uuid
+
+from transform.db_objects import FilmWork, film_work_document
+
+ROLES = ('actor', 'actor', 'actor', 'writer', 'director')
+
+
+def make_rows(count: int, cast: int, seed: int = 0) -> list[dict]:
+    """Сгенерировать строки фильмов в том виде, в каком их отдает SQL.
+
+    Args:
+        count: Сколько строк сгенерировать.
+        cast: Сколько персон у каждого фильма.
+        seed: Начальное значение генератора случайных чисел.
+
+    Returns:
+        Строки БД с информацией о фильмах.
+    """
+    rnd = random.Random(seed)
+    rows = []
+    for i in range(count):
+        persons = [
+            {
+                'id': str(uuid.UUID(int=rnd.getrandbits(128))),
+                'name': f'Person {rnd.randrange(10000)}',
+                'role': rnd.choice(ROLES),
+            }
+            for _ in range(cast)
+        ]
+        rows.append({
+            'id': str(uuid.UUID(int=rnd.getrandbits(128))),
+            'title': f'Film {i}',
+            'description': 'Description ' * 20,
+            'rating': round(rnd.uniform(1, 10), 1),
+            'type': 'movie',
+            'created': '2021-06-16 20:14:09.313086+00',
+            'modified': '2021-06-16 20:14:09.313086+00',
+            'genre': ['Action', 'Drama'],
+            'genres': [
+                {'id': str(uuid.uuid4()), 'name': 'Action'},
+                {'id': str(uuid.uuid4()), 'name': 'Drama'},
+            ],
+            'persons': persons,
+        })
+    return rows
+
+
+def rows_per_second(transform, rows: list[dict], repeat: int = 5) -> float:
+    """Измерить скорость преобразования строк в документы.
+
+    Args:
+        transform: Функция, которая делает из строки документ.
+        rows: Строки БД с информацией о фильмах.
+        repeat: Сколько раз повторить замер.
+
+    Returns:
+        Число строк в секунду по лучшему из замеров.
+    """
+    timer = timeit.Timer(lambda: [transform(row) for row in rows])
+    return len(rows) / min(timer.repeat(repeat=repeat, number=1))
+
+
+def main() -> None:
+    """Вывести скорость обоих способов на фильмах с разным составом."""
+    transforms = {
+        'FilmWork.as_document': lambda row: FilmWork(**row).as_document(),
+        'film_work_document': film_work_document,
+    }
+    for cast in (5, 50, 500):
+        rows = make_rows(2000, cast)
+        results = {
+            name: rows_per_second(transform, rows)
+            for name, transform in transforms.items()
+        }
+        base = results['FilmWork.as_document']
+        for name, speed in results.items():
+            print(
+                f'cast={cast:<4} {name:<22} {speed:>10.0f} rows/s '
+                f'x{speed / base:.1f}',
+            )
+
+
+if __name__ == '__main__':
+    main()
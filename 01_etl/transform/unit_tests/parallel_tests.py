@@ -0,0 +1,92 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
+from unittest import TestCase, main
+
+from extract.postgres_genre_loader import PostgresGenreLoader
+from extract.postgres_loader import Deleted
+from storage import Checkpoint
+from transform.parallel import Serialized, TransformPool, create_executor
+
+
+def genre_row(i):
+    return {
+        'id': f'00000000-0000-0000-0000-{i:012d}',
+        'name': f'Genre {i}',
+        'description': '',
+        'film_ids': [],
+    }
+
+
+class CountingRows:
+    """Строки, которые считают, сколько из них уже прочитано."""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.read = 0
+
+    def __iter__(self):
+        for row in self.rows:
+            self.read += 1
+            yield row
+
+
+class TestTransformPool(TestCase):
+
+    def setUp(self):
+        self.executor = ThreadPoolExecutor(max_workers=4)
+
+    def tearDown(self):
+        self.executor.shutdown()
+
+    def test_keeps_order_of_rows_and_marks(self):
+        rows = [
+            genre_row(1), genre_row(2), genre_row(3),
+            Checkpoint('key', 1),
+            genre_row(4),
+            Deleted('5'),
+            genre_row(6),
+        ]
+        pool = TransformPool(self.executor, PostgresGenreLoader, chunk_size=2)
+        results = list(pool.transform(rows))
+        expected = [
+            Serialized(genre_row(1)['id'], None),
+            Serialized(genre_row(2)['id'], None),
+            Serialized(genre_row(3)['id'], None),
+            Checkpoint('key', 1),
+            Serialized(genre_row(4)['id'], None),
+            Deleted('5'),
+            Serialized(genre_row(6)['id'], None),
+        ]
+        self.assertEqual(
+            expected,
+            [
+                Serialized(item.id, None) if isinstance(item, Serialized)
+                else item
+                for item in results
+            ],
+        )
+        self.assertEqual('Genre 1', json.loads(results[0].source)['name'])
+
+    def test_bounds_rows_read_ahead(self):
+        rows = CountingRows([genre_row(i) for i in range(100)])
+        pool = TransformPool(
+            self.executor, PostgresGenreLoader, chunk_size=5, max_pending=2,
+        )
+        results = pool.transform(rows)
+        next(results)
+        self.assertLessEqual(rows.read, 5 * 4)
+        self.assertEqual(99, len(list(results)))
+
+
+class TestProcessPool(TestCase):
+
+    def test_transforms_in_processes(self):
+        rows = [genre_row(i) for i in range(10)]
+        with create_executor(2) as executor:
+            pool = TransformPool(executor, PostgresGenreLoader, chunk_size=3)
+            results = list(pool.transform(rows))
+        self.assertEqual([row['id'] for row in rows], [r.id for r in results])
+
+
+if __name__ == '__main__':
+    main()
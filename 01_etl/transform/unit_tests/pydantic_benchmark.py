@@ -0,0 +1,90 @@
+"""Сравнение скорости сборки документов жанров и персон.
+
+Запуск: python -m transform.unit_tests.pydantic_benchmark
+"""
+
+import timeit
+import uuid
+
+from extract.postgres_genre_loader import PostgresGenreLoader
+from extract.postgres_person_loader import PostgresPersonLoader
+
+
+def make_genre_rows(count: int, films: int) -> list[dict]:
+    """Сгенерировать строки жанров в том виде, в каком их отдает SQL.
+
+    Args:
+        count: Сколько строк сгенерировать.
+        films: Сколько фильмов у каждого жанра.
+
+    Returns:
+        Строки БД с информацией о жанрах.
+    """
+    return [
+        {
+            'id': str(uuid.uuid4()),
+            'name': f'Genre {i}',
+            'description': 'Description',
+            'film_ids': [str(uuid.uuid4()) for _ in range(films)],
+        }
+        for i in range(count)
+    ]
+
+
+def make_person_rows(count: int, films: int) -> list[dict]:
+    """Сгенерировать строки персон в том виде, в каком их отдает SQL.
+
+    Args:
+        count: Сколько строк сгенерировать.
+        films: Сколько фильмов у каждой персоны.
+
+    Returns:
+        Строки БД с информацией о персонах.
+    """
+    return [
+        {
+            'id': str(uuid.uuid4()),
+            'full_name': f'Person {i}',
+            'role': ['actor', 'director'],
+            'film_ids': [str(uuid.uuid4()) for _ in range(films)],
+        }
+        for i in range(count)
+    ]
+
+
+def microseconds_per_row(loader, rows: list[dict]) -> float:
+    """Измерить время сборки документа из строки.
+
+    Args:
+        loader: Загрузчик, который собирает документы.
+        rows: Строки БД.
+
+    Returns:
+        Микросекунд на строку по лучшему из замеров.
+    """
+    timer = timeit.Timer(lambda: [loader.to_document(row) for row in rows])
+    return min(timer.repeat(repeat=5, number=1)) / len(rows) * 1e6
+
+
+def main() -> None:
+    """Вывести время на строку для разных режимов проверки."""
+    datasets = {
+        PostgresGenreLoader: make_genre_rows,
+        PostgresPersonLoader: make_person_rows,
+    }
+    for index_loader, make_rows in datasets.items():
+        for films in (10, 1000):
+            rows = make_rows(500, films)
+            for validate_every in (1, 100, 0):
+                loader = index_loader(
+                    None, None, validate_every=validate_every,
+                )
+                cost = microseconds_per_row(loader, rows)
+                print(
+                    f'{index_loader.es_index:<8} films={films:<5} '
+                    f'validate_every={validate_every:<4} {cost:>9.1f} us/row',
+                )
+
+
+if __name__ == '__main__':
+    main()
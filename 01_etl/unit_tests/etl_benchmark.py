@@ -0,0 +1,291 @@
+"""Замер полной и инкрементальной загрузки индексов.
+
+Пересоздает схему content в базе POSTGRES_TEST_* и заполняет ее
+синтетическим каталогом, загружает все индексы целиком, меняет часть
+каталога и загружает изменения.  Документы уходят в поддельный
+bulk-сервер или, с флагом --elastic, в ElasticSearch ELASTIC_TEST_*.
+Остальные настройки ETL берутся из окружения, как в load_data.
+
+Каждая загрузка идет в отдельном процессе, чтобы пик памяти
+относился только к ней.  Для каждой загрузки выводится скорость,
+пик памяти и время этапов.  С --baseline замер сравнивается с
+сохраненным через --output и завершается с кодом 1, если скорость
+упала больше чем на --tolerance.
+
+Запуск: python -m unit_tests.etl_benchmark --films 20000
+"""
+
+import argparse
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+from contextlib import nullcontext
+from dataclasses import asdict
+from typing import Optional
+
+import metrics
+import profiling
+import settings
+from extract.postgres_loader import PostgresLoader, postgres_connection
+from load.elastic_search_saver import elastic_search_connection
+from load_data import INDEX_LOADERS, run_pipeline
+from storage import MemoryStorage, State
+from transform.parallel import create_executor
+from unit_tests import fake_elastic_search
+from unit_tests.synthetic_catalog import Catalog, create_catalog, touch
+
+# Этапы в таблице и метки профиля, время которых в них входит.
+STAGES = {
+    'extract': ('extract.execute_sql',),
+    'transform': (
+        'transform.validate', 'transform.construct', 'transform.as_document',
+    ),
+    'load': ('load.flush',),
+}
+
+
+def run_load(
+        index_loader: type[PostgresLoader], dsl: dict, host: dict,
+        state: dict, directory: str,
+        ) -> dict:
+    """Загрузить индекс и замерить загрузку.
+
+    Выполняется в отдельном процессе.
+
+    Args:
+        index_loader: Класс загрузчика индекса.
+        dsl: Настройки подключения к PostgreSQL.
+        host: Настройки подключения к ElasticSearch.
+        state: Состояние после предыдущей загрузки.
+        directory: Куда писать отчеты профилирования и отпечатки
+            документов этого замера.
+
+    Returns:
+        Результат замера и состояние после загрузки.
+    """
+    # Отпечатки прошлых замеров и регулярной загрузки не должны
+    # пропускать документы этого замера.
+    settings.FINGERPRINTS_FILE = os.path.join(directory, 'fingerprints.db')
+    storage = MemoryStorage(state)
+    state = State(storage)
+    index = index_loader.es_index
+    transform_executor = (
+        create_executor(settings.ETL_TRANSFORM_WORKERS)
+        if settings.ETL_TRANSFORM_WORKERS else nullcontext()
+    )
+    with (
+        postgres_connection(dsl) as pg_conn,
+        elastic_search_connection(host) as es_client,
+        transform_executor as transform_executor,
+        profiling.cycle(frozenset(('spans',)), directory) as profiles,
+    ):
+        started = time.perf_counter()
+        run_pipeline(
+            index_loader, pg_conn, es_client, state, transform_executor,
+        )
+        elapsed = time.perf_counter() - started
+    state.flush()
+    timings = profiles[0].timings()
+    return {
+        'index': index,
+        'documents': int(
+            metrics.BULK_DOCUMENTS.value(index=index)
+            + metrics.SKIPPED_DOCUMENTS.value(index=index),
+        ),
+        'seconds': elapsed,
+        # В Linux ru_maxrss в килобайтах.
+        'peak_rss_mb': resource.getrusage(
+            resource.RUSAGE_SELF,
+        ).ru_maxrss / 1024,
+        'stages': {
+            stage: sum(timings[name][1] for name in names if name in timings)
+            for stage, names in STAGES.items()
+        },
+        'spans': timings,
+        'state': storage.retrieve_state(),
+    }
+
+
+def run_in_child(*args) -> dict:
+    """Выполнить run_load в новом процессе.
+
+    Args:
+        args: Аргументы run_load.
+
+    Returns:
+        Результат run_load.
+    """
+    with create_executor(1) as executor:
+        return executor.submit(run_load, *args).result()
+
+
+def print_results(results: list[dict]) -> None:
+    """Вывести таблицу замеров.
+
+    Args:
+        results: Замеры загрузок.
+    """
+    print(
+        f'{"mode":<12}{"index":<9}{"docs":>9}{"s":>9}{"docs/s":>10}'
+        f'{"rss, MB":>9}'
+        + ''.join(f'{stage + ", s":>13}' for stage in STAGES),
+    )
+    for result in results:
+        print(
+            f'{result["mode"]:<12}{result["index"]:<9}'
+            f'{result["documents"]:>9}{result["seconds"]:>9.2f}'
+            f'{result["docs_per_second"]:>10.0f}'
+            f'{result["peak_rss_mb"]:>9.0f}'
+            + ''.join(
+                f'{result["stages"][stage]:>13.2f}' for stage in STAGES
+            ),
+        )
+
+
+def regressions(
+        results: list[dict], baseline: list[dict], tolerance: float,
+        ) -> list[str]:
+    """Найти загрузки, которые стали медленнее базового замера.
+
+    Args:
+        results: Замеры загрузок.
+        baseline: Замеры, сохраненные раньше через --output.
+        tolerance: Допустимое падение скорости, доля.
+
+    Returns:
+        Описания замедлений.
+    """
+    before = {
+        (result['mode'], result['index']): result for result in baseline
+    }
+    found = []
+    for result in results:
+        old = before.get((result['mode'], result['index']))
+        if old is None:
+            continue
+        speed, old_speed = result['docs_per_second'], old['docs_per_second']
+        if speed < old_speed * (1 - tolerance):
+            found.append(
+                f'{result["mode"]} {result["index"]}: {speed:.0f} docs/s, '
+                f'was {old_speed:.0f} docs/s',
+            )
+    return found
+
+
+def parse_args(argv: Optional[list[str]] = None) -> argparse.Namespace:
+    """Разобрать аргументы командной строки.
+
+    Args:
+        argv: Аргументы, по умолчанию из sys.argv.
+
+    Returns:
+        Аргументы.
+    """
+    defaults = Catalog()
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument(
+        '--films', type=int, default=defaults.films, help='Число фильмов.',
+    )
+    parser.add_argument(
+        '--genres', type=int, default=defaults.genres, help='Число жанров.',
+    )
+    parser.add_argument(
+        '--persons', type=int, default=defaults.persons,
+        help='Число персон.',
+    )
+    parser.add_argument(
+        '--cast', type=int, default=defaults.cast_per_film,
+        help='Среднее число персон у фильма.',
+    )
+    parser.add_argument(
+        '--skew', type=float, default=defaults.skew,
+        help='Показатель Ципфа для популярности жанров и персон.',
+    )
+    parser.add_argument(
+        '--seed', type=int, default=defaults.seed,
+        help='Начальное значение генератора каталога.',
+    )
+    parser.add_argument(
+        '--touch', type=float, default=0.05,
+        help='Доля фильмов, измененных перед инкрементальной загрузкой.',
+    )
+    parser.add_argument(
+        '--elastic', action='store_true',
+        help='Загружать в ELASTIC_TEST_*, а не в поддельный сервер.',
+    )
+    parser.add_argument('--output', help='Сохранить замеры в JSON-файл.')
+    parser.add_argument(
+        '--baseline', help='Сравнить с замерами из JSON-файла.',
+    )
+    parser.add_argument(
+        '--tolerance', type=float, default=0.2,
+        help='Допустимое падение скорости относительно --baseline, доля.',
+    )
+    return parser.parse_args(argv)
+
+
+def main() -> None:
+    """Сгенерировать каталог, загрузить индексы и вывести замеры."""
+    args = parse_args()
+    catalog = Catalog(
+        films=args.films, genres=args.genres, persons=args.persons,
+        cast_per_film=args.cast, skew=args.skew, seed=args.seed,
+    )
+    # Загрузчики обращаются к таблицам без схемы.
+    dsl = {**settings.POSTGRES_TEST_DB, 'options': '-c search_path=content'}
+    with postgres_connection(dsl) as pg_conn:
+        started = time.perf_counter()
+        counts = create_catalog(pg_conn, catalog)
+    print(
+        f'Generated {counts} in {time.perf_counter() - started:.1f} s.',
+    )
+    server = None
+    if args.elastic:
+        host = settings.ELASTIC_TEST_HOST
+    else:
+        server = fake_elastic_search.serve()
+        host = {'host': '127.0.0.1', 'port': server.server_port}
+    results, states = [], {}
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            for index_loader in INDEX_LOADERS:
+                result = run_in_child(index_loader, dsl, host, {}, directory)
+                states[index_loader] = result['state']
+                results.append({**result, 'mode': 'full'})
+            with postgres_connection(dsl) as pg_conn:
+                print(f'Touched {touch(pg_conn, args.touch, args.seed)}.')
+            for index_loader in INDEX_LOADERS:
+                result = run_in_child(
+                    index_loader, dsl, host, states[index_loader], directory,
+                )
+                results.append({**result, 'mode': 'incremental'})
+    finally:
+        if server:
+            server.shutdown()
+            server.server_close()
+    for result in results:
+        del result['state']
+        result['docs_per_second'] = (
+            result['documents'] / result['seconds'] if result['seconds'] else 0
+        )
+    print_results(results)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(
+                {'catalog': asdict(catalog), 'results': results}, f, indent=2,
+            )
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        found = regressions(results, baseline, args.tolerance)
+        for line in found:
+            print(f'REGRESSION {line}')
+        if found:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
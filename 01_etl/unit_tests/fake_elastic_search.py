@@ -0,0 +1,142 @@
+"""HTTP-сервер, который принимает bulk-запросы вместо ElasticSearch.
+
+Нужен для замеров ETL без кластера: сервер разбирает тело
+bulk-запроса и подтверждает каждое действие, ничего не сохраняя.
+Время ответа - только разбор NDJSON, поэтому замер показывает
+скорость самого ETL.
+"""
+
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any
+
+# Ответ на GET /, по которому клиент проверяет, что это ElasticSearch.
+INFO = {
+    'name': 'fake',
+    'cluster_name': 'fake',
+    'version': {'number': '7.17.4', 'build_flavor': 'default'},
+    'tagline': 'You Know, for Search',
+}
+# uuid любого индекса, который клиент запрашивает перед загрузкой
+# с отпечатками.
+INDEX_UUID = 'fake-index-uuid'
+# Действия bulk-запроса, за которыми идет строка документа.
+WITH_SOURCE = frozenset(('index', 'create', 'update'))
+
+
+def bulk_items(body: bytes) -> list[dict]:
+    """Подтвердить действия из тела bulk-запроса.
+
+    Args:
+        body: Тело запроса в формате NDJSON.
+
+    Returns:
+        Результаты действий в том виде, в каком их отдает ElasticSearch.
+    """
+    items = []
+    lines = iter(body.splitlines())
+    for line in lines:
+        if not line.strip():
+            continue
+        (op_type, meta), = json.loads(line).items()
+        if op_type in WITH_SOURCE:
+            next(lines, None)
+        items.append({op_type: {
+            '_index': meta.get('_index'),
+            '_id': meta.get('_id'),
+            'status': 200,
+            'result': 'deleted' if op_type == 'delete' else 'updated',
+        }})
+    return items
+
+
+class _BulkHandler(BaseHTTPRequestHandler):
+    """Ответы на запросы клиента ElasticSearch."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self) -> None:
+        """Ответить на проверку кластера или запрос настроек индекса."""
+        path = self.path.split('?')[0].strip('/').split('/')
+        if len(path) > 1 and path[1] == '_settings':
+            self._reply({
+                path[0]: {'settings': {'index': {'uuid': INDEX_UUID}}},
+            })
+            return
+        self._reply(INFO)
+
+    def do_HEAD(self) -> None:
+        """Ответить на ping."""
+        self._reply({})
+
+    def do_POST(self) -> None:
+        """Подтвердить bulk-запрос."""
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.path.split('?')[0].endswith('/_bulk'):
+            self.server.stats.add(len(body))
+            self._reply({
+                'took': 0, 'errors': False, 'items': bulk_items(body),
+            })
+            return
+        self._reply({'acknowledged': True})
+
+    do_PUT = do_POST
+
+    def _reply(self, data: Any) -> None:
+        """Отправить ответ в JSON.
+
+        Args:
+            data: Тело ответа.
+        """
+        body = json.dumps(data).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('X-Elastic-Product', 'Elasticsearch')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        """Не писать каждый запрос в stderr."""
+
+
+class BulkStats:
+    """Число принятых bulk-запросов и их байтов."""
+
+    def __init__(self):
+        """Проинициализировать счетчики."""
+        self.requests = 0
+        self.bytes = 0
+        self._lock = threading.Lock()
+
+    def add(self, size: int) -> None:
+        """Учесть bulk-запрос.
+
+        Args:
+            size: Размер тела запроса в байтах.
+        """
+        with self._lock:
+            self.requests += 1
+            self.bytes += size
+
+
+def serve(host: str = '127.0.0.1', port: int = 0) -> ThreadingHTTPServer:
+    """Запустить сервер в фоновом потоке.
+
+    Args:
+        host: Адрес, на котором слушать.
+        port: Порт, 0 - любой свободный.
+
+    Returns:
+        Сервер, у которого stats - счетчики bulk-запросов.
+        Остановить его можно через shutdown().
+    """
+    server = ThreadingHTTPServer((host, port), _BulkHandler)
+    server.daemon_threads = True
+    server.stats = BulkStats()
+    threading.Thread(
+        target=server.serve_forever, name='fake-elastic', daemon=True,
+    ).start()
+    return server
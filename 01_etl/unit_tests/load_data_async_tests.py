@@ -0,0 +1,68 @@
+import threading
+from unittest import IsolatedAsyncioTestCase, main
+
+from elasticsearch.helpers import BulkIndexError
+
+from extract.postgres_loader import Deleted
+from load.async_elastic_search_saver import AsyncElasticSearchSaver
+from load.unit_tests.async_elastic_search_saver_tests import FakeAsyncClient
+from load_data_async import load_async
+from storage import Checkpoint, CheckpointLedger, MemoryStorage, State
+
+
+class FakeLoader:
+    pass_through = False
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.closed = threading.Event()
+        self.threads = set()
+
+    def load_all(self):
+        try:
+            yield from self.rows
+        finally:
+            self.closed.set()
+
+    def build_document(self, row):
+        self.threads.add(threading.current_thread())
+        return {'id': row['id'], 'title': row['title'].upper()}
+
+
+class TestLoadAsync(IsolatedAsyncioTestCase):
+
+    async def test_loads_documents_and_markers_in_order(self):
+        state = State(MemoryStorage())
+        client = FakeAsyncClient()
+        saver = AsyncElasticSearchSaver(
+            client, 'movies', batch_size=2, ledger=CheckpointLedger(state),
+        )
+        loader = FakeLoader([
+            {'id': '1', 'title': 'a'},
+            {'id': '2', 'title': 'b'},
+            Checkpoint('movies', 2),
+            Deleted('3'),
+            {'id': '4', 'title': 'c'},
+            Checkpoint('movies', 4),
+        ])
+        await load_async(loader, saver, queue_size=1)
+        body = b''.join(client.bodies)
+        self.assertIn(b'"A"', body)
+        self.assertIn(b'"delete"', body)
+        self.assertLess(body.index(b'"A"'), body.index(b'"C"'))
+        self.assertEqual(4, state.get_state('movies'))
+        self.assertNotIn(threading.current_thread(), loader.threads)
+
+    async def test_stops_extraction_after_failed_bulk(self):
+        rows = ({'id': str(id), 'title': 'a'} for id in range(10000))
+        loader = FakeLoader(rows)
+        saver = AsyncElasticSearchSaver(
+            FakeAsyncClient(errors=True), 'movies', batch_size=10,
+        )
+        with self.assertRaises(BulkIndexError):
+            await load_async(loader, saver, queue_size=5)
+        self.assertTrue(loader.closed.is_set())
+
+
+if __name__ == '__main__':
+    main()
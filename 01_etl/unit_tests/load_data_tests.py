@@ -0,0 +1,62 @@
+import os
+import tempfile
+from unittest import TestCase, main
+from unittest.mock import patch
+
+import settings
+from extract.postgres_genre_loader import PostgresGenreLoader
+from load.elastic_search_saver import elastic_search_connection
+from load_data import run_pipeline
+from storage import Checkpoint, MemoryStorage, State
+from unit_tests import fake_elastic_search
+
+
+class FakeGenreLoader(PostgresGenreLoader):
+    """Загрузчик жанров без PostgreSQL."""
+
+    def load_all(self):
+        yield {'id': '3d8d9bf5-0d90-4353-88ba-4ccc5d2c07ff', 'name': 'Drama'}
+        yield {'id': '120a21cf-9097-479e-904a-13dd7198c1dd', 'name': 'Comedy'}
+        yield Checkpoint('genres', 2)
+
+
+class TestRunPipeline(TestCase):
+
+    def setUp(self):
+        self.server = fake_elastic_search.serve()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        patcher = patch.multiple(
+            settings,
+            ETL_SKIP_UNCHANGED=True,
+            ETL_PASS_THROUGH=False,
+            FINGERPRINTS_FILE=os.path.join(directory.name, 'fingerprints.db'),
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def run_pipeline(self):
+        state = State(MemoryStorage())
+        host = {'host': '127.0.0.1', 'port': self.server.server_port}
+        with (
+            self.assertLogs(level='INFO'),
+            elastic_search_connection(host) as es_client,
+        ):
+            run_pipeline(FakeGenreLoader, None, es_client, state)
+        return state
+
+    def test_loads_into_fake_server(self):
+        state = self.run_pipeline()
+        self.assertEqual(2, state.get_state('genres'))
+        self.assertEqual(1, self.server.stats.requests)
+
+    def test_skips_unchanged_documents(self):
+        self.run_pipeline()
+        self.run_pipeline()
+        self.assertEqual(1, self.server.stats.requests)
+
+
+if __name__ == '__main__':
+    main()
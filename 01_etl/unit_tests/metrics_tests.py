@@ -0,0 +1,108 @@
+import time
+import urllib.error
+import urllib.request
+from datetime import datetime, timedelta, timezone
+from unittest import TestCase, main
+
+from metrics import (WATERMARK_AGE, Counter, Histogram, Registry, serve, timed,
+                     watch_watermarks)
+from storage import MemoryStorage, State
+
+
+class TestCounter(TestCase):
+
+    def test_renders_series_by_labels(self):
+        counter = Counter('rows_total', 'Rows.', ('index',))
+        counter.inc(index='movies')
+        counter.inc(2, index='movies')
+        counter.inc(index='genres')
+        self.assertEqual(
+            '# HELP rows_total Rows.\n'
+            '# TYPE rows_total counter\n'
+            'rows_total{index="genres"} 1\n'
+            'rows_total{index="movies"} 3\n',
+            counter.render(),
+        )
+
+    def test_escapes_label_values(self):
+        counter = Counter('rows_total', 'Rows.', ('index',))
+        counter.inc(index='a"b')
+        self.assertIn('rows_total{index="a\\"b"} 1', counter.render())
+
+
+class TestHistogram(TestCase):
+
+    def test_counts_values_cumulatively(self):
+        histogram = Histogram('bulk_seconds', 'Bulk.', buckets=(0.1, 1))
+        for value in (0.05, 0.1, 0.5, 3):
+            histogram.observe(value)
+        self.assertEqual(
+            '# HELP bulk_seconds Bulk.\n'
+            '# TYPE bulk_seconds histogram\n'
+            'bulk_seconds_bucket{le="0.1"} 2\n'
+            'bulk_seconds_bucket{le="1"} 3\n'
+            'bulk_seconds_bucket{le="+Inf"} 4\n'
+            'bulk_seconds_sum 3.65\n'
+            'bulk_seconds_count 4\n',
+            histogram.render(),
+        )
+
+    def test_observes_value_several_times(self):
+        histogram = Histogram('transform_seconds', 'Build.', buckets=(0.1,))
+        histogram.observe(0.05, count=3)
+        rendered = histogram.render()
+        self.assertIn('transform_seconds_bucket{le="0.1"} 3', rendered)
+        self.assertIn('transform_seconds_sum 0.15', rendered)
+
+    def test_timed_skips_time_of_consumer(self):
+        histogram = Histogram('query_seconds', 'Query.', buckets=(0.05,))
+        for _ in timed(range(3), histogram):
+            time.sleep(0.03)
+        self.assertIn('query_seconds_bucket{le="0.05"} 1', histogram.render())
+
+
+class TestWatermarks(TestCase):
+
+    def test_reports_age_of_keysets(self):
+        state = State(MemoryStorage())
+        modified = datetime.now(timezone.utc) - timedelta(minutes=5)
+        state.set_state('movie_genre_since', (modified, 'id'))
+        state.set_state('movie_person_work_since', '2021-06-16 20:14:09+00')
+        state.set_state('movie_change_log_since', [10, 1])
+        watch_watermarks(state, [
+            'movie_genre_since', 'movie_person_work_since',
+            'movie_change_log_since', 'movie_film_work_since',
+        ])
+        self.addCleanup(WATERMARK_AGE.set_function, None)
+        ages = {
+            labels['key']: value
+            for _, labels, value in WATERMARK_AGE.samples()
+        }
+        self.assertEqual(
+            {'movie_genre_since', 'movie_person_work_since'}, set(ages),
+        )
+        self.assertAlmostEqual(300, ages['movie_genre_since'], delta=5)
+
+
+class TestServe(TestCase):
+
+    def setUp(self):
+        self.registry = Registry()
+        self.registry.register(Counter('rows_total', 'Rows.')).inc()
+        self.server = serve('127.0.0.1', 0, self.registry)
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.url = f'http://127.0.0.1:{self.server.server_port}'
+
+    def test_serves_metrics(self):
+        with urllib.request.urlopen(f'{self.url}/metrics') as response:
+            body = response.read().decode()
+        self.assertIn('rows_total 1\n', body)
+
+    def test_other_paths_are_not_found(self):
+        with self.assertRaises(urllib.error.HTTPError):
+            urllib.request.urlopen(f'{self.url}/')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+import os
+import signal
+import tempfile
+from unittest import TestCase, main
+
+import profiling
+
+
+def reports(directory):
+    found = {}
+    for name in os.listdir(directory):
+        with open(os.path.join(directory, name)) as f:
+            found[name.split('-')[0]] = f.read()
+    return found
+
+
+class TestProfiling(TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def test_does_nothing_outside_of_cycle(self):
+        rows = iter([1, 2])
+        with profiling.profile('movies'):
+            self.assertIs(rows, profiling.traced(rows, 'extract.execute_sql'))
+            self.assertIs(profiling.span('load.flush'), profiling._NOOP)
+        self.assertEqual([], os.listdir(self.directory))
+
+    def test_writes_report_per_index(self):
+        modes = frozenset(('spans', 'cprofile'))
+        with profiling.cycle(modes, self.directory) as profiles:
+            for index in ('movies', 'genres'):
+                with profiling.profile(index):
+                    list(profiling.traced(range(3), 'extract.execute_sql'))
+                    with profiling.span('load.flush'):
+                        pass
+        found = reports(self.directory)
+        self.assertEqual({'movies', 'genres'}, set(found))
+        self.assertEqual(['movies', 'genres'], [p.index for p in profiles])
+        self.assertEqual(4, profiles[0].timings()['extract.execute_sql'][0])
+        report = found['movies']
+        self.assertIn('index: movies', report)
+        self.assertRegex(report, r'extract\.execute_sql\s+4\s')
+        self.assertRegex(report, r'load\.flush\s+1\s')
+        self.assertIn('== cprofile', report)
+
+    def test_reports_memory_growth(self):
+        with profiling.cycle(frozenset(('tracemalloc',)), self.directory):
+            with profiling.profile('movies'):
+                data = [str(n) * 10 for n in range(1000)]
+        self.assertTrue(data)
+        self.assertIn('== tracemalloc', reports(self.directory)['movies'])
+
+    def test_signal_profiles_next_cycle(self):
+        previous = signal.getsignal(signal.SIGUSR1)
+        self.addCleanup(signal.signal, signal.SIGUSR1, previous)
+        profiling.install_signal_handler(
+            signal.SIGUSR1, frozenset(('spans',)),
+        )
+        os.kill(os.getpid(), signal.SIGUSR1)
+        for _ in range(2):
+            with profiling.cycle(frozenset(), self.directory):
+                with profiling.profile('movies'):
+                    pass
+        self.assertEqual(1, len(os.listdir(self.directory)))
+
+    def test_rejects_unknown_modes(self):
+        self.assertEqual(
+            frozenset(('spans', 'cprofile')),
+            profiling.parse_modes(' spans, cprofile'),
+        )
+        with self.assertRaises(ValueError):
+            profiling.parse_modes('spans,perf')
+
+
+if __name__ == '__main__':
+    main()
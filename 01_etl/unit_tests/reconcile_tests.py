@@ -0,0 +1,116 @@
+import random
+import uuid
+from unittest import TestCase, main
+
+from reconcile import find_drift, id_range
+
+
+def checksum(ids):
+    return len(ids), sum(int(id[-6:], 16) for id in ids)
+
+
+def in_range(ids, low, high):
+    return [id for id in ids if id >= low and (high is None or id < high)]
+
+
+class FakeLoader:
+
+    def __init__(self, ids):
+        self.ids = sorted(ids)
+        self.queries = 0
+
+    def range_checksums(self, low, high, length):
+        self.queries += 1
+        groups = {}
+        for id in in_range(self.ids, low, high):
+            groups.setdefault(id.replace('-', '')[:length], []).append(id)
+        return {prefix: checksum(ids) for prefix, ids in groups.items()}
+
+    def range_ids(self, low, high):
+        self.queries += 1
+        return in_range(self.ids, low, high)
+
+
+class FakeElasticSearch:
+
+    def __init__(self, ids):
+        self.ids = sorted(ids)
+        self.queries = 0
+
+    def _match(self, query):
+        bounds = query['range']['id']
+        return in_range(self.ids, bounds['gte'], bounds.get('lt'))
+
+    def search(self, index, body):
+        self.queries += 1
+        if 'aggs' not in body:
+            hits = self._match(body['query'])[:body['size']]
+            return {'hits': {'hits': [{'_id': id} for id in hits]}}
+        filters = body['aggs']['ranges']['filters']['filters']
+        buckets = {}
+        for name, query in filters.items():
+            count, total = checksum(self._match(query))
+            buckets[name] = {'doc_count': count, 'checksum': {'value': total}}
+        return {'aggregations': {'ranges': {'buckets': buckets}}}
+
+
+def make_ids(count, seed=0):
+    rnd = random.Random(seed)
+    return [
+        str(uuid.UUID(int=rnd.getrandbits(128), version=4))
+        for _ in range(count)
+    ]
+
+
+class TestIdRange(TestCase):
+
+    def test_bounds_prefix(self):
+        self.assertEqual(
+            ('a3000000-0000-0000-0000-000000000000',
+             'a4000000-0000-0000-0000-000000000000'),
+            id_range('a3'),
+        )
+
+    def test_last_range_is_open(self):
+        self.assertEqual(
+            ('ff000000-0000-0000-0000-000000000000', None), id_range('ff'),
+        )
+        self.assertEqual(
+            ('00000000-0000-0000-0000-000000000000', None), id_range(''),
+        )
+
+
+class TestFindDrift(TestCase):
+
+    def test_finds_missing_and_orphaned_ids(self):
+        ids = make_ids(5000)
+        postgres = ids[:-1]
+        elastic = ids[1:-1] + make_ids(1, seed=1)
+        loader = FakeLoader(postgres)
+        client = FakeElasticSearch(elastic)
+        missing, orphaned = find_drift(loader, client, 'movies', 50)
+        self.assertEqual([ids[0]], missing)
+        self.assertEqual(make_ids(1, seed=1), orphaned)
+        self.assertLess(loader.queries + client.queries, 20)
+
+    def test_detects_swapped_ids_with_equal_counts(self):
+        ids = make_ids(2000)
+        extra = make_ids(1, seed=2)[0]
+        same_range = [id for id in ids if id[0] == extra[0]]
+        postgres = [id for id in ids if id != same_range[0]] + [extra]
+        missing, orphaned = find_drift(
+            FakeLoader(postgres), FakeElasticSearch(ids), 'movies', 10,
+        )
+        self.assertEqual([extra], missing)
+        self.assertEqual([same_range[0]], orphaned)
+
+    def test_skips_matching_index(self):
+        ids = make_ids(3000)
+        loader = FakeLoader(ids)
+        client = FakeElasticSearch(ids)
+        self.assertEqual(([], []), find_drift(loader, client, 'genres', 10))
+        self.assertEqual((1, 1), (loader.queries, client.queries))
+
+
+if __name__ == '__main__':
+    main()
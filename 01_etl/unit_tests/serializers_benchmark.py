@@ -0,0 +1,77 @@
+"""Сравнение скорости сериализаторов JSON.
+
+Запуск: python -m unit_tests.serializers_benchmark
+"""
+
+import timeit
+import uuid
+from datetime import datetime, timezone
+
+from elasticsearch.serializer import JSONSerializer
+
+from serializers import SERIALIZERS, get_serializer, orjson
+from transform.db_objects import film_work_document
+from transform.unit_tests.film_work_benchmark import make_rows
+
+
+def make_genres(count: int) -> list[dict]:
+    """Сгенерировать документы жанров с UUID и датами.
+
+    Args:
+        count: Сколько документов сгенерировать.
+
+    Returns:
+        Документы жанров.
+    """
+    now = datetime.now(timezone.utc)
+    return [
+        {
+            'id': uuid.uuid4(),
+            'name': f'Genre {i}',
+            'modified': now,
+            'film_ids': [uuid.uuid4() for _ in range(50)],
+        }
+        for i in range(count)
+    ]
+
+
+def documents_per_second(dumps, documents: list[dict]) -> float:
+    """Измерить скорость сериализации документов.
+
+    Args:
+        dumps: Функция сериализации в байты.
+        documents: Документы.
+
+    Returns:
+        Число документов в секунду по лучшему из замеров.
+    """
+    timer = timeit.Timer(lambda: [dumps(document) for document in documents])
+    return len(documents) / min(timer.repeat(repeat=5, number=1))
+
+
+def main() -> None:
+    """Вывести скорость сериализаторов на документах фильмов и жанров."""
+    backends = {'elasticsearch-py': JSONSerializer()}
+    for name in SERIALIZERS:
+        if name != 'orjson' or orjson:
+            backends[name] = get_serializer(name)
+    datasets = {
+        'movies': [film_work_document(row) for row in make_rows(2000, 50)],
+        'genres': make_genres(2000),
+    }
+    for dataset, documents in datasets.items():
+        base = None
+        for name, serializer in backends.items():
+            dumpb = getattr(serializer, 'dumpb', None) or (
+                lambda data: serializer.dumps(data).encode()
+            )
+            speed = documents_per_second(dumpb, documents)
+            base = base or speed
+            print(
+                f'{dataset:<7} {name:<17} {speed:>10.0f} docs/s '
+                f'x{speed / base:.1f}',
+            )
+
+
+if __name__ == '__main__':
+    main()
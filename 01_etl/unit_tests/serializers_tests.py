@@ -0,0 +1,101 @@
+import json
+import uuid
+from datetime import datetime, timezone
+from decimal import Decimal
+from unittest import TestCase, main, skipUnless
+
+from elasticsearch import Elasticsearch
+from elasticsearch.connection import Connection
+
+from serializers import (OrjsonSerializer, StdlibSerializer, get_serializer,
+                         orjson)
+
+
+class RecordingConnection(Connection):
+    """Подключение, которое запоминает тела запросов вместо отправки."""
+
+    headers = {'x-elastic-product': 'Elasticsearch'}
+    info = {'version': {'number': '7.17.4', 'build_flavor': 'default'}}
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.bodies = []
+
+    def perform_request(self, method, url, params=None, body=None,
+                        timeout=None, ignore=(), headers=None):
+        if url == '/':
+            return 200, self.headers, json.dumps(self.info)
+        self.bodies.append(body)
+        return 200, self.headers, '{"errors": false, "items": []}'
+
+
+class SerializerTestMixin:
+    serializer_class = None
+
+    def setUp(self):
+        self.serializer = self.serializer_class()
+
+    def test_native_types(self):
+        id = uuid.UUID('3d8d9bf5-0d90-4353-88ba-4ccc5d2c07ff')
+        created = datetime(2021, 6, 16, 20, 14, 9, 313086, timezone.utc)
+        data = {'id': id, 'created': created, 'rating': Decimal('8.5')}
+        self.assertEqual(
+            {
+                'id': '3d8d9bf5-0d90-4353-88ba-4ccc5d2c07ff',
+                'created': '2021-06-16T20:14:09.313086+00:00',
+                'rating': 8.5,
+            },
+            json.loads(self.serializer.dumpb(data)),
+        )
+
+    def test_same_as_stdlib(self):
+        data = {'title': 'Амели', 'ids': [1, 2.5, None, True]}
+        self.assertEqual(
+            StdlibSerializer().dumps(data), self.serializer.dumps(data),
+        )
+
+    def test_keeps_strings(self):
+        self.assertEqual('{"a":1}', self.serializer.dumps('{"a":1}'))
+
+    def test_keeps_bulk_body_bytes(self):
+        body = b'{"index":{"_id":"1"}}\n{"a":1}\n'
+        self.assertIs(body, self.serializer.dumps(body))
+
+    def test_sends_bulk_through_transport(self):
+        client = Elasticsearch(
+            connection_class=RecordingConnection, serializer=self.serializer,
+        )
+        body = self.serializer.dumpb({'index': {'_id': '1'}}) + b'\n'
+        client.bulk(body=body)
+        connection = client.transport.get_connection()
+        self.assertEqual([body], connection.bodies)
+
+    def test_loads(self):
+        self.assertEqual({'a': [1]}, self.serializer.loads(b'{"a": [1]}'))
+
+    def test_loads_raises_value_error(self):
+        with self.assertRaises(ValueError):
+            self.serializer.loads(b'{"a"')
+
+
+class TestStdlibSerializer(SerializerTestMixin, TestCase):
+    serializer_class = StdlibSerializer
+
+
+@skipUnless(orjson, 'orjson is not installed')
+class TestOrjsonSerializer(SerializerTestMixin, TestCase):
+    serializer_class = OrjsonSerializer
+
+
+class TestGetSerializer(TestCase):
+
+    def test_json(self):
+        self.assertIsInstance(get_serializer('json'), StdlibSerializer)
+
+    def test_unknown(self):
+        with self.assertRaises(ValueError):
+            get_serializer('yaml')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,10 @@
+import os
 from unittest import TestCase, main
 
-from storage import JsonFileStorage, State
+from elasticsearch.serializer import JSONSerializer
+
+from serializers import StdlibSerializer
+from storage import Checkpoint, CheckpointLedger, JsonFileStorage, State
 
 
 class FileStorageTestCase(TestCase):
@@ -17,6 +21,28 @@ class TestJsonFileStorage(FileStorageTestCase):
         self.storage.save_state(state)
         self.assertEqual(state, self.storage.retrieve_state())
 
+    def test_keeps_state_with_stdlib_serializer(self):
+        storage = JsonFileStorage(self.TEST_STORAGE_FILE, StdlibSerializer())
+        state = {'key': ['2021-06-16 20:14:09+00', 'id']}
+        storage.save_state(state)
+        self.assertEqual(state, storage.retrieve_state())
+
+    def test_keeps_state_with_elasticsearch_serializer(self):
+        storage = JsonFileStorage(self.TEST_STORAGE_FILE, JSONSerializer())
+        state = {'key': 'value'}
+        storage.save_state(state)
+        self.assertEqual(state, storage.retrieve_state())
+
+    def test_corrupted_file(self):
+        with open(self.TEST_STORAGE_FILE, 'wb') as f:
+            f.write(b'{"key": ')
+        self.assertEqual({}, self.storage.retrieve_state())
+
+    def test_leaves_no_temporary_files(self):
+        self.storage.save_state({'key': 'value'})
+        leftovers = [f for f in os.listdir('.') if f.endswith('.tmp')]
+        self.assertEqual([], leftovers)
+
 
 class Test(FileStorageTestCase):
 
@@ -43,5 +69,62 @@ class Test(FileStorageTestCase):
         self.assertIsNone(self.state.get_state('no_such_key'))
 
 
+class TestBatchedState(FileStorageTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.storage.save_state({})
+        self.state = State(self.storage, flush_every=3, flush_interval=60)
+
+    def test_keeps_changes_in_memory(self):
+        self.state.set_state('key', 'value')
+        self.assertEqual('value', self.state.get_state('key'))
+        self.assertEqual({}, self.storage.retrieve_state())
+
+    def test_flushes_every_n_changes(self):
+        for value in range(3):
+            self.state.set_state('key', value)
+        self.assertEqual({'key': 2}, self.storage.retrieve_state())
+
+    def test_flushes_explicitly(self):
+        self.state.set_state('key', 'value')
+        self.state.flush()
+        self.assertEqual({'key': 'value'}, self.storage.retrieve_state())
+
+    def test_reads_storage_once(self):
+        self.storage.save_state({'key': 'stored'})
+        self.assertIsNone(self.state.get_state('key'))
+
+
+class TestCheckpointLedger(FileStorageTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.storage.save_state({})
+        self.state = State(self.storage)
+        self.ledger = CheckpointLedger(self.state)
+
+    def test_commits_without_pending_batches(self):
+        self.ledger.add(Checkpoint('key', 1))
+        self.assertEqual(1, self.state.get_state('key'))
+
+    def test_waits_for_batch_ack(self):
+        ticket = self.ledger.open_batch()
+        self.ledger.add(Checkpoint('key', 1))
+        self.assertIsNone(self.state.get_state('key'))
+        self.ledger.ack(ticket)
+        self.assertEqual(1, self.state.get_state('key'))
+
+    def test_waits_for_earlier_batches(self):
+        first = self.ledger.open_batch()
+        self.ledger.add(Checkpoint('key', 1))
+        second = self.ledger.open_batch()
+        self.ledger.add(Checkpoint('key', 2))
+        self.ledger.ack(second)
+        self.assertIsNone(self.state.get_state('key'))
+        self.ledger.ack(first)
+        self.assertEqual(2, self.state.get_state('key'))
+
+
 if __name__ == '__main__':
     main()
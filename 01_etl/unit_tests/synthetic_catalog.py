@@ -0,0 +1,312 @@
+"""Синтетический каталог кино в схеме content для замеров ETL.
+
+Каталог повторяет перекосы настоящих данных: популярность жанров и
+персон распределена по закону Ципфа, поэтому несколько жанров
+связаны с большей частью фильмов, а самые занятые актеры снимаются
+в тысячах фильмов.  Именно такие объекты дают самые большие
+документы и самые дорогие проходы по изменениям.
+
+При одинаковых параметрах каталог получается одним и тем же.
+"""
+
+import io
+import itertools
+import random
+import uuid
+from collections.abc import Iterable, Iterator
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+
+from psycopg2.extensions import connection as pg_connection
+
+SCHEMA_SQL = """
+    DROP SCHEMA IF EXISTS content CASCADE;
+    CREATE SCHEMA content;
+    CREATE TABLE content.film_work (
+        id uuid PRIMARY KEY,
+        title text NOT NULL,
+        description text,
+        creation_date date,
+        rating float,
+        type text NOT NULL,
+        created timestamp with time zone,
+        modified timestamp with time zone
+    );
+    CREATE TABLE content.genre (
+        id uuid PRIMARY KEY,
+        name text NOT NULL,
+        description text,
+        created timestamp with time zone,
+        modified timestamp with time zone
+    );
+    CREATE TABLE content.person (
+        id uuid PRIMARY KEY,
+        full_name text NOT NULL,
+        created timestamp with time zone,
+        modified timestamp with time zone
+    );
+    CREATE TABLE content.genre_film_work (
+        id uuid PRIMARY KEY,
+        film_work_id uuid NOT NULL,
+        genre_id uuid NOT NULL,
+        created timestamp with time zone
+    );
+    CREATE TABLE content.person_film_work (
+        id uuid PRIMARY KEY,
+        film_work_id uuid NOT NULL,
+        person_id uuid NOT NULL,
+        role text NOT NULL,
+        created timestamp with time zone
+    );
+"""
+INDEXES_SQL = """
+    CREATE INDEX ON content.film_work (modified, id);
+    CREATE INDEX ON content.genre (modified, id);
+    CREATE INDEX ON content.person (modified, id);
+    CREATE UNIQUE INDEX ON content.genre_film_work (film_work_id, genre_id);
+    CREATE INDEX ON content.genre_film_work (genre_id);
+    CREATE UNIQUE INDEX ON content.person_film_work
+        (film_work_id, person_id, role);
+    CREATE INDEX ON content.person_film_work (person_id);
+    ANALYZE;
+"""
+ROLES = ('actor', 'actor', 'actor', 'actor', 'writer', 'director')
+# Сколько строк отправлять в COPY за раз.
+COPY_CHUNK = 50000
+
+
+@dataclass(frozen=True)
+class Catalog:
+    """Параметры синтетического каталога."""
+
+    films: int = 10000
+    genres: int = 40
+    persons: int = 5000
+    # Среднее число жанров и персон у фильма.
+    genres_per_film: int = 2
+    cast_per_film: int = 10
+    # Показатель распределения Ципфа: чем больше, тем сильнее перекос.
+    skew: float = 1.1
+    seed: int = 0
+
+
+def zipf_weights(count: int, skew: float) -> list[float]:
+    """Посчитать накопленные веса рангов по закону Ципфа.
+
+    Args:
+        count: Число рангов.
+        skew: Показатель распределения.
+
+    Returns:
+        Накопленные веса для random.choices.
+    """
+    return list(itertools.accumulate(
+        1 / (rank ** skew) for rank in range(1, count + 1)
+    ))
+
+
+def _uuid(rnd: random.Random) -> str:
+    """Сгенерировать воспроизводимый UUID.
+
+    Args:
+        rnd: Генератор случайных чисел.
+
+    Returns:
+        UUID в виде строки.
+    """
+    return str(uuid.UUID(int=rnd.getrandbits(128), version=4))
+
+
+def _sample(
+        rnd: random.Random, ids: list[str], weights: list[float], count: int,
+        ) -> list[str]:
+    """Выбрать count разных ID с учетом весов.
+
+    Args:
+        rnd: Генератор случайных чисел.
+        ids: ID по убыванию популярности.
+        weights: Накопленные веса.
+        count: Сколько ID выбрать.
+
+    Returns:
+        Разные ID, популярные чаще.
+    """
+    count = min(count, len(ids))
+    chosen = dict.fromkeys(rnd.choices(ids, cum_weights=weights, k=count))
+    while len(chosen) < count:
+        chosen.setdefault(rnd.choices(ids, cum_weights=weights)[0])
+    return list(chosen)
+
+
+def generate(catalog: Catalog) -> dict[str, Iterator[tuple]]:
+    """Сгенерировать строки таблиц каталога.
+
+    Args:
+        catalog: Параметры каталога.
+
+    Returns:
+        Строки по таблицам в порядке колонок COLUMNS.
+    """
+    rnd = random.Random(catalog.seed)
+    start = datetime(2021, 1, 1, tzinfo=timezone.utc)
+
+    def timestamp() -> datetime:
+        return start + timedelta(seconds=rnd.randrange(365 * 24 * 3600))
+
+    genres = [
+        (_uuid(rnd), f'Genre {n}', f'Description of genre {n}',
+         start, timestamp())
+        for n in range(catalog.genres)
+    ]
+    persons = [
+        (_uuid(rnd), f'Person {n}', start, timestamp())
+        for n in range(catalog.persons)
+    ]
+    genre_ids = [row[0] for row in genres]
+    person_ids = [row[0] for row in persons]
+    genre_weights = zipf_weights(catalog.genres, catalog.skew)
+    person_weights = zipf_weights(catalog.persons, catalog.skew)
+    films, genre_links, person_links = [], [], []
+    for n in range(catalog.films):
+        film_id = _uuid(rnd)
+        created = timestamp()
+        films.append((
+            film_id, f'Film {n}', f'Description of film {n} ' * 5,
+            created.date(), round(rnd.uniform(1, 10), 1),
+            rnd.choice(('movie', 'tv_show')), created, timestamp(),
+        ))
+        genre_count = rnd.randint(1, 2 * catalog.genres_per_film - 1)
+        for genre_id in _sample(rnd, genre_ids, genre_weights, genre_count):
+            genre_links.append((_uuid(rnd), film_id, genre_id, created))
+        cast = rnd.randint(1, 2 * catalog.cast_per_film - 1)
+        for person_id in _sample(rnd, person_ids, person_weights, cast):
+            person_links.append(
+                (_uuid(rnd), film_id, person_id, rnd.choice(ROLES), created),
+            )
+    return {
+        'film_work': iter(films),
+        'genre': iter(genres),
+        'person': iter(persons),
+        'genre_film_work': iter(genre_links),
+        'person_film_work': iter(person_links),
+    }
+
+
+COLUMNS = {
+    'film_work': (
+        'id', 'title', 'description', 'creation_date', 'rating', 'type',
+        'created', 'modified',
+    ),
+    'genre': ('id', 'name', 'description', 'created', 'modified'),
+    'person': ('id', 'full_name', 'created', 'modified'),
+    'genre_film_work': ('id', 'film_work_id', 'genre_id', 'created'),
+    'person_film_work': (
+        'id', 'film_work_id', 'person_id', 'role', 'created',
+    ),
+}
+
+
+def _copy(
+        connection: pg_connection, table: str, rows: Iterable[tuple],
+        ) -> int:
+    """Записать строки в таблицу через COPY.
+
+    Args:
+        connection: Подключение к PostgreSQL.
+        table: Таблица в схеме content.
+        rows: Строки в порядке колонок COLUMNS[table].
+
+    Returns:
+        Сколько строк записано.
+    """
+    sql = f'COPY content.{table} ({", ".join(COLUMNS[table])}) FROM STDIN'
+    total = 0
+    rows = iter(rows)
+    with connection.cursor() as cursor:
+        while chunk := list(itertools.islice(rows, COPY_CHUNK)):
+            buffer = io.StringIO(''.join(
+                '\t'.join(map(str, row)) + '\n' for row in chunk
+            ))
+            cursor.copy_expert(sql, buffer)
+            total += len(chunk)
+    return total
+
+
+def create_catalog(
+        connection: pg_connection, catalog: Catalog,
+        ) -> dict[str, int]:
+    """Пересоздать схему content и заполнить ее каталогом.
+
+    Args:
+        connection: Подключение к PostgreSQL.  Все данные схемы
+            content в этой базе удаляются.
+        catalog: Параметры каталога.
+
+    Returns:
+        Число строк по таблицам.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(SCHEMA_SQL)
+    counts = {
+        table: _copy(connection, table, rows)
+        for table, rows in generate(catalog).items()
+    }
+    with connection.cursor() as cursor:
+        cursor.execute(INDEXES_SQL)
+    return counts
+
+
+def touch(
+        connection: pg_connection, fraction: float, seed: int = 0,
+        ) -> dict[str, int]:
+    """Изменить часть каталога для инкрементальной загрузки.
+
+    Меняются доля фильмов, а также самый большой жанр и самая занятая
+    персона, у которых больше всего связанных фильмов.
+
+    Args:
+        connection: Подключение к PostgreSQL.
+        fraction: Доля фильмов, которые нужно изменить.
+        seed: Начальное значение выборки фильмов.
+
+    Returns:
+        Число измененных строк по таблицам.
+    """
+    statements = {
+        'film_work': (
+            """
+            UPDATE content.film_work SET modified = now()
+            WHERE id IN (
+                SELECT id FROM content.film_work
+                TABLESAMPLE BERNOULLI (%s) REPEATABLE (%s)
+            );
+            """,
+            (fraction * 100, seed),
+        ),
+        'genre': (
+            """
+            UPDATE content.genre SET modified = now()
+            WHERE id = (
+                SELECT genre_id FROM content.genre_film_work
+                GROUP BY genre_id ORDER BY count(*) DESC LIMIT 1
+            );
+            """,
+            (),
+        ),
+        'person': (
+            """
+            UPDATE content.person SET modified = now()
+            WHERE id = (
+                SELECT person_id FROM content.person_film_work
+                GROUP BY person_id ORDER BY count(*) DESC LIMIT 1
+            );
+            """,
+            (),
+        ),
+    }
+    counts = {}
+    with connection.cursor() as cursor:
+        for table, (sql, values) in statements.items():
+            cursor.execute(sql, values)
+            counts[table] = cursor.rowcount
+    return counts
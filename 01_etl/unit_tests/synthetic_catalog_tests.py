@@ -0,0 +1,58 @@
+from collections import Counter
+from unittest import TestCase, main
+
+from unit_tests.fake_elastic_search import bulk_items
+from unit_tests.synthetic_catalog import Catalog, generate
+
+
+def tables(catalog):
+    return {table: list(rows) for table, rows in generate(catalog).items()}
+
+
+class TestSyntheticCatalog(TestCase):
+
+    def setUp(self):
+        self.catalog = Catalog(films=500, genres=20, persons=300, seed=7)
+
+    def test_is_reproducible(self):
+        self.assertEqual(tables(self.catalog), tables(self.catalog))
+        other = tables(Catalog(films=500, genres=20, persons=300, seed=8))
+        self.assertNotEqual(tables(self.catalog)['film_work'],
+                            other['film_work'])
+
+    def test_links_are_unique_and_skewed(self):
+        data = tables(self.catalog)
+        self.assertEqual(500, len(data['film_work']))
+        for table, column in (('genre_film_work', 2),
+                              ('person_film_work', 2)):
+            links = [(row[1], row[column]) for row in data[table]]
+            self.assertEqual(len(links), len(set(links)))
+        films_per_genre = Counter(row[2] for row in data['genre_film_work'])
+        (top_genre, top_count), = films_per_genre.most_common(1)
+        self.assertEqual(data['genre'][0][0], top_genre)
+        self.assertGreater(top_count, 5 * min(films_per_genre.values()))
+        films_per_person = Counter(
+            row[2] for row in data['person_film_work']
+        )
+        self.assertGreater(films_per_person.most_common(1)[0][1], 100)
+
+
+class TestFakeElasticSearch(TestCase):
+
+    def test_acknowledges_bulk_actions(self):
+        body = (
+            b'{"index": {"_index": "movies", "_id": "1"}}\n{"title": "A"}\n'
+            b'{"delete": {"_index": "movies", "_id": "2"}}\n'
+        )
+        items = bulk_items(body)
+        self.assertEqual(
+            [('index', '1', 200), ('delete', '2', 200)],
+            [
+                (op_type, item['_id'], item['status'])
+                for op_type, item in (next(iter(i.items())) for i in items)
+            ],
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -10,65 +10,5 @@
 # Поле title содержит внутри себя ещё одно поле — title.raw. Оно нужно, чтобы у
 # Elasticsearch была возможность делать сортировку, так как он не умеет сортировать
 # данные по типу text.
-curl -XPUT http://127.0.0.1:9200/genres -H 'Content-Type: application/json' -d'
-{
-  "settings": {
-    "refresh_interval": "1s",
-    "analysis": {
-      "filter": {
-        "english_stop": {
-          "type":       "stop",
-          "stopwords":  "_english_"
-        },
-        "english_stemmer": {
-          "type": "stemmer",
-          "language": "english"
-        },
-        "english_possessive_stemmer": {
-          "type": "stemmer",
-          "language": "possessive_english"
-        },
-        "russian_stop": {
-          "type":       "stop",
-          "stopwords":  "_russian_"
-        },
-        "russian_stemmer": {
-          "type": "stemmer",
-          "language": "russian"
-        }
-      },
-      "analyzer": {
-        "ru_en": {
-          "tokenizer": "standard",
-          "filter": [
-            "lowercase",
-            "english_stop",
-            "english_stemmer",
-            "english_possessive_stemmer",
-            "russian_stop",
-            "russian_stemmer"
-          ]
-        }
-      }
-    }
-  },
-  "mappings": {
-    "dynamic": "strict",
-    "properties": {
-      "id": {
-        "type": "keyword"
-      },
-      "name": {
-        "type": "text",
-        "analyzer": "ru_en"
-      },
-      "description": {
-        "type": "text",
-        "analyzer": "ru_en"
-      },
-      "film_ids": {
-        "type": "keyword"
-      }
-    }
-  }
-}'
+curl -XPUT http://127.0.0.1:9200/genres -H 'Content-Type: application/json' \
+    -d @"$(dirname "$0")/../01_etl/load/schemas/genres.json"
@@ -1,62 +1,2 @@
-curl -XPUT http://127.0.0.1:9200/persons -H 'Content-Type: application/json' -d'
-{
-  "settings": {
-    "refresh_interval": "1s",
-    "analysis": {
-      "filter": {
-        "english_stop": {
-          "type":       "stop",
-          "stopwords":  "_english_"
-        },
-        "english_stemmer": {
-          "type": "stemmer",
-          "language": "english"
-        },
-        "english_possessive_stemmer": {
-          "type": "stemmer",
-          "language": "possessive_english"
-        },
-        "russian_stop": {
-          "type":       "stop",
-          "stopwords":  "_russian_"
-        },
-        "russian_stemmer": {
-          "type": "stemmer",
-          "language": "russian"
-        }
-      },
-      "analyzer": {
-        "ru_en": {
-          "tokenizer": "standard",
-          "filter": [
-            "lowercase",
-            "english_stop",
-            "english_stemmer",
-            "english_possessive_stemmer",
-            "russian_stop",
-            "russian_stemmer"
-          ]
-        }
-      }
-    }
-  },
-  "mappings": {
-    "dynamic": "strict",
-    "properties": {
-      "id": {
-        "type": "keyword"
-      },
-      "name": {
-        "type": "text",
-        "analyzer": "ru_en"
-      },
-      "role": {
-        "type": "text",
-        "analyzer": "ru_en"
-      },
-      "film_ids": {
-        "type": "keyword"
-      }
-    }
-  }
-}'
+curl -XPUT http://127.0.0.1:9200/persons -H 'Content-Type: application/json' \
+    -d @"$(dirname "$0")/../01_etl/load/schemas/persons.json"
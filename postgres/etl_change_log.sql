@@ -0,0 +1,96 @@
+-- Журнал изменений (outbox) для ETL.
+--
+-- Триггеры на таблицах фильмов, жанров, персон и таблицах связей
+-- записывают в content.etl_change_log по строке на каждую измененную
+-- строку с ID затронутых объектов.  ETL, запущенный с
+-- ETL_EXTRACTOR=change_log, читает журнал по порядку записей, видит
+-- в том числе удаления и удаляет прочитанные всеми индексами записи.
+--
+-- seq выдается при вставке, а транзакции фиксируются в другом порядке,
+-- поэтому читать журнал просто по seq нельзя: запись с меньшим seq
+-- может стать видна позже записи с большим.  ETL читает журнал в
+-- порядке (txid, seq) и только записи транзакций старше самой старой
+-- незавершенной (txid_snapshot_xmin).  Такие транзакции уже не
+-- добавят записей, и курсор по (txid, seq) ничего не пропустит.
+--
+-- psql -h 127.0.0.1 -U $POSTGRES_USER -d $POSTGRES_DB -f postgres/etl_change_log.sql
+
+CREATE TABLE IF NOT EXISTS content.etl_change_log (
+    seq bigserial PRIMARY KEY,
+    txid bigint NOT NULL DEFAULT txid_current(),
+    table_name text NOT NULL,
+    -- I - вставка, U - изменение, D - удаление.
+    op char(1) NOT NULL,
+    film_work_id uuid,
+    genre_id uuid,
+    person_id uuid,
+    created timestamp with time zone NOT NULL DEFAULT now()
+);
+
+CREATE INDEX IF NOT EXISTS etl_change_log_txid_seq_idx
+    ON content.etl_change_log (txid, seq);
+
+CREATE OR REPLACE FUNCTION content.etl_log_change() RETURNS trigger AS $$
+BEGIN
+    IF TG_TABLE_NAME = 'film_work' THEN
+        INSERT INTO content.etl_change_log (table_name, op, film_work_id)
+        VALUES (TG_TABLE_NAME, left(TG_OP, 1), COALESCE(NEW.id, OLD.id));
+    ELSIF TG_TABLE_NAME = 'genre' THEN
+        INSERT INTO content.etl_change_log (table_name, op, genre_id)
+        VALUES (TG_TABLE_NAME, left(TG_OP, 1), COALESCE(NEW.id, OLD.id));
+    ELSIF TG_TABLE_NAME = 'person' THEN
+        INSERT INTO content.etl_change_log (table_name, op, person_id)
+        VALUES (TG_TABLE_NAME, left(TG_OP, 1), COALESCE(NEW.id, OLD.id));
+    -- Изменение строки связи записывается как удаление старой связи
+    -- и вставка новой.
+    ELSIF TG_TABLE_NAME = 'genre_film_work' THEN
+        IF TG_OP IN ('UPDATE', 'DELETE') THEN
+            INSERT INTO content.etl_change_log
+                (table_name, op, film_work_id, genre_id)
+            VALUES (TG_TABLE_NAME, 'D', OLD.film_work_id, OLD.genre_id);
+        END IF;
+        IF TG_OP IN ('UPDATE', 'INSERT') THEN
+            INSERT INTO content.etl_change_log
+                (table_name, op, film_work_id, genre_id)
+            VALUES (TG_TABLE_NAME, 'I', NEW.film_work_id, NEW.genre_id);
+        END IF;
+    ELSIF TG_TABLE_NAME = 'person_film_work' THEN
+        IF TG_OP IN ('UPDATE', 'DELETE') THEN
+            INSERT INTO content.etl_change_log
+                (table_name, op, film_work_id, person_id)
+            VALUES (TG_TABLE_NAME, 'D', OLD.film_work_id, OLD.person_id);
+        END IF;
+        IF TG_OP IN ('UPDATE', 'INSERT') THEN
+            INSERT INTO content.etl_change_log
+                (table_name, op, film_work_id, person_id)
+            VALUES (TG_TABLE_NAME, 'I', NEW.film_work_id, NEW.person_id);
+        END IF;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS etl_log_change ON content.film_work;
+CREATE TRIGGER etl_log_change
+    AFTER INSERT OR UPDATE OR DELETE ON content.film_work
+    FOR EACH ROW EXECUTE FUNCTION content.etl_log_change();
+
+DROP TRIGGER IF EXISTS etl_log_change ON content.genre;
+CREATE TRIGGER etl_log_change
+    AFTER INSERT OR UPDATE OR DELETE ON content.genre
+    FOR EACH ROW EXECUTE FUNCTION content.etl_log_change();
+
+DROP TRIGGER IF EXISTS etl_log_change ON content.person;
+CREATE TRIGGER etl_log_change
+    AFTER INSERT OR UPDATE OR DELETE ON content.person
+    FOR EACH ROW EXECUTE FUNCTION content.etl_log_change();
+
+DROP TRIGGER IF EXISTS etl_log_change ON content.genre_film_work;
+CREATE TRIGGER etl_log_change
+    AFTER INSERT OR UPDATE OR DELETE ON content.genre_film_work
+    FOR EACH ROW EXECUTE FUNCTION content.etl_log_change();
+
+DROP TRIGGER IF EXISTS etl_log_change ON content.person_film_work;
+CREATE TRIGGER etl_log_change
+    AFTER INSERT OR UPDATE OR DELETE ON content.person_film_work
+    FOR EACH ROW EXECUTE FUNCTION content.etl_log_change();
@@ -0,0 +1,21 @@
+-- Индексы для сканирования таблиц ETL.
+--
+-- В режиме ETL_EXTRACTOR=scan ETL читает фильмы, жанры и персоны в
+-- порядке (modified, id) строго после курсора последней обработанной
+-- строки.  С индексом по (modified, id) каждый запрос начинает чтение
+-- с курсора, без него - сортирует всю таблицу заново.
+--
+-- CONCURRENTLY не блокирует запись в таблицы, поэтому файл можно
+-- применить к работающей базе.  Такие индексы нельзя строить внутри
+-- транзакции, не запускайте файл с psql --single-transaction.
+--
+-- psql -h 127.0.0.1 -U $POSTGRES_USER -d $POSTGRES_DB -f postgres/etl_indexes.sql
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS film_work_modified_id_idx
+    ON content.film_work (modified, id);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS genre_modified_id_idx
+    ON content.genre (modified, id);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS person_modified_id_idx
+    ON content.person (modified, id);
@@ -0,0 +1,42 @@
+-- Уведомления ETL об изменениях в схеме content.
+--
+-- После каждого изменяющего запроса к таблицам фильмов, жанров,
+-- персон и таблицам связей в канал etl_changes отправляется имя
+-- таблицы.  ETL, запущенный с ETL_LISTEN=true, просыпается и сразу
+-- загружает только затронутые индексы.  Уведомления отправляются
+-- после фиксации транзакции, а одинаковые уведомления одной
+-- транзакции PostgreSQL сворачивает в одно.
+--
+-- psql -h 127.0.0.1 -U $POSTGRES_USER -d $POSTGRES_DB -f postgres/etl_notify.sql
+
+CREATE OR REPLACE FUNCTION content.etl_notify() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('etl_changes', TG_TABLE_NAME);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS etl_notify ON content.film_work;
+CREATE TRIGGER etl_notify
+    AFTER INSERT OR UPDATE OR DELETE ON content.film_work
+    FOR EACH STATEMENT EXECUTE FUNCTION content.etl_notify();
+
+DROP TRIGGER IF EXISTS etl_notify ON content.genre;
+CREATE TRIGGER etl_notify
+    AFTER INSERT OR UPDATE OR DELETE ON content.genre
+    FOR EACH STATEMENT EXECUTE FUNCTION content.etl_notify();
+
+DROP TRIGGER IF EXISTS etl_notify ON content.person;
+CREATE TRIGGER etl_notify
+    AFTER INSERT OR UPDATE OR DELETE ON content.person
+    FOR EACH STATEMENT EXECUTE FUNCTION content.etl_notify();
+
+DROP TRIGGER IF EXISTS etl_notify ON content.genre_film_work;
+CREATE TRIGGER etl_notify
+    AFTER INSERT OR UPDATE OR DELETE ON content.genre_film_work
+    FOR EACH STATEMENT EXECUTE FUNCTION content.etl_notify();
+
+DROP TRIGGER IF EXISTS etl_notify ON content.person_film_work;
+CREATE TRIGGER etl_notify
+    AFTER INSERT OR UPDATE OR DELETE ON content.person_film_work
+    FOR EACH STATEMENT EXECUTE FUNCTION content.etl_notify();